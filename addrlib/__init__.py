@@ -12,13 +12,30 @@ try:
     pyximport.install()
 
     from . import addrlib_cy as addrlib
+    swizzler = addrlib
+    addrMapCache = None
 
 except:
     from . import addrlib
 
+    # The per-pixel Python path is very slow,
+    # use the NumPy engine instead if available
+    try:
+        from . import addrlib_np as swizzler
+
+    except ImportError:
+        swizzler = addrlib
+        addrMapCache = None
+
+    else:
+        # Address maps of recently used surface geometries,
+        # use addrMapCache.getStats() to get the hit/miss counters
+        addrMapCache = swizzler.addrMapCache
+
 # Define the functions that can be used
 getDefaultGX2TileMode = addrlib.getDefaultGX2TileMode
-deswizzle = addrlib.deswizzle
-swizzle = addrlib.swizzle
+deswizzle = swizzler.deswizzle
+swizzle = swizzler.swizzle
+getSurfaceAddrs = swizzler.getSurfaceAddrs
 surfaceGetBitsPerPixel = addrlib.surfaceGetBitsPerPixel
 getSurfaceInfo = addrlib.getSurfaceInfo
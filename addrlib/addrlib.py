@@ -8,6 +8,11 @@
 ################################################################
 ################################################################
 
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+
 BCn_formats = [
     0x31, 0x431, 0x32, 0x432,
     0x33, 0x433, 0x34, 0x234,
@@ -59,7 +64,7 @@ def GX2TileModeToAddrTileMode(tileMode):
 
 
 def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
-                pitch, bitsPerPixel, slice, sample, data, dataSize, swizzle):
+                pitch, bitsPerPixel, slice, sample, data, dataSize, result, firstRow, numRows, swizzle):
 
     """
     width: width of the surface
@@ -72,23 +77,49 @@ def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
     swizzle_: swizzle of the surface (GX2Surface.swizzle)
     pitch: aligned width of the surface (can be calculated using getSurfaceInfo())
     bitsPerPixel: bits per element for the given format (use surfaceGetBitsPerPixel())
-    data: data to be (un)swizzled
+    data: data to be (un)swizzled (any buffer)
+    result: writable buffer the (un)swizzled data will be written to, elements that don't fit are skipped
+    firstRow, numRows: rows of pixels to (un)swizzle, the linear data only holds these rows
     swizzle: boolen where the data will be swizzled if true, otherwise unswizzled
     """
 
     bytesPerPixel = bitsPerPixel // 8
-    result = bytearray(len(data))
 
     if format_ in BCn_formats:
         width = (width + 3) // 4
         height = (height + 3) // 4
+        firstRow, numRows = firstRow // 4, (numRows + 3) // 4
+
+    rowStart = firstRow
+    rowEnd = min(height, firstRow + numRows)
+
+    # Elements must be within the source data and the result buffer
+    if swizzle:
+        linearSize = dataSize
+        tiledSize = min(dataSize, len(result))
+
+    else:
+        linearSize = max(0, min(dataSize - rowStart * width * bytesPerPixel, len(result)))
+        tiledSize = dataSize
 
     pipeSwizzle = (swizzle_ >> 8) & 1
     bankSwizzle = (swizzle_ >> 9) & 3
 
     tileMode = GX2TileModeToAddrTileMode(tileMode)
 
-    for y in range(height):
+    if tileMode in [0, 1] and bytesPerPixel:
+        swizzleSurfLinear(width, height, depth, bytesPerPixel, pitch, slice, sample, data,
+                          linearSize, tiledSize, result, rowStart, rowEnd, swizzle)
+
+        return result
+
+    if tileMode not in [0, 1] and not isSampleSplit(tileMode, bitsPerPixel, 1 << aa):
+        swizzleSurfMicroTiles(width, height, aa, use, tileMode, pipeSwizzle, bankSwizzle, pitch, bitsPerPixel,
+                              slice, sample, data, linearSize, tiledSize, result, rowStart, rowEnd, swizzle)
+
+        return result
+
+    for y in range(rowStart, rowEnd):
         for x in range(width):
             if tileMode in [0, 1]:
                 pos = computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
@@ -100,30 +131,170 @@ def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
                 pos = computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
                                                             tileMode, bool(use & 4), pipeSwizzle, bankSwizzle)
 
-            pos_ = (y * width + x) * bytesPerPixel
+            pos_ = ((y - rowStart) * width + x) * bytesPerPixel
 
-            if pos_ + bytesPerPixel <= len(data) and pos + bytesPerPixel <= len(data):
+            if pos_ + bytesPerPixel <= linearSize and pos + bytesPerPixel <= tiledSize:
                 if swizzle == 0:
                     result[pos_:pos_ + bytesPerPixel] = data[pos:pos + bytesPerPixel]
 
                 else:
                     result[pos:pos + bytesPerPixel] = data[pos_:pos_ + bytesPerPixel]
 
-    return bytes(result)
+    return result
+
+
+def swizzleSurfLinear(width, height, depth, bytesPerPixel, pitch, slice, sample, data,
+                      linearSize, tiledSize, result, rowStart, rowEnd, swizzle):
+
+    """
+    (Un)swizzles a linear surface one row at a time,
+    its rows are the same as in the linear data, only padded to pitch.
+    """
+
+    sliceOffset = pitch * height * (slice + sample * depth)
+    rowSize = width * bytesPerPixel
+
+    for y in range(rowStart, rowEnd):
+        pos = (y * pitch + sliceOffset) * bytesPerPixel
+        pos_ = (y - rowStart) * rowSize
+
+        # Only the elements that fit are moved, none of the next rows fit if this one doesn't
+        size = min(rowSize, (linearSize - pos_) // bytesPerPixel * bytesPerPixel,
+                   (tiledSize - pos) // bytesPerPixel * bytesPerPixel)
+
+        if size <= 0:
+            break
+
+        if swizzle == 0:
+            result[pos_:pos_ + size] = data[pos:pos + size]
+
+        else:
+            result[pos:pos + size] = data[pos_:pos_ + size]
+
+
+def swizzleSurfMicroTiles(width, height, aa, use, tileMode, pipeSwizzle, bankSwizzle, pitch, bitsPerPixel,
+                          slice, sample, data, linearSize, tiledSize, result, rowStart, rowEnd, swizzle):
+
+    """
+    (Un)swizzles a tiled surface one micro tile at a time.
+    Only one address is computed per 8x8 micro tile,
+    the pixels are then placed using the offsets from computeMicroTilePixelOffsets().
+    Not usable for linear tileModes or if the samples of a micro tile are split (see isSampleSplit()).
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+    isDepth = bool(use & 4)
+    numSamples = 1 << aa
+
+    pixelOffsets = computeMicroTilePixelOffsets(slice, sample, bitsPerPixel, numSamples, tileMode, isDepth)
+
+    for tileY in range(rowStart & ~7, rowEnd, 8):
+        for tileX in range(0, width, 8):
+            if tileMode in [2, 3]:
+                tileAddr = computeMicroTileAddrMicroTiled(tileX, tileY, slice, bitsPerPixel, pitch, height, tileMode)
+                pixelAddrs = [tileAddr + offset for offset in pixelOffsets]
+
+            else:
+                bankPipe, tileOffset = computeMicroTileAddrMacroTiled(tileX, tileY, slice, bitsPerPixel, pitch, height,
+                                                                      numSamples, tileMode, pipeSwizzle, bankSwizzle)
+
+                pixelAddrs = []
+                for offset in pixelOffsets:
+                    totalOffset = tileOffset + offset
+                    pixelAddrs.append(bankPipe | totalOffset & 255 | (totalOffset & -256) << 3)
+
+            for y in range(max(tileY, rowStart), min(tileY + 8, rowEnd)):
+                row = (y - tileY) * 8 - tileX
+
+                for x in range(tileX, min(tileX + 8, width)):
+                    pos = pixelAddrs[row + x]
+                    pos_ = ((y - rowStart) * width + x) * bytesPerPixel
+
+                    if pos_ + bytesPerPixel <= linearSize and pos + bytesPerPixel <= tiledSize:
+                        if swizzle == 0:
+                            result[pos_:pos_ + bytesPerPixel] = data[pos:pos + bytesPerPixel]
+
+                        else:
+                            result[pos:pos + bytesPerPixel] = data[pos_:pos_ + bytesPerPixel]
 
 
 def deswizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
-              pitch, bpp, slice, sample, data):
+              pitch, bpp, slice, sample, data, result=None, firstRow=0, numRows=None):
+
+    """
+    firstRow, numRows: deswizzle only these rows of pixels (a band of the surface) to the result,
+                       firstRow must be a multiple of 4 for BCn formats
+    """
+
+    if numRows is None:
+        numRows = height - firstRow
+
+    if result is None:
+        result = bytearray(len(data))
 
     return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, data, len(data), False)
+                       slice, sample, data, len(data), result, firstRow, numRows, False)
 
 
 def swizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
-            pitch, bpp, slice, sample, data):
+            pitch, bpp, slice, sample, data, result=None):
+
+    if result is None:
+        result = bytearray(len(data))
 
     return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, data, len(data), True)
+                       slice, sample, data, len(data), result, 0, height, True)
+
+
+def getSurfaceAddrs(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bpp, slice, sample, dataSize, firstRow=0, numRows=None):
+
+    """
+    Computes the address in the swizzled data of every element (pixel or BCn block) of a surface,
+    in the order of the elements in the deswizzled data, so that they can be read without deswizzling.
+    Elements that are out of the data (of size dataSize) get the address 0xFFFFFFFF.
+    firstRow, numRows: only compute the addresses of these rows of pixels
+    """
+
+    if numRows is None:
+        numRows = height - firstRow
+
+    bytesPerPixel = bpp // 8
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+        firstRow, numRows = firstRow // 4, (numRows + 3) // 4
+
+    rowStart = firstRow
+    rowEnd = min(height, firstRow + numRows)
+
+    linearSize = dataSize - rowStart * width * bytesPerPixel
+    addrs = array('I', [0xFFFFFFFF]) * (max(0, rowEnd - rowStart) * width)
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    for y in range(rowStart, rowEnd):
+        for x in range(width):
+            if tileMode in [0, 1]:
+                pos = computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+            elif tileMode in [2, 3]:
+                pos = computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bpp, pitch, height, tileMode, bool(use & 4))
+
+            else:
+                pos = computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bpp, pitch, height, 1 << aa,
+                                                            tileMode, bool(use & 4), pipeSwizzle, bankSwizzle)
+
+            i = (y - rowStart) * width + x
+
+            if (i + 1) * bytesPerPixel <= linearSize and pos + bytesPerPixel <= dataSize:
+                addrs[i] = pos
+
+    return addrs
 
 
 formatHwInfo = [
@@ -179,13 +350,38 @@ def computeSurfaceThickness(tileMode):
     return 1
 
 
+# Pixel index within a micro tile for every (z & (thickness - 1), y & 7, x & 7),
+# built on first use for every bpp/thickness/isDepth combination
+microTilePixelIndexTables = {}
+
+
+def getMicroTilePixelIndexTable(bpp, thickness, isDepth):
+    key = (bpp, thickness, bool(isDepth))
+
+    table = microTilePixelIndexTables.get(key)
+    if table is None:
+        table = tuple(
+            computePixelIndexFromBits(x, y, z, bpp, thickness, isDepth)
+            for z in range(thickness) for y in range(8) for x in range(8)
+        )
+
+        microTilePixelIndexTables[key] = table
+
+    return table
+
+
 def computePixelIndexWithinMicroTile(x, y, z, bpp, tileMode, isDepth):
+    thickness = computeSurfaceThickness(tileMode)
+    table = getMicroTilePixelIndexTable(bpp, thickness, isDepth)
+
+    return table[(z & (thickness - 1)) << 6 | (y & 7) << 3 | x & 7]
+
+
+def computePixelIndexFromBits(x, y, z, bpp, thickness, isDepth):
     pixelBit6 = 0
     pixelBit7 = 0
     pixelBit8 = 0
 
-    thickness = computeSurfaceThickness(tileMode)
-
     if isDepth:
         pixelBit0 = x & 1
         pixelBit1 = y & 1
@@ -445,9 +641,114 @@ def computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bpp, pitch, heigh
     return bank << 9 | pipe << 8 | totalOffset & 255 | (totalOffset & -256) << 3
 
 
-expPitch = 0
-expHeight = 0
-expNumSlices = 0
+def isSampleSplit(tileMode, bpp, numSamples):
+    microTileBytes = (numSamples * bpp * (computeSurfaceThickness(tileMode) * 64) + 7) // 8
+    return numSamples > 1 and microTileBytes > 2048 and tileMode not in [0, 1, 2, 3]
+
+
+def computeMicroTilePixelOffsets(slice, sample, bpp, numSamples, tileMode, isDepth):
+    """
+    Returns the byte offsets of the 64 pixels of a micro tile (in row-major order),
+    relative to the address of the micro tile.
+    """
+
+    pixelOffsets = []
+
+    for y in range(8):
+        for x in range(8):
+            pixelIndex = computePixelIndexWithinMicroTile(x, y, slice, bpp, tileMode, isDepth)
+
+            if tileMode in [2, 3]:
+                pixelOffsets.append((bpp * pixelIndex) >> 3)
+
+            elif isDepth:
+                pixelOffsets.append((numSamples * bpp * pixelIndex + bpp * sample + 7) // 8)
+
+            else:
+                microTileBits = numSamples * bpp * (computeSurfaceThickness(tileMode) * 64)
+                pixelOffsets.append((bpp * pixelIndex + sample * (microTileBits // numSamples) + 7) // 8)
+
+    return pixelOffsets
+
+
+def computeMicroTileAddrMicroTiled(x, y, slice, bpp, pitch, height, tileMode):
+    """
+    Same as computeSurfaceAddrFromCoordMicroTiled(), without the offset of the pixel within the micro tile.
+    """
+
+    microTileThickness = 1
+    if tileMode == 3:
+        microTileThickness = 4
+
+    microTileBytes = (64 * microTileThickness * bpp + 7) // 8
+    microTilesPerRow = pitch >> 3
+    microTileIndexX = x >> 3
+    microTileIndexY = y >> 3
+    microTileIndexZ = slice // microTileThickness
+
+    microTileOffset = microTileBytes * (microTileIndexX + microTileIndexY * microTilesPerRow)
+    sliceBytes = (pitch * height * microTileThickness * bpp + 7) // 8
+    sliceOffset = microTileIndexZ * sliceBytes
+
+    return microTileOffset + sliceOffset
+
+
+def computeMicroTileAddrMacroTiled(x, y, slice, bpp, pitch, height,
+                                   numSamples, tileMode, pipeSwizzle, bankSwizzle):
+
+    """
+    Same as computeSurfaceAddrFromCoordMacroTiled(), without the offset of the pixel within the micro tile.
+    Returns the bank/pipe bits of the address and the offset of the micro tile,
+    the address of a pixel with the offset elemOffset in the micro tile is then:
+    bankPipe | totalOffset & 255 | (totalOffset & -256) << 3, where totalOffset = elemOffset + tileOffset
+    Only valid if the samples of the micro tile are not split (see isSampleSplit()).
+    """
+
+    microTileThickness = computeSurfaceThickness(tileMode)
+
+    pipe = computePipeFromCoordWoRotation(x, y)
+    bank = computeBankFromCoordWoRotation(x, y)
+
+    swizzle_ = pipeSwizzle + 2 * bankSwizzle
+    bankPipe = pipe + 2 * bank
+    rotation = computeSurfaceRotationFromTileMode(tileMode)
+    sliceIn = slice
+
+    if isThickMacroTiled(tileMode):
+        sliceIn >>= 2
+
+    bankPipe ^= swizzle_ + sliceIn * rotation
+    bankPipe %= 8
+    pipe = bankPipe % 2
+    bank = bankPipe // 2
+
+    sliceBytes = (height * pitch * microTileThickness * bpp * numSamples + 7) // 8
+    sliceOffset = sliceBytes * (slice // microTileThickness)
+
+    macroTilePitch = 32
+    macroTileHeight = 16
+
+    if tileMode in [5, 9]:  # GX2_TILE_MODE_2D_TILED_THIN2 and GX2_TILE_MODE_2B_TILED_THIN2
+        macroTilePitch = 16
+        macroTileHeight = 32
+
+    elif tileMode in [6, 10]:  # GX2_TILE_MODE_2D_TILED_THIN4 and GX2_TILE_MODE_2B_TILED_THIN4
+        macroTilePitch = 8
+        macroTileHeight = 64
+
+    macroTilesPerRow = pitch // macroTilePitch
+    macroTileBytes = (numSamples * microTileThickness * bpp * macroTileHeight
+                      * macroTilePitch + 7) // 8
+    macroTileIndexX = x // macroTilePitch
+    macroTileIndexY = y // macroTileHeight
+    macroTileOffset = (macroTileIndexX + macroTilesPerRow * macroTileIndexY) * macroTileBytes
+
+    if isBankSwappedTileMode(tileMode):
+        bankSwapWidth = computeSurfaceBankSwappedWidth(tileMode, bpp, numSamples, pitch)
+        swapIndex = macroTilePitch * macroTileIndexX // bankSwapWidth
+        bank ^= bankSwapOrder[swapIndex & 3]
+
+    return bank << 9 | pipe << 8, (macroTileOffset + sliceOffset) >> 3
 
 
 class Flags:
@@ -508,8 +809,56 @@ class surfaceOut:
         self.tileIndex = 0
 
 
-pIn = surfaceIn()
-pOut = surfaceOut()
+# Immutable copies of tileInfo and surfaceOut, returned by getSurfaceInfo()
+SurfaceTileInfo = namedtuple('SurfaceTileInfo', [
+    'banks', 'bankWidth', 'bankHeight', 'macroAspectRatio', 'tileSplitBytes', 'pipeConfig'
+])
+
+SurfaceInfo = namedtuple('SurfaceInfo', [
+    'size', 'pitch', 'height', 'depth', 'surfSize', 'tileMode', 'baseAlign', 'pitchAlign',
+    'heightAlign', 'depthAlign', 'bpp', 'pixelPitch', 'pixelHeight', 'pixelBits', 'sliceSize',
+    'pitchTileMax', 'heightTileMax', 'sliceTileMax', 'pTileInfo', 'tileType', 'tileIndex'
+])
+
+# Max number of surface descriptors kept by getSurfaceInfo()
+# (one per format/size/tileMode/level combination),
+# fixed when the module is imported, changing it afterwards has no effect
+_surfaceInfoCacheSize = 512
+
+
+def surfaceOutToSurfaceInfo(pSurfOut):
+    pTileInfo = pSurfOut.pTileInfo
+
+    return SurfaceInfo(
+        pSurfOut.size,
+        pSurfOut.pitch,
+        pSurfOut.height,
+        pSurfOut.depth,
+        pSurfOut.surfSize,
+        pSurfOut.tileMode,
+        pSurfOut.baseAlign,
+        pSurfOut.pitchAlign,
+        pSurfOut.heightAlign,
+        pSurfOut.depthAlign,
+        pSurfOut.bpp,
+        pSurfOut.pixelPitch,
+        pSurfOut.pixelHeight,
+        pSurfOut.pixelBits,
+        pSurfOut.sliceSize,
+        pSurfOut.pitchTileMax,
+        pSurfOut.heightTileMax,
+        pSurfOut.sliceTileMax,
+        SurfaceTileInfo(
+            pTileInfo.banks,
+            pTileInfo.bankWidth,
+            pTileInfo.bankHeight,
+            pTileInfo.macroAspectRatio,
+            pTileInfo.tileSplitBytes,
+            pTileInfo.pipeConfig,
+        ),
+        pSurfOut.tileType,
+        pSurfOut.tileIndex,
+    )
 
 
 def powTwoAlign(x, align):
@@ -534,7 +883,7 @@ def getBitsPerPixel(format_):
             formatExInfo[fmtIdx + 2], formatExInfo[fmtIdx + 3])
 
 
-def adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height):
+def adjustSurfaceInfo(pIn, elemMode, expandX, expandY, bpp, width, height):
     bBCnFormat = 0
     if bpp and elemMode in [9, 10, 11, 12, 13]:
         bBCnFormat = 1
@@ -583,7 +932,7 @@ def adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height):
     return 0
 
 
-def hwlComputeMipLevel():
+def hwlComputeMipLevel(pIn):
     handled = 0
 
     if 49 <= pIn.format <= 55:
@@ -612,7 +961,7 @@ def hwlComputeMipLevel():
     return handled
 
 
-def computeMipLevel():
+def computeMipLevel(pIn):
     slices = 0
     height = 0
     width = 0
@@ -622,7 +971,7 @@ def computeMipLevel():
         pIn.width = powTwoAlign(pIn.width, 4)
         pIn.height = powTwoAlign(pIn.height, 4)
 
-    hwlHandled = hwlComputeMipLevel()
+    hwlHandled = hwlComputeMipLevel(pIn)
     if not hwlHandled and pIn.mipLevel and (pIn.flags.value >> 12) & 1:
         width = max(1, pIn.width >> pIn.mipLevel)
         height = max(1, pIn.height >> pIn.mipLevel)
@@ -769,11 +1118,7 @@ def computeSurfaceMipLevelTileMode(baseTileMode, bpp, level, width, height, numS
         1)
 
 
-def padDimensions(tileMode, padDims, isCube, pitchAlign, heightAlign, sliceAlign):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def padDimensions(expPitch, expHeight, expNumSlices, tileMode, padDims, isCube, pitchAlign, heightAlign, sliceAlign):
     thickness = computeSurfaceThickness(tileMode)
     if not padDims:
         padDims = 3
@@ -828,11 +1173,7 @@ def computeSurfaceAlignmentsLinear(tileMode, bpp, flags):
     return baseAlign, pitchAlign, heightAlign
 
 
-def computeSurfaceInfoLinear(tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def computeSurfaceInfoLinear(pOut, tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
     expPitch = pitch
     expHeight = height
     expNumSlices = numSlices
@@ -863,6 +1204,9 @@ def computeSurfaceInfoLinear(tileMode, bpp, numSamples, pitch, height, numSlices
             expNumSlices = nextPow2(numSlices)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         tileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -900,11 +1244,7 @@ def computeSurfaceAlignmentsMicroTiled(tileMode, bpp, flags, numSamples):
     return baseAlign, pitchAlign, heightAlign
 
 
-def computeSurfaceInfoMicroTiled(tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def computeSurfaceInfoMicroTiled(pOut, tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
     expTileMode = tileMode
     expPitch = pitch
     expHeight = height
@@ -939,6 +1279,9 @@ def computeSurfaceInfoMicroTiled(tileMode, bpp, numSamples, pitch, height, numSl
         numSamples)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         expTileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -991,11 +1334,7 @@ def computeSurfaceAlignmentsMacroTiled(tileMode, bpp, flags, numSamples):
     return baseAlign, pitchAlign, heightAlign, macroTileWidth, macroTileHeight
 
 
-def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def computeSurfaceInfoMacroTiled(pOut, tileMode, baseTileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
     expPitch = pitch
     expHeight = height
     expNumSlices = numSlices
@@ -1035,6 +1374,9 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
             pitchAlign = bankSwappedWidth
 
         expPitch, expHeight, expNumSlices = padDimensions(
+            expPitch,
+            expHeight,
+            expNumSlices,
             tileMode,
             padDims,
             (flags.value >> 4) & 1,
@@ -1066,6 +1408,7 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
             expTileMode = 2
 
             result = computeSurfaceInfoMicroTiled(
+                pOut,
                 2,
                 bpp,
                 numSamples,
@@ -1088,6 +1431,9 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
                 pitchAlign = bankSwappedWidth
 
             expPitch, expHeight, expNumSlices = padDimensions(
+                expPitch,
+                expHeight,
+                expNumSlices,
                 tileMode,
                 padDims,
                 (flags.value >> 4) & 1,
@@ -1109,7 +1455,7 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
     return result
 
 
-def ComputeSurfaceInfoEx():
+def ComputeSurfaceInfoEx(pIn, pOut):
     tileMode = pIn.tileMode
     bpp = pIn.bpp
     numSamples = max(1, pIn.numSamples)
@@ -1143,6 +1489,7 @@ def ComputeSurfaceInfoEx():
 
     if tileMode in [0, 1]:
         valid = computeSurfaceInfoLinear(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1157,6 +1504,7 @@ def ComputeSurfaceInfoEx():
 
     elif tileMode in [2, 3]:
         valid = computeSurfaceInfoMicroTiled(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1169,6 +1517,7 @@ def ComputeSurfaceInfoEx():
 
     elif tileMode in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]:
         valid = computeSurfaceInfoMacroTiled(
+            pOut,
             tileMode,
             baseTileMode,
             bpp,
@@ -1186,7 +1535,7 @@ def ComputeSurfaceInfoEx():
     return 0
 
 
-def restoreSurfaceInfo(elemMode, expandX, expandY, bpp):
+def restoreSurfaceInfo(pOut, elemMode, expandX, expandY, bpp):
     if pOut.pixelPitch and pOut.pixelHeight:
         width = pOut.pixelPitch
         height = pOut.pixelHeight
@@ -1221,13 +1570,7 @@ def restoreSurfaceInfo(elemMode, expandX, expandY, bpp):
     return 0
 
 
-def computeSurfaceInfo(aSurfIn, pSurfOut):
-    global pIn
-    global pOut
-
-    pIn = aSurfIn
-    pOut = pSurfOut
-
+def computeSurfaceInfo(pIn, pOut):
     returnCode = 0
     elemMode = 0
 
@@ -1235,7 +1578,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
         returnCode = 3
 
     if returnCode == 0:
-        computeMipLevel()
+        computeMipLevel(pIn)
 
         width = pIn.width
         height = pIn.height
@@ -1251,7 +1594,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             if elemMode == 4 and expandX == 3 and pIn.tileMode == 1:
                 pIn.flags.value |= 0x200
 
-            bpp = adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height)
+            bpp = adjustSurfaceInfo(pIn, elemMode, expandX, expandY, bpp, width, height)
 
         elif pIn.bpp:
             pIn.width = max(1, pIn.width)
@@ -1261,7 +1604,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             returnCode = 3
 
         if returnCode == 0:
-            returnCode = ComputeSurfaceInfoEx()
+            returnCode = ComputeSurfaceInfoEx(pIn, pOut)
 
         if returnCode == 0:
             pOut.bpp = pIn.bpp
@@ -1269,7 +1612,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             pOut.pixelHeight = pOut.height
 
             if pIn.format and (not (pIn.flags.value >> 9) & 1 or not pIn.mipLevel):
-                bpp = restoreSurfaceInfo(elemMode, expandX, expandY, bpp)
+                bpp = restoreSurfaceInfo(pOut, elemMode, expandX, expandY, bpp)
 
             if (pIn.flags.value >> 5) & 1:
                 pOut.sliceSize = pOut.surfSize
@@ -1285,6 +1628,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             pOut.sliceTileMax = (pOut.height * pOut.pitch >> 6) - 1
 
 
+@lru_cache(maxsize=_surfaceInfoCacheSize)
 def getSurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, surfaceDim, surfaceTileMode, surfaceAA, level):
     """
     surfaceFormat: format of the surface (GX2SurfaceFormat)
@@ -1295,6 +1639,9 @@ def getSurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, sur
     surfaceTileMode: GX2TileMode (note: NOT AddrTileMode)
     surfaceAA: AA mode of the surface (GX2AAMode)
     level: mip level of which the info will be calculated for (first mipmap corresponds to value 1)
+
+    Results are memoized, the returned SurfaceInfo is immutable and shared between callers.
+    Use getSurfaceInfo.cache_info() / getSurfaceInfo.cache_clear() to inspect or reset the cache.
     """
 
     dim = 0
@@ -1417,9 +1764,7 @@ def getSurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, sur
         pSurfOut.size = 96
         computeSurfaceInfo(aSurfIn, pSurfOut)
 
-        pSurfOut = pOut
-
     if not pSurfOut.tileMode:
         pSurfOut.tileMode = 16
 
-    return pSurfOut
+    return surfaceOutToSurfaceInfo(pSurfOut)
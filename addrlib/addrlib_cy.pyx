@@ -8,10 +8,15 @@
 ################################################################
 ################################################################
 
+from collections import namedtuple
+from functools import lru_cache
+
 from cpython cimport array
+from libc.string cimport memcpy
 
 
 ctypedef unsigned char u8
+ctypedef unsigned short u16
 ctypedef unsigned int u32
 ctypedef long long int64
 ctypedef unsigned long long u64
@@ -68,8 +73,9 @@ cdef u32 GX2TileModeToAddrTileMode(u32 tileMode):
     return tileMode
 
 
-cdef bytes swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
-                       u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, u8 *data, u32 dataSize, int swizzle):
+cdef void swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                      u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, const u8 *data, u32 dataSize,
+                      u8 *result, u32 resultSize, u32 firstRow, u32 numRows, int swizzle):
 
     """
     width: width of the surface
@@ -83,66 +89,272 @@ cdef bytes swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u3
     pitch: aligned width of the surface (can be calculated using getSurfaceInfo())
     bitsPerPixel: bits per element for the given format (use surfaceGetBitsPerPixel())
     data: data to be (un)swizzled
+    result: buffer the (un)swizzled data will be written to, elements that don't fit are skipped
+    firstRow, numRows: rows of pixels to (un)swizzle, the linear data only holds these rows
     swizzle: boolen where the data will be swizzled if true, otherwise unswizzled
     """
 
     cdef:
         u32 bytesPerPixel = bitsPerPixel // 8
-        bytearray result = bytearray(dataSize)
+        u32 linearSize, tiledSize, rowStart, rowEnd
+        u64 linearOffset
 
         u32 pipeSwizzle, bankSwizzle, y, x, pos, pos_, n
 
     if format_ in BCn_formats:
         width = (width + 3) // 4
         height = (height + 3) // 4
+        firstRow, numRows = firstRow // 4, (numRows + 3) // 4
+
+    rowStart = firstRow
+    rowEnd = min(height, <u64>firstRow + numRows)
+
+    # Elements must be within the source data and the result buffer
+    if swizzle:
+        linearSize = dataSize
+        tiledSize = min(dataSize, resultSize)
+
+    else:
+        linearOffset = <u64>rowStart * width * bytesPerPixel
+        linearSize = min(dataSize - linearOffset, resultSize) if linearOffset < dataSize else 0
+        tiledSize = dataSize
 
     pipeSwizzle = (swizzle_ >> 8) & 1
     bankSwizzle = (swizzle_ >> 9) & 3
 
     tileMode = GX2TileModeToAddrTileMode(tileMode)
 
-    for y in range(height):
-        for x in range(width):
-            if tileMode in [0, 1]:
-                pos = <u32>computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+    # The GIL is released while (un)swizzling, so that other threads can work on other bands
+    with nogil:
+        if tileMode in [0, 1] and bytesPerPixel:
+            swizzleSurfLinear(width, height, depth, bytesPerPixel, pitch, slice, sample, data,
+                              linearSize, tiledSize, result, rowStart, rowEnd, swizzle)
 
-            elif tileMode in [2, 3]:
-                pos = <u32>computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, use & 4)
+            return
 
-            else:
-                pos = <u32>computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
-                                                                 tileMode, use & 4, pipeSwizzle, bankSwizzle)
+        if tileMode not in [0, 1] and not isSampleSplit(tileMode, bitsPerPixel, 1 << aa):
+            swizzleSurfMicroTiles(width, height, aa, use, tileMode, pipeSwizzle, bankSwizzle, pitch, bitsPerPixel,
+                                  slice, sample, data, linearSize, tiledSize, result, rowStart, rowEnd, swizzle)
+
+            return
 
-            pos_ = (y * width + x) * bytesPerPixel
+        for y in range(rowStart, rowEnd):
+            for x in range(width):
+                if tileMode in [0, 1]:
+                    pos = <u32>computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
 
-            if pos_ + bytesPerPixel <= dataSize and pos + bytesPerPixel <= dataSize:
-                if swizzle == 0:
-                    for n in range(bytesPerPixel):
-                        result[pos_ + n] = <u8>data[pos + n]
+                elif tileMode in [2, 3]:
+                    pos = <u32>computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, use & 4)
 
                 else:
-                    for n in range(bytesPerPixel):
-                        result[pos + n] = <u8>data[pos_ + n]
+                    pos = <u32>computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
+                                                                     tileMode, use & 4, pipeSwizzle, bankSwizzle)
 
-    return bytes(result)
+                pos_ = ((y - rowStart) * width + x) * bytesPerPixel
 
+                if pos_ + bytesPerPixel <= linearSize and pos + bytesPerPixel <= tiledSize:
+                    if swizzle == 0:
+                        for n in range(bytesPerPixel):
+                            result[pos_ + n] = data[pos + n]
 
-cpdef bytes deswizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
-                      u32 pitch, u32 bpp, u32 slice, u32 sample, bytes data):
+                    else:
+                        for n in range(bytesPerPixel):
+                            result[pos + n] = data[pos_ + n]
+
+
+cdef void swizzleSurfLinear(u32 width, u32 height, u32 depth, u32 bytesPerPixel, u32 pitch, u32 slice, u32 sample,
+                           const u8 *data, u32 linearSize, u32 tiledSize, u8 *result, u32 rowStart, u32 rowEnd,
+                           int swizzle) noexcept nogil:
+
+    """
+    (Un)swizzles a linear surface one row at a time,
+    its rows are the same as in the linear data, only padded to pitch.
+    """
+
+    cdef:
+        u64 sliceOffset = <u64>pitch * height * (slice + sample * depth)
+        u64 rowSize = <u64>width * bytesPerPixel
+        u64 pos, pos_, size
+        u32 y
 
-    cdef array.array dataArr = array.array('B', data)
+    for y in range(rowStart, rowEnd):
+        pos = (<u64>y * pitch + sliceOffset) * bytesPerPixel
+        pos_ = <u64>(y - rowStart) * rowSize
 
-    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, dataArr.data.as_uchars, len(data), 0)
+        # Only the elements that fit are moved, none of the next rows fit if this one doesn't
+        if pos_ >= linearSize or pos >= tiledSize:
+            break
+
+        size = min(rowSize, (linearSize - pos_) // bytesPerPixel * bytesPerPixel,
+                   (tiledSize - pos) // bytesPerPixel * bytesPerPixel)
+
+        if not size:
+            break
+
+        if swizzle == 0:
+            memcpy(result + pos_, data + pos, size)
+
+        else:
+            memcpy(result + pos, data + pos_, size)
+
+
+cdef void swizzleSurfMicroTiles(u32 width, u32 height, u32 aa, u32 use, u32 tileMode, u32 pipeSwizzle, u32 bankSwizzle,
+                                u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, const u8 *data,
+                                u32 linearSize, u32 tiledSize, u8 *result, u32 rowStart, u32 rowEnd, int swizzle) noexcept nogil:
+
+    """
+    (Un)swizzles a tiled surface one micro tile at a time.
+    Only one address is computed per 8x8 micro tile,
+    the pixels are then placed using the offsets from computeMicroTilePixelOffsets().
+    Not usable for linear tileModes or if the samples of a micro tile are split (see isSampleSplit()).
+    """
+
+    cdef:
+        u32 bytesPerPixel = bitsPerPixel // 8
+        int isDepth = use & 4
+        u32 numSamples = 1 << aa
 
+        u64 pixelOffsets[64]
+        u64 pixelAddrs[64]
 
-cpdef bytes swizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
-                    u32 pitch, u32 bpp, u32 slice, u32 sample, bytes data):
+        u32 tileX, tileY, x, y, row, i
+        u64 tileAddr, bankPipe, tileOffset, totalOffset, pos, pos_
 
-    cdef array.array dataArr = array.array('B', data)
+    computeMicroTilePixelOffsets(slice, sample, bitsPerPixel, numSamples, tileMode, isDepth, pixelOffsets)
+
+    for tileY in range(rowStart & ~7, rowEnd, 8):
+        for tileX in range(0, width, 8):
+            if tileMode in [2, 3]:
+                tileAddr = computeMicroTileAddrMicroTiled(tileX, tileY, slice, bitsPerPixel, pitch, height, tileMode)
+                for i in range(64):
+                    pixelAddrs[i] = tileAddr + pixelOffsets[i]
+
+            else:
+                bankPipe, tileOffset = computeMicroTileAddrMacroTiled(tileX, tileY, slice, bitsPerPixel, pitch, height,
+                                                                      numSamples, tileMode, pipeSwizzle, bankSwizzle)
+
+                for i in range(64):
+                    totalOffset = tileOffset + pixelOffsets[i]
+                    pixelAddrs[i] = bankPipe | totalOffset & 255 | (totalOffset & ~(<u64>255)) << 3
+
+            for y in range(max(tileY, rowStart), min(tileY + 8, rowEnd)):
+                row = (y - tileY) * 8
+
+                for x in range(tileX, min(tileX + 8, width)):
+                    pos = pixelAddrs[row + x - tileX]
+                    pos_ = ((y - rowStart) * width + x) * bytesPerPixel
+
+                    if pos_ + bytesPerPixel <= linearSize and pos + bytesPerPixel <= tiledSize:
+                        if swizzle == 0:
+                            memcpy(result + pos_, data + pos, bytesPerPixel)
+
+                        else:
+                            memcpy(result + pos, data + pos_, bytesPerPixel)
+
+
+cpdef deswizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data, result=None,
+                u32 firstRow=0, numRows=None):
+
+    """
+    firstRow, numRows: deswizzle only these rows of pixels (a band of the surface) to the result,
+                       firstRow must be a multiple of 4 for BCn formats
+    """
+
+    if numRows is None:
+        numRows = height - firstRow
+
+    if result is None:
+        result = bytearray(data.shape[0])
+
+    cdef u8[::1] resultView = result
+
+    if data.shape[0] and resultView.shape[0]:
+        swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp, slice, sample,
+                    &data[0], data.shape[0], &resultView[0], resultView.shape[0], firstRow, numRows, 0)
+
+    return result
+
+
+cpdef swizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+              u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data, result=None):
+
+    if result is None:
+        result = bytearray(data.shape[0])
+
+    cdef u8[::1] resultView = result
+
+    if data.shape[0] and resultView.shape[0]:
+        swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp, slice, sample,
+                    &data[0], data.shape[0], &resultView[0], resultView.shape[0], 0, height, 1)
+
+    return result
 
-    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, dataArr.data.as_uchars, len(data), 1)
+
+cpdef array.array getSurfaceAddrs(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode,
+                                  u32 swizzle_, u32 pitch, u32 bpp, u32 slice, u32 sample, u64 dataSize,
+                                  u32 firstRow=0, numRows=None):
+
+    """
+    Computes the address in the swizzled data of every element (pixel or BCn block) of a surface,
+    in the order of the elements in the deswizzled data, so that they can be read without deswizzling.
+    Elements that are out of the data (of size dataSize) get the address 0xFFFFFFFF.
+    firstRow, numRows: only compute the addresses of these rows of pixels
+    """
+
+    if numRows is None:
+        numRows = height - firstRow
+
+    cdef:
+        u32 bytesPerPixel = bpp // 8
+        u32 rowCount = numRows
+        u32 rowStart, rowEnd, pipeSwizzle, bankSwizzle, y, x, i
+        u64 pos, linearSize
+
+        array.array addrs
+        u32 *addrsPtr
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+        firstRow, rowCount = firstRow // 4, (rowCount + 3) // 4
+
+    rowStart = firstRow
+    rowEnd = min(height, <u64>firstRow + rowCount)
+
+    linearSize = <u64>rowStart * width * bytesPerPixel
+    linearSize = dataSize - linearSize if linearSize < dataSize else 0
+
+    addrs = array.clone(array.array('I'), (rowEnd - rowStart) * width if rowEnd > rowStart else 0, zero=False)
+    addrsPtr = addrs.data.as_uints
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    with nogil:
+        for y in range(rowStart, rowEnd):
+            for x in range(width):
+                if tileMode in [0, 1]:
+                    pos = computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+                elif tileMode in [2, 3]:
+                    pos = computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bpp, pitch, height, tileMode, use & 4)
+
+                else:
+                    pos = computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bpp, pitch, height, 1 << aa,
+                                                                tileMode, use & 4, pipeSwizzle, bankSwizzle)
+
+                i = (y - rowStart) * width + x
+
+                if (<u64>i + 1) * bytesPerPixel <= linearSize and pos + bytesPerPixel <= dataSize:
+                    addrsPtr[i] = <u32>pos
+
+                else:
+                    addrsPtr[i] = 0xFFFFFFFF
+
+    return addrs
 
 
 cdef u8 formatHwInfo[0x100]
@@ -190,7 +402,7 @@ cpdef u32 surfaceGetBitsPerPixel(u32 surfaceFormat):
     return formatHwInfo[(surfaceFormat & 0x3F) * 4]
 
 
-cdef u32 computeSurfaceThickness(u32 tileMode):
+cdef u32 computeSurfaceThickness(u32 tileMode) noexcept nogil:
     if tileMode in [3, 7, 11, 13, 15]:
         return 4
 
@@ -200,7 +412,60 @@ cdef u32 computeSurfaceThickness(u32 tileMode):
     return 1
 
 
-cdef u32 computePixelIndexWithinMicroTile(u32 x, u32 y, u32 z, u32 bpp, u32 tileMode, int isDepth):
+# Pixel index within a micro tile for every bpp class (see getPixelIndexClass()),
+# thickness (1, 4, 8) and (z & (thickness - 1), y & 7, x & 7)
+cdef u16 microTilePixelIndices[6][3][512]
+
+
+cdef u32 getPixelIndexClass(u32 bpp, int isDepth) noexcept nogil:
+    if isDepth:
+        return 0
+
+    elif bpp == 8:
+        return 1
+
+    elif bpp == 0x10:
+        return 2
+
+    elif bpp == 0x40:
+        return 4
+
+    elif bpp == 0x80:
+        return 5
+
+    return 3  # 0x20, 0x60 and everything else
+
+
+cdef void buildMicroTilePixelIndices():
+    cdef:
+        u32 classBpp[6]
+        u32 thicknesses[3]
+        u32 cls, t, thickness, z, y, x
+
+    classBpp[:] = [0x20, 8, 0x10, 0x20, 0x40, 0x80]
+    thicknesses[:] = [1, 4, 8]
+
+    for cls in range(6):
+        for t in range(3):
+            thickness = thicknesses[t]
+            for z in range(thickness):
+                for y in range(8):
+                    for x in range(8):
+                        microTilePixelIndices[cls][t][z << 6 | y << 3 | x] = computePixelIndexFromBits(
+                            x, y, z, classBpp[cls], thickness, cls == 0)
+
+
+buildMicroTilePixelIndices()
+
+
+cdef u32 computePixelIndexWithinMicroTile(u32 x, u32 y, u32 z, u32 bpp, u32 tileMode, int isDepth) noexcept nogil:
+    cdef u32 thickness = computeSurfaceThickness(tileMode)
+
+    return microTilePixelIndices[getPixelIndexClass(bpp, isDepth)][thickness >> 2][
+        (z & (thickness - 1)) << 6 | (y & 7) << 3 | x & 7]
+
+
+cdef u32 computePixelIndexFromBits(u32 x, u32 y, u32 z, u32 bpp, u32 thickness, int isDepth) noexcept nogil:
     cdef:
         u32 pixelBit0, pixelBit1, pixelBit2
         u32 pixelBit3, pixelBit4, pixelBit5
@@ -208,8 +473,6 @@ cdef u32 computePixelIndexWithinMicroTile(u32 x, u32 y, u32 z, u32 bpp, u32 tile
         u32 pixelBit7 = 0
         u32 pixelBit8 = 0
 
-        u32 thickness = computeSurfaceThickness(tileMode)
-
     if isDepth:
         pixelBit0 = x & 1
         pixelBit1 = y & 1
@@ -278,15 +541,15 @@ cdef u32 computePixelIndexWithinMicroTile(u32 x, u32 y, u32 z, u32 bpp, u32 tile
 
 
 
-cdef u32 computePipeFromCoordWoRotation(u32 x, u32 y):
+cdef u32 computePipeFromCoordWoRotation(u32 x, u32 y) noexcept nogil:
     return ((y >> 3) ^ (x >> 3)) & 1
 
 
-cdef u32 computeBankFromCoordWoRotation(u32 x, u32 y):
+cdef u32 computeBankFromCoordWoRotation(u32 x, u32 y) noexcept nogil:
     return ((y >> 5) ^ (x >> 3)) & 1 | 2 * (((y >> 4) ^ (x >> 4)) & 1)
 
 
-cdef u32 computeSurfaceRotationFromTileMode(u32 tileMode):
+cdef u32 computeSurfaceRotationFromTileMode(u32 tileMode) noexcept nogil:
     if tileMode in [4, 5, 6, 7, 8, 9, 10, 11]:
         return 2
 
@@ -296,21 +559,21 @@ cdef u32 computeSurfaceRotationFromTileMode(u32 tileMode):
     return 0
 
 
-cdef u32 isThickMacroTiled(u32 tileMode):
+cdef u32 isThickMacroTiled(u32 tileMode) noexcept nogil:
     if tileMode in [7, 11, 13, 15]:
         return 1
 
     return 0
 
 
-cdef u32 isBankSwappedTileMode(u32 tileMode):
+cdef u32 isBankSwappedTileMode(u32 tileMode) noexcept nogil:
     if tileMode in [8, 9, 10, 11, 14, 15]:
         return 1
 
     return 0
 
 
-cdef u32 computeMacroTileAspectRatio(u32 tileMode):
+cdef u32 computeMacroTileAspectRatio(u32 tileMode) noexcept nogil:
     if tileMode in [5, 9]:
         return 2
 
@@ -320,7 +583,7 @@ cdef u32 computeMacroTileAspectRatio(u32 tileMode):
     return 1
 
 
-cdef u32 computeSurfaceBankSwappedWidth(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch):
+cdef u32 computeSurfaceBankSwappedWidth(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch) noexcept nogil:
     if isBankSwappedTileMode(tileMode) == 0:
         return 0
 
@@ -357,7 +620,7 @@ cdef u32 computeSurfaceBankSwappedWidth(u32 tileMode, u32 bpp, u32 numSamples, u
     return bankSwapWidth
 
 
-cdef u64 computeSurfaceAddrFromCoordLinear(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height, u32 numSlices):
+cdef u64 computeSurfaceAddrFromCoordLinear(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height, u32 numSlices) noexcept nogil:
     cdef:
         u64 sliceOffset = pitch * height * (slice + sample * numSlices)
         u64 addr = (y * pitch + x + sliceOffset) * bpp
@@ -366,7 +629,7 @@ cdef u64 computeSurfaceAddrFromCoordLinear(u32 x, u32 y, u32 slice, u32 sample,
 
 
 cdef u64 computeSurfaceAddrFromCoordMicroTiled(u32 x, u32 y, u32 slice, u32 bpp, u32 pitch, u32 height,
-                                               u32 tileMode, int isDepth):
+                                               u32 tileMode, int isDepth) noexcept nogil:
 
     cdef u64 microTileThickness = 1
     if tileMode == 3:
@@ -396,7 +659,7 @@ bankSwapOrder[:] = [0, 1, 3, 2, 6, 7, 5, 4, 0, 0]
 
 cdef u64 computeSurfaceAddrFromCoordMacroTiled(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height,
                                                u32 numSamples, u32 tileMode, int isDepth,
-                                               u32 pipeSwizzle, u32 bankSwizzle):
+                                               u32 pipeSwizzle, u32 bankSwizzle) noexcept nogil:
 
     cdef:
         u64 sampleSlice, samplesPerSlice, tileSliceBits
@@ -486,10 +749,123 @@ cdef u64 computeSurfaceAddrFromCoordMacroTiled(u32 x, u32 y, u32 slice, u32 samp
     return bank << 9 | pipe << 8 | totalOffset & 255 | (totalOffset & -256) << 3
 
 
-cdef:
-    u32 expPitch = 0
-    u32 expHeight = 0
-    u32 expNumSlices = 0
+cdef u32 isSampleSplit(u32 tileMode, u32 bpp, u32 numSamples) noexcept nogil:
+    cdef u64 microTileBytes = (<u64>numSamples * bpp * (computeSurfaceThickness(tileMode) * 64) + 7) // 8
+    return numSamples > 1 and microTileBytes > 2048 and tileMode not in [0, 1, 2, 3]
+
+
+cdef void computeMicroTilePixelOffsets(u32 slice, u32 sample, u32 bpp, u32 numSamples, u32 tileMode, int isDepth,
+                                       u64 *pixelOffsets) noexcept nogil:
+
+    """
+    Writes the byte offsets of the 64 pixels of a micro tile (in row-major order)
+    relative to the address of the micro tile to pixelOffsets.
+    """
+
+    cdef:
+        u64 microTileBits = numSamples * bpp * (computeSurfaceThickness(tileMode) * 64)
+        u64 pixelIndex
+        u32 x, y
+
+    for y in range(8):
+        for x in range(8):
+            pixelIndex = computePixelIndexWithinMicroTile(x, y, slice, bpp, tileMode, isDepth)
+
+            if tileMode in [2, 3]:
+                pixelOffsets[y * 8 + x] = (bpp * pixelIndex) >> 3
+
+            elif isDepth:
+                pixelOffsets[y * 8 + x] = (numSamples * bpp * pixelIndex + bpp * sample + 7) // 8
+
+            else:
+                pixelOffsets[y * 8 + x] = (bpp * pixelIndex + sample * (microTileBits // numSamples) + 7) // 8
+
+
+cdef u64 computeMicroTileAddrMicroTiled(u32 x, u32 y, u32 slice, u32 bpp, u32 pitch, u32 height, u32 tileMode) noexcept nogil:
+    """
+    Same as computeSurfaceAddrFromCoordMicroTiled(), without the offset of the pixel within the micro tile.
+    """
+
+    cdef u64 microTileThickness = 1
+    if tileMode == 3:
+        microTileThickness = 4
+
+    cdef:
+        u64 microTileBytes = (64 * microTileThickness * bpp + 7) // 8
+        u64 microTilesPerRow = pitch >> 3
+        u64 microTileIndexX = x >> 3
+        u64 microTileIndexY = y >> 3
+        u64 microTileIndexZ = slice // microTileThickness
+
+        u64 microTileOffset = microTileBytes * (microTileIndexX + microTileIndexY * microTilesPerRow)
+
+        u64 sliceBytes = (pitch * height * microTileThickness * bpp + 7) // 8
+        u64 sliceOffset = microTileIndexZ * sliceBytes
+
+    return microTileOffset + sliceOffset
+
+
+cdef (u64, u64) computeMicroTileAddrMacroTiled(u32 x, u32 y, u32 slice, u32 bpp, u32 pitch, u32 height,
+                                               u32 numSamples, u32 tileMode, u32 pipeSwizzle, u32 bankSwizzle) noexcept nogil:
+
+    """
+    Same as computeSurfaceAddrFromCoordMacroTiled(), without the offset of the pixel within the micro tile.
+    Returns the bank/pipe bits of the address and the offset of the micro tile,
+    the address of a pixel with the offset elemOffset in the micro tile is then:
+    bankPipe | totalOffset & 255 | (totalOffset & -256) << 3, where totalOffset = elemOffset + tileOffset
+    Only valid if the samples of the micro tile are not split (see isSampleSplit()).
+    """
+
+    cdef:
+        u64 bankSwapWidth, swapIndex
+
+        u64 microTileThickness = computeSurfaceThickness(tileMode)
+
+        u64 pipe = computePipeFromCoordWoRotation(x, y)
+        u64 bank = computeBankFromCoordWoRotation(x, y)
+
+        u64 swizzle_ = pipeSwizzle + 2 * bankSwizzle
+        u64 bankPipe = pipe + 2 * bank
+        u64 rotation = computeSurfaceRotationFromTileMode(tileMode)
+        u64 sliceIn = slice
+
+    if isThickMacroTiled(tileMode):
+        sliceIn >>= 2
+
+    bankPipe ^= swizzle_ + sliceIn * rotation
+    bankPipe %= 8
+    pipe = bankPipe % 2
+    bank = bankPipe // 2
+
+    cdef:
+        u64 sliceBytes = (height * pitch * microTileThickness * bpp * numSamples + 7) // 8
+        u64 sliceOffset = sliceBytes * (slice // microTileThickness)
+
+        u64 macroTilePitch = 32
+        u64 macroTileHeight = 16
+
+    if tileMode in [5, 9]:  # GX2_TILE_MODE_2D_TILED_THIN2 and GX2_TILE_MODE_2B_TILED_THIN2
+        macroTilePitch = 16
+        macroTileHeight = 32
+
+    elif tileMode in [6, 10]:  # GX2_TILE_MODE_2D_TILED_THIN4 and GX2_TILE_MODE_2B_TILED_THIN4
+        macroTilePitch = 8
+        macroTileHeight = 64
+
+    cdef:
+        u64 macroTilesPerRow = pitch // macroTilePitch
+        u64 macroTileBytes = (numSamples * microTileThickness * bpp * macroTileHeight
+                              * macroTilePitch + 7) // 8
+        u64 macroTileIndexX = x // macroTilePitch
+        u64 macroTileIndexY = y // macroTileHeight
+        u64 macroTileOffset = (macroTileIndexX + macroTilesPerRow * macroTileIndexY) * macroTileBytes
+
+    if isBankSwappedTileMode(tileMode):
+        bankSwapWidth = computeSurfaceBankSwappedWidth(tileMode, bpp, numSamples, pitch)
+        swapIndex = macroTilePitch * macroTileIndexX // bankSwapWidth
+        bank ^= bankSwapOrder[swapIndex & 3]
+
+    return bank << 9 | pipe << 8, (macroTileOffset + sliceOffset) >> 3
 
 
 cdef class Flags:
@@ -596,52 +972,56 @@ cdef class surfaceOut:
         self.tileIndex = 0
 
 
-class pyClass:
-    pass
-
-
-def surfaceOutToPyClass(surfaceOut pSurfOut):
-    # We can't return a Cython class
-    # Copy the attributes from our Cython class to a Python class
-    # and return it instead
-    pypOut = pyClass()
-    pypTileInfo = pyClass() 
-
-    pypTileInfo.banks = pSurfOut.pTileInfo.banks
-    pypTileInfo.bankWidth = pSurfOut.pTileInfo.bankWidth
-    pypTileInfo.bankHeight = pSurfOut.pTileInfo.bankHeight
-    pypTileInfo.macroAspectRatio = pSurfOut.pTileInfo.macroAspectRatio
-    pypTileInfo.tileSplitBytes = pSurfOut.pTileInfo.tileSplitBytes
-    pypTileInfo.pipeConfig = pSurfOut.pTileInfo.pipeConfig
-
-    pypOut.size = pSurfOut.size
-    pypOut.pitch = pSurfOut.pitch
-    pypOut.height = pSurfOut.height
-    pypOut.depth = pSurfOut.depth
-    pypOut.surfSize = pSurfOut.surfSize
-    pypOut.tileMode = pSurfOut.tileMode
-    pypOut.baseAlign = pSurfOut.baseAlign
-    pypOut.pitchAlign = pSurfOut.pitchAlign
-    pypOut.heightAlign = pSurfOut.heightAlign
-    pypOut.depthAlign = pSurfOut.depthAlign
-    pypOut.bpp = pSurfOut.bpp
-    pypOut.pixelPitch = pSurfOut.pixelPitch
-    pypOut.pixelHeight = pSurfOut.pixelHeight
-    pypOut.pixelBits = pSurfOut.pixelBits
-    pypOut.sliceSize = pSurfOut.sliceSize
-    pypOut.pitchTileMax = pSurfOut.pitchTileMax
-    pypOut.heightTileMax = pSurfOut.heightTileMax
-    pypOut.sliceTileMax = pSurfOut.sliceTileMax
-    pypOut.pTileInfo = pypTileInfo
-    pypOut.tileType = pSurfOut.tileType
-    pypOut.tileIndex = pSurfOut.tileIndex
-
-    return pypOut
-
-
-cdef:
-    surfaceIn pIn = surfaceIn()
-    surfaceOut pOut = surfaceOut()
+# Immutable copies of tileInfo and surfaceOut, returned by getSurfaceInfo()
+SurfaceTileInfo = namedtuple('SurfaceTileInfo', [
+    'banks', 'bankWidth', 'bankHeight', 'macroAspectRatio', 'tileSplitBytes', 'pipeConfig'
+])
+
+SurfaceInfo = namedtuple('SurfaceInfo', [
+    'size', 'pitch', 'height', 'depth', 'surfSize', 'tileMode', 'baseAlign', 'pitchAlign',
+    'heightAlign', 'depthAlign', 'bpp', 'pixelPitch', 'pixelHeight', 'pixelBits', 'sliceSize',
+    'pitchTileMax', 'heightTileMax', 'sliceTileMax', 'pTileInfo', 'tileType', 'tileIndex'
+])
+
+# Max number of surface descriptors kept by getSurfaceInfo()
+# (one per format/size/tileMode/level combination),
+# fixed when the module is imported, changing it afterwards has no effect
+_surfaceInfoCacheSize = 512
+
+
+def surfaceOutToSurfaceInfo(surfaceOut pSurfOut):
+    cdef tileInfo pTileInfo = pSurfOut.pTileInfo
+
+    return SurfaceInfo(
+        pSurfOut.size,
+        pSurfOut.pitch,
+        pSurfOut.height,
+        pSurfOut.depth,
+        pSurfOut.surfSize,
+        pSurfOut.tileMode,
+        pSurfOut.baseAlign,
+        pSurfOut.pitchAlign,
+        pSurfOut.heightAlign,
+        pSurfOut.depthAlign,
+        pSurfOut.bpp,
+        pSurfOut.pixelPitch,
+        pSurfOut.pixelHeight,
+        pSurfOut.pixelBits,
+        pSurfOut.sliceSize,
+        pSurfOut.pitchTileMax,
+        pSurfOut.heightTileMax,
+        pSurfOut.sliceTileMax,
+        SurfaceTileInfo(
+            pTileInfo.banks,
+            pTileInfo.bankWidth,
+            pTileInfo.bankHeight,
+            pTileInfo.macroAspectRatio,
+            pTileInfo.tileSplitBytes,
+            pTileInfo.pipeConfig,
+        ),
+        pSurfOut.tileType,
+        pSurfOut.tileIndex,
+    )
 
 
 cdef u32 powTwoAlign(u32 x, u32 align):
@@ -666,7 +1046,7 @@ cdef (u32, u32, u32, u32) getBitsPerPixel(u32 format_):
             formatExInfo[fmtIdx + 2], formatExInfo[fmtIdx + 3])
 
 
-cdef u32 adjustSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp, u32 width, u32 height):
+cdef u32 adjustSurfaceInfo(surfaceIn pIn, u32 elemMode, u32 expandX, u32 expandY, u32 bpp, u32 width, u32 height):
     cdef:
         u32 bBCnFormat = 0
         u32 widtha, heighta
@@ -712,7 +1092,7 @@ cdef u32 adjustSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp, u32
     return 0
 
 
-cdef u32 hwlComputeMipLevel():
+cdef u32 hwlComputeMipLevel(surfaceIn pIn):
     cdef:
         u32 width, widtha
         u32 height, heighta
@@ -746,7 +1126,7 @@ cdef u32 hwlComputeMipLevel():
     return handled
 
 
-cdef void computeMipLevel():
+cdef void computeMipLevel(surfaceIn pIn):
     cdef:
         u32 slices = 0
         u32 height = 0
@@ -757,7 +1137,7 @@ cdef void computeMipLevel():
         pIn.width = powTwoAlign(pIn.width, 4)
         pIn.height = powTwoAlign(pIn.height, 4)
 
-    hwlHandled = hwlComputeMipLevel()
+    hwlHandled = hwlComputeMipLevel(pIn)
     if not hwlHandled and pIn.mipLevel and (pIn.flags.value >> 12) & 1:
         width = max(1, pIn.width >> pIn.mipLevel)
         height = max(1, pIn.height >> pIn.mipLevel)
@@ -910,11 +1290,7 @@ cdef u32 computeSurfaceMipLevelTileMode(u32 baseTileMode, u32 bpp, u32 level, u3
         1)
 
 
-cdef (u32, u32, u32) padDimensions(u32 tileMode, u32 padDims, u32 isCube, u32 pitchAlign, u32 heightAlign, u32 sliceAlign):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+cdef (u32, u32, u32) padDimensions(u32 expPitch, u32 expHeight, u32 expNumSlices, u32 tileMode, u32 padDims, u32 isCube, u32 pitchAlign, u32 heightAlign, u32 sliceAlign):
     cdef u32 thickness = computeSurfaceThickness(tileMode)
     if not padDims:
         padDims = 3
@@ -973,16 +1349,12 @@ cdef (u32, u32, u32) computeSurfaceAlignmentsLinear(u32 tileMode, u32 bpp, Flags
     return baseAlign, pitchAlign, heightAlign
 
 
-cdef u32 computeSurfaceInfoLinear(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
-    expPitch = pitch
-    expHeight = height
-    expNumSlices = numSlices
-
+cdef u32 computeSurfaceInfoLinear(surfaceOut pOut, u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
     cdef:
+        u32 expPitch = pitch
+        u32 expHeight = height
+        u32 expNumSlices = numSlices
+
         u32 valid = 1
         u32 microTileThickness = computeSurfaceThickness(tileMode)
 
@@ -1011,6 +1383,9 @@ cdef u32 computeSurfaceInfoLinear(u32 tileMode, u32 bpp, u32 numSamples, u32 pit
             expNumSlices = nextPow2(numSlices)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         tileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -1049,16 +1424,12 @@ cdef (u32, u32, u32) computeSurfaceAlignmentsMicroTiled(u32 tileMode, u32 bpp, F
     return baseAlign, pitchAlign, heightAlign
 
 
-cdef u32 computeSurfaceInfoMicroTiled(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
-    expPitch = pitch
-    expHeight = height
-    expNumSlices = numSlices
-
+cdef u32 computeSurfaceInfoMicroTiled(surfaceOut pOut, u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
     cdef:
+        u32 expPitch = pitch
+        u32 expHeight = height
+        u32 expNumSlices = numSlices
+
         u32 valid = 1
         u32 expTileMode = tileMode
         u32 microTileThickness = computeSurfaceThickness(tileMode)
@@ -1090,6 +1461,9 @@ cdef u32 computeSurfaceInfoMicroTiled(u32 tileMode, u32 bpp, u32 numSamples, u32
         numSamples)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         expTileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -1149,16 +1523,12 @@ cdef (u32, u32, u32, u32, u32) computeSurfaceAlignmentsMacroTiled(u32 tileMode,
     return baseAlign, pitchAlign, heightAlign, macroTileWidth, macroTileHeight
 
 
-cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
-    expPitch = pitch
-    expHeight = height
-    expNumSlices = numSlices
-
+cdef u32 computeSurfaceInfoMacroTiled(surfaceOut pOut, u32 tileMode, u32 baseTileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
     cdef:
+        u32 expPitch = pitch
+        u32 expHeight = height
+        u32 expNumSlices = numSlices
+
         u32 valid = 1
         u32 expTileMode = tileMode
         u32 microTileThickness = computeSurfaceThickness(tileMode)
@@ -1197,6 +1567,9 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
             pitchAlign = bankSwappedWidth
 
         expPitch, expHeight, expNumSlices = padDimensions(
+            expPitch,
+            expHeight,
+            expNumSlices,
             tileMode,
             padDims,
             (flags.value >> 4) & 1,
@@ -1228,6 +1601,7 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
             expTileMode = 2
 
             result = computeSurfaceInfoMicroTiled(
+                pOut,
                 2,
                 bpp,
                 numSamples,
@@ -1250,6 +1624,9 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
                 pitchAlign = bankSwappedWidth
 
             expPitch, expHeight, expNumSlices = padDimensions(
+                expPitch,
+                expHeight,
+                expNumSlices,
                 tileMode,
                 padDims,
                 (flags.value >> 4) & 1,
@@ -1271,7 +1648,7 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
     return result
 
 
-cdef u32 ComputeSurfaceInfoEx():
+cdef u32 ComputeSurfaceInfoEx(surfaceIn pIn, surfaceOut pOut):
     cdef:
         u32 tileMode = pIn.tileMode
         u32 bpp = pIn.bpp
@@ -1307,6 +1684,7 @@ cdef u32 ComputeSurfaceInfoEx():
 
     if tileMode in [0, 1]:
         valid = computeSurfaceInfoLinear(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1321,6 +1699,7 @@ cdef u32 ComputeSurfaceInfoEx():
 
     elif tileMode in [2, 3]:
         valid = computeSurfaceInfoMicroTiled(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1333,6 +1712,7 @@ cdef u32 ComputeSurfaceInfoEx():
 
     elif tileMode in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]:
         valid = computeSurfaceInfoMacroTiled(
+            pOut,
             tileMode,
             baseTileMode,
             bpp,
@@ -1350,7 +1730,7 @@ cdef u32 ComputeSurfaceInfoEx():
     return 0
 
 
-cdef u32 restoreSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp):
+cdef u32 restoreSurfaceInfo(surfaceOut pOut, u32 elemMode, u32 expandX, u32 expandY, u32 bpp):
     cdef u32 width, height
 
     if pOut.pixelPitch and pOut.pixelHeight:
@@ -1387,13 +1767,7 @@ cdef u32 restoreSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp):
     return 0
 
 
-cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
-    global pIn
-    global pOut
-
-    pIn = aSurfIn
-    pOut = pSurfOut
-
+cdef void computeSurfaceInfo(surfaceIn pIn, surfaceOut pOut):
     cdef:
         u32 returnCode = 0
         u32 elemMode = 0
@@ -1405,7 +1779,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
         returnCode = 3
 
     if returnCode == 0:
-        computeMipLevel()
+        computeMipLevel(pIn)
 
         width = pIn.width
         height = pIn.height
@@ -1421,7 +1795,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             if elemMode == 4 and expandX == 3 and pIn.tileMode == 1:
                 pIn.flags.value |= 0x200
 
-            bpp = adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height)
+            bpp = adjustSurfaceInfo(pIn, elemMode, expandX, expandY, bpp, width, height)
 
         elif pIn.bpp:
             pIn.width = max(1, pIn.width)
@@ -1431,7 +1805,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             returnCode = 3
 
         if returnCode == 0:
-            returnCode = ComputeSurfaceInfoEx()
+            returnCode = ComputeSurfaceInfoEx(pIn, pOut)
 
         if returnCode == 0:
             pOut.bpp = pIn.bpp
@@ -1439,7 +1813,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             pOut.pixelHeight = pOut.height
 
             if pIn.format and (not (pIn.flags.value >> 9) & 1 or not pIn.mipLevel):
-                bpp = restoreSurfaceInfo(elemMode, expandX, expandY, bpp)
+                bpp = restoreSurfaceInfo(pOut, elemMode, expandX, expandY, bpp)
 
             if (pIn.flags.value >> 5) & 1:
                 pOut.sliceSize = pOut.surfSize
@@ -1455,6 +1829,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             pOut.sliceTileMax = (pOut.height * pOut.pitch >> 6) - 1
 
 
+@lru_cache(maxsize=_surfaceInfoCacheSize)
 def getSurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 surfaceDepth, u32 surfaceDim, u32 surfaceTileMode, u32 surfaceAA, u32 level):
     """
     surfaceFormat: format of the surface (GX2SurfaceFormat)
@@ -1465,6 +1840,9 @@ def getSurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 s
     surfaceTileMode: GX2TileMode (note: NOT AddrTileMode)
     surfaceAA: AA mode of the surface (GX2AAMode)
     level: mip level of which the info will be calculated for (first mipmap corresponds to value 1)
+
+    Results are memoized, the returned SurfaceInfo is immutable and shared between callers.
+    Use getSurfaceInfo.cache_info() / getSurfaceInfo.cache_clear() to inspect or reset the cache.
     """
 
     cdef:
@@ -1588,9 +1966,7 @@ def getSurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 s
         pSurfOut.size = 96
         computeSurfaceInfo(aSurfIn, pSurfOut)
 
-        pSurfOut = pOut
-
     if not pSurfOut.tileMode:
         pSurfOut.tileMode = 16
 
-    return surfaceOutToPyClass(pSurfOut)
+    return surfaceOutToSurfaceInfo(pSurfOut)
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# addrlib_np.py
+# A NumPy (un)swizzling engine for Wii U textures.
+# Computes the address of every element of a surface in one batched pass
+# instead of calling the per-pixel address functions for each of them.
+
+
+################################################################
+################################################################
+
+from collections import OrderedDict
+import os
+import tempfile
+import threading
+import zipfile
+
+import numpy as np
+
+from .addrlib import (
+    BCn_formats, GX2TileModeToAddrTileMode, swizzleSurfLinear, computeSurfaceThickness, getMicroTilePixelIndexTable,
+    computeSurfaceRotationFromTileMode, isThickMacroTiled,
+    isBankSwappedTileMode, computeSurfaceBankSwappedWidth, bankSwapOrder,
+)
+
+
+bankSwapOrderArr = np.array(bankSwapOrder, dtype=np.int64)
+
+
+def computePixelIndexWithinMicroTile(x, y, z, bpp, tileMode, isDepth):
+    thickness = computeSurfaceThickness(tileMode)
+    table = np.array(getMicroTilePixelIndexTable(bpp, thickness, isDepth), dtype=np.int64)
+
+    return table[(z & (thickness - 1)) << 6 | (y & 7) << 3 | x & 7]
+
+
+def computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bpp, pitch, height, numSlices):
+    sliceOffset = pitch * height * (slice + sample * numSlices)
+    return (y * pitch + x + sliceOffset) * bpp
+
+
+def computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bpp, pitch, height,
+                                          tileMode, isDepth):
+
+    microTileThickness = 1
+    if tileMode == 3:
+        microTileThickness = 4
+
+    microTileBytes = (64 * microTileThickness * bpp + 7) // 8
+    microTilesPerRow = pitch >> 3
+
+    microTileOffset = microTileBytes * ((x >> 3) + (y >> 3) * microTilesPerRow)
+    sliceBytes = (pitch * height * microTileThickness * bpp + 7) // 8
+    sliceOffset = (slice // microTileThickness) * sliceBytes
+
+    pixelIndex = computePixelIndexWithinMicroTile(x, y, slice, bpp, tileMode, isDepth)
+    pixelOffset = (bpp * pixelIndex) >> 3
+
+    return pixelOffset + microTileOffset + sliceOffset
+
+
+def computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bpp, pitch, height,
+                                          numSamples, tileMode, isDepth,
+                                          pipeSwizzle, bankSwizzle):
+
+    microTileThickness = computeSurfaceThickness(tileMode)
+
+    microTileBits = numSamples * bpp * (microTileThickness * 64)
+    microTileBytes = (microTileBits + 7) // 8
+
+    pixelIndex = computePixelIndexWithinMicroTile(x, y, slice, bpp, tileMode, isDepth)
+    bytesPerSample = microTileBytes // numSamples
+
+    if isDepth:
+        sampleOffset = bpp * sample
+        pixelOffset = numSamples * bpp * pixelIndex
+
+    else:
+        sampleOffset = sample * (microTileBits // numSamples)
+        pixelOffset = bpp * pixelIndex
+
+    elemOffset = pixelOffset + sampleOffset
+
+    if numSamples <= 1 or microTileBytes <= 2048:
+        numSampleSplits = 1
+        sampleSlice = 0
+
+    else:
+        samplesPerSlice = 2048 // bytesPerSample
+        numSampleSplits = numSamples // samplesPerSlice
+        numSamples = samplesPerSlice
+
+        tileSliceBits = microTileBits // numSampleSplits
+        sampleSlice = elemOffset // tileSliceBits
+        elemOffset = elemOffset % tileSliceBits
+
+    elemOffset = (elemOffset + 7) // 8
+
+    pipe = ((y >> 3) ^ (x >> 3)) & 1
+    bank = ((y >> 5) ^ (x >> 3)) & 1 | 2 * (((y >> 4) ^ (x >> 4)) & 1)
+
+    swizzle_ = pipeSwizzle + 2 * bankSwizzle
+    bankPipe = pipe + 2 * bank
+    rotation = computeSurfaceRotationFromTileMode(tileMode)
+    sliceIn = slice
+
+    if isThickMacroTiled(tileMode):
+        sliceIn >>= 2
+
+    bankPipe = (bankPipe ^ (2 * sampleSlice * 3 ^ (swizzle_ + sliceIn * rotation))) % 8
+    pipe = bankPipe % 2
+    bank = bankPipe // 2
+
+    sliceBytes = (height * pitch * microTileThickness * bpp * numSamples + 7) // 8
+    sliceOffset = sliceBytes * ((sampleSlice + numSampleSplits * slice) // microTileThickness)
+
+    macroTilePitch = 32
+    macroTileHeight = 16
+
+    if tileMode in [5, 9]:  # GX2_TILE_MODE_2D_TILED_THIN2 and GX2_TILE_MODE_2B_TILED_THIN2
+        macroTilePitch = 16
+        macroTileHeight = 32
+
+    elif tileMode in [6, 10]:  # GX2_TILE_MODE_2D_TILED_THIN4 and GX2_TILE_MODE_2B_TILED_THIN4
+        macroTilePitch = 8
+        macroTileHeight = 64
+
+    macroTilesPerRow = pitch // macroTilePitch
+    macroTileBytes = (numSamples * microTileThickness * bpp * macroTileHeight
+                      * macroTilePitch + 7) // 8
+    macroTileIndexX = x // macroTilePitch
+    macroTileIndexY = y // macroTileHeight
+    macroTileOffset = (macroTileIndexX + macroTilesPerRow * macroTileIndexY) * macroTileBytes
+
+    if isBankSwappedTileMode(tileMode):
+        bankSwapWidth = computeSurfaceBankSwappedWidth(tileMode, bpp, numSamples, pitch)
+        swapIndex = macroTilePitch * macroTileIndexX // bankSwapWidth
+        bank = bank ^ bankSwapOrderArr[swapIndex & 3]
+
+    totalOffset = elemOffset + ((macroTileOffset + sliceOffset) >> 3)
+    return bank << 9 | pipe << 8 | totalOffset & 255 | (totalOffset & -256) << 3
+
+
+def computeSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                          pitch, bitsPerPixel, slice, sample, rowStart=0, rowEnd=None):
+
+    """
+    Returns the byte address of every element of the surface, in linear (row-major) order.
+    Arguments are the same as for swizzleSurf(),
+    rowStart, rowEnd: rows of elements (blocks for BCn formats) to compute, all of them by default
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    if rowEnd is None:
+        rowEnd = height
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    y, x = np.divmod(np.arange(rowStart * width, rowEnd * width, dtype=np.int64), max(1, width))
+
+    if tileMode in [0, 1]:
+        return computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+    elif tileMode in [2, 3]:
+        return computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, bool(use & 4))
+
+    return computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
+                                                 tileMode, bool(use & 4), pipeSwizzle, bankSwizzle)
+
+
+class AddrMapCache:
+    """
+    LRU cache of surface address maps, keyed by the surface geometry and the rows of the map,
+    holding at most maxBytes bytes of maps.
+    If path is set, the maps are also kept in an on-disk store in that directory.
+    """
+
+    def __init__(self, maxBytes=64 * 1024 * 1024, path=None):
+        self.maxBytes = maxBytes
+        self.path = path
+        self.maps = OrderedDict()
+        self.size = 0
+
+        # The cache can be shared by threads converting bands of the same surface
+        self.lock = threading.Lock()
+
+        # Locks of the maps being computed, so that each one is only computed once
+        self.computeLocks = {}
+
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+    def getFileName(self, key):
+        return os.path.join(self.path, "addrmap_%s.npz" % "_".join("%x" % value for value in key))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.getUnlocked(key)
+            if entry is None:
+                self.misses += 1
+
+            return entry
+
+    def getUnlocked(self, key):
+        entry = self.maps.get(key)
+        if entry is not None:
+            self.maps.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        if self.path:
+            fileName = self.getFileName(key)
+
+            try:
+                with np.load(fileName) as file:
+                    entry = file["addrMap"], int(file["elemSize"])
+
+            except FileNotFoundError:
+                pass
+
+            except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+                # Truncated or corrupted, it will be computed and stored again
+                try:
+                    os.remove(fileName)
+
+                except OSError:
+                    pass
+
+            else:
+                self.diskHits += 1
+                self.addUnlocked(key, entry, False)
+                return entry
+
+        return None
+
+    def getOrCompute(self, key, compute):
+        """
+        Returns the entry of key, calling compute() to make it if it isn't cached.
+        Threads asking for the same missing entry wait for the first one to compute it.
+        """
+
+        with self.lock:
+            entry = self.getUnlocked(key)
+            if entry is not None:
+                return entry
+
+            computeLock = self.computeLocks.setdefault(key, threading.Lock())
+
+        with computeLock:
+            with self.lock:
+                # Computed by another thread while waiting
+                entry = self.getUnlocked(key)
+                if entry is not None:
+                    return entry
+
+                self.misses += 1
+
+            try:
+                entry = compute()
+
+                with self.lock:
+                    self.addUnlocked(key, entry, True)
+
+            finally:
+                # Also when compute() raised, the threads waiting for it then compute it themselves
+                with self.lock:
+                    if self.computeLocks.get(key) is computeLock:
+                        del self.computeLocks[key]
+
+        return entry
+
+    def add(self, key, entry, store=True):
+        with self.lock:
+            self.addUnlocked(key, entry, store)
+
+    def addUnlocked(self, key, entry, store):
+        # Entries are shared between callers, make sure no one modifies them
+        entry[0].flags.writeable = False
+
+        if key in self.maps:
+            self.size -= self.maps[key][0].nbytes
+
+        self.maps[key] = entry
+        self.maps.move_to_end(key)
+        self.size += entry[0].nbytes
+
+        # A map bigger than the cache isn't kept at all
+        while self.size > max(0, self.maxBytes):
+            _, (addrMap, _) = self.maps.popitem(last=False)
+            self.size -= addrMap.nbytes
+
+        if store and self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+            # Write to a temporary file first, so that a map is never seen half-written
+            fd, tmpName = tempfile.mkstemp(".tmp", "addrmap_", self.path)
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    np.savez(file, addrMap=entry[0], elemSize=entry[1])
+
+                os.replace(tmpName, self.getFileName(key))
+
+            except BaseException:
+                os.remove(tmpName)
+                raise
+
+    def clear(self):
+        with self.lock:
+            self.maps.clear()
+            self.size = 0
+            self.hits = 0
+            self.diskHits = 0
+            self.misses = 0
+
+    def getStats(self):
+        return {
+            "hits": self.hits,
+            "diskHits": self.diskHits,
+            "misses": self.misses,
+            "entries": len(self.maps),
+            "bytes": self.size,
+            "maxBytes": self.maxBytes,
+        }
+
+
+addrMapCache = AddrMapCache()
+
+
+def getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                      pitch, bitsPerPixel, slice, sample, rowStart, rowEnd):
+
+    """
+    Returns (addrMap, elemSize) for the rows rowStart to rowEnd of elements of the surface,
+    from addrMapCache if possible.
+    addrMap holds the address of every element of these rows in units of elemSize bytes,
+    elemSize is bytesPerPixel if all elements are aligned, otherwise 1.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    key = (format_, width, height, tileMode, swizzle_ & 0x700, pitch, bitsPerPixel,
+           depth, aa, use & 4, slice, sample, rowStart, rowEnd)
+
+    def compute():
+        addrMap = computeSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                        pitch, bitsPerPixel, slice, sample, rowStart, rowEnd)
+
+        elemSize = 1
+        if bytesPerPixel > 1 and not (addrMap % bytesPerPixel).any():
+            elemSize = bytesPerPixel
+            addrMap //= bytesPerPixel
+
+        if not addrMap.size or addrMap.max() <= 0xFFFFFFFF:
+            addrMap = addrMap.astype(np.uint32)
+
+        return addrMap, elemSize
+
+    return addrMapCache.getOrCompute(key, compute)
+
+
+def getRowRange(width, height, format_, firstRow, numRows):
+    """
+    Returns the width and the rows of elements (blocks for BCn formats) covered by the given rows of pixels.
+    """
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+        firstRow, numRows = firstRow // 4, (numRows + 3) // 4
+
+    rowStart = min(firstRow, height)
+    rowEnd = max(rowStart, min(height, firstRow + numRows))
+
+    return width, rowStart, rowEnd
+
+
+def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bitsPerPixel, slice, sample, data, dataSize, result, firstRow, numRows, swizzle):
+
+    """
+    Same as addrlib.swizzleSurf(), but the whole surface (or band of rows) is (un)swizzled with one gather/scatter.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    src = np.frombuffer(data, dtype=np.uint8, count=dataSize)
+    dst = np.frombuffer(result, dtype=np.uint8)
+
+    if GX2TileModeToAddrTileMode(tileMode) in [0, 1] and bytesPerPixel:
+        return swizzleSurfLinearRows(width, height, depth, format_, bytesPerPixel, pitch, slice, sample,
+                                     src, dst, result, firstRow, numRows, swizzle)
+
+    # Only the address map of the rows to move is computed
+    elemWidth, rowStart, rowEnd = getRowRange(width, height, format_, firstRow, numRows)
+    addrMap, elemSize = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                          pitch, bitsPerPixel, slice, sample, rowStart, rowEnd)
+
+    width = elemWidth
+
+    # Elements must be within the source data and the result buffer
+    if swizzle:
+        linearSize = dataSize
+        tiledSize = min(dataSize, dst.size)
+
+    else:
+        linearSize = max(0, min(dataSize - rowStart * width * bytesPerPixel, dst.size))
+        tiledSize = dataSize
+
+    if elemSize == bytesPerPixel:
+        # Every element is aligned, move whole elements at once
+        numLinear = linearSize // bytesPerPixel
+        numTiled = tiledSize // bytesPerPixel
+
+        if swizzle:
+            linearElems = src[:numLinear * bytesPerPixel].reshape(numLinear, bytesPerPixel)
+            tiledElems = dst[:numTiled * bytesPerPixel].reshape(numTiled, bytesPerPixel)
+
+        else:
+            linearElems = dst[:numLinear * bytesPerPixel].reshape(numLinear, bytesPerPixel)
+            tiledElems = src[:numTiled * bytesPerPixel].reshape(numTiled, bytesPerPixel)
+
+        addrMap = addrMap[:numLinear]
+        linear = np.s_[:addrMap.size]
+
+        if addrMap.size and addrMap.max() >= numTiled:
+            valid = addrMap < numTiled
+            addrMap = addrMap[valid]
+            linear = np.flatnonzero(valid)
+
+        if swizzle == 0:
+            linearElems[linear] = tiledElems[addrMap]
+
+        else:
+            tiledElems[addrMap] = linearElems[linear]
+
+        return result
+
+    pos = addrMap.astype(np.int64)
+    pos_ = np.arange(pos.size, dtype=np.int64) * bytesPerPixel
+
+    valid = (pos_ + bytesPerPixel <= linearSize) & (pos + bytesPerPixel <= tiledSize)
+    if not valid.all():
+        pos = pos[valid]
+        pos_ = pos_[valid]
+
+    byteIdx = np.arange(bytesPerPixel, dtype=np.int64)
+    pos = (pos[:, None] + byteIdx).ravel()
+    pos_ = (pos_[:, None] + byteIdx).ravel()
+
+    if swizzle == 0:
+        dst[pos_] = src[pos]
+
+    else:
+        dst[pos] = src[pos_]
+
+    return result
+
+
+def swizzleSurfLinearRows(width, height, depth, format_, bytesPerPixel, pitch, slice, sample,
+                          src, dst, result, firstRow, numRows, swizzle):
+
+    """
+    (Un)swizzles a linear surface without an address map,
+    the rows that fit entirely are moved with one strided copy (a plain copy if pitch == width).
+    """
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+        firstRow, numRows = firstRow // 4, (numRows + 3) // 4
+
+    rowStart = firstRow
+    rowEnd = min(height, firstRow + numRows)
+
+    if swizzle:
+        linearSize = src.size
+        tiledSize = min(src.size, dst.size)
+
+    else:
+        linearSize = max(0, min(src.size - rowStart * width * bytesPerPixel, dst.size))
+        tiledSize = src.size
+
+    rowSize = width * bytesPerPixel
+    pitchSize = pitch * bytesPerPixel
+    base = (rowStart * pitch + pitch * height * (slice + sample * depth)) * bytesPerPixel
+
+    # Number of rows that fit entirely in both buffers
+    numFull = max(0, min(rowEnd - rowStart, linearSize // rowSize if rowSize else 0,
+                         (tiledSize - base + pitchSize - rowSize) // pitchSize if pitchSize else 0))
+
+    if numFull:
+        tiled = (src if swizzle == 0 else dst)[base:base + numFull * pitchSize - pitchSize + rowSize]
+        tiled = np.lib.stride_tricks.as_strided(tiled, (numFull, rowSize), (pitchSize, 1), writeable=swizzle != 0)
+        linear = (dst if swizzle == 0 else src)[:numFull * rowSize].reshape(numFull, rowSize)
+
+        if swizzle == 0:
+            linear[:] = tiled
+
+        else:
+            tiled[:] = linear
+
+    # The rest of the rows only partially fit, if at all
+    if rowStart + numFull < rowEnd:
+        skipped = numFull * rowSize
+
+        if swizzle == 0:
+            swizzleSurfLinear(width, height, depth, bytesPerPixel, pitch, slice, sample, src,
+                              linearSize - skipped, tiledSize, dst[skipped:], rowStart + numFull, rowEnd, 0)
+
+        else:
+            swizzleSurfLinear(width, height, depth, bytesPerPixel, pitch, slice, sample, src[skipped:],
+                              linearSize - skipped, tiledSize, dst, rowStart + numFull, rowEnd, 1)
+
+    return result
+
+
+def getSurfaceAddrs(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bpp, slice, sample, dataSize, firstRow=0, numRows=None):
+
+    """
+    Same as addrlib.getSurfaceAddrs(), but taken from the cached address map.
+    """
+
+    if numRows is None:
+        numRows = height - firstRow
+
+    bytesPerPixel = bpp // 8
+
+    elemWidth, rowStart, rowEnd = getRowRange(width, height, format_, firstRow, numRows)
+    addrMap, elemSize = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                          pitch, bpp, slice, sample, rowStart, rowEnd)
+
+    width = elemWidth
+    addrs = addrMap.astype(np.int64) * elemSize
+
+    linearEnd = (np.arange(addrs.size, dtype=np.int64) + 1) * bytesPerPixel
+    valid = (linearEnd <= dataSize - rowStart * width * bytesPerPixel) & (addrs + bytesPerPixel <= dataSize)
+
+    return np.where(valid, addrs, 0xFFFFFFFF).astype(np.uint32)
+
+
+def deswizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
+              pitch, bpp, slice, sample, data, result=None, firstRow=0, numRows=None):
+
+    if numRows is None:
+        numRows = height - firstRow
+
+    if result is None:
+        result = bytearray(len(data))
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, len(data), result, firstRow, numRows, False)
+
+
+def swizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
+            pitch, bpp, slice, sample, data, result=None):
+
+    if result is None:
+        result = bytearray(len(data))
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, len(data), result, 0, height, True)
@@ -13,96 +13,195 @@ try:
     pyximport.install()
 
     from . import decompress_cy as decompress_
+    tier = "Cython"
 
 except:
-    from . import decompress_
-
+    # The per-texel Python path is very slow,
+    # use the NumPy decoder instead if available
+    try:
+        from . import decompress_np as decompress_
+        tier = "NumPy"
+
+    except ImportError:
+        from . import decompress_
+        tier = "Python"
+
+
+def decompressDXT1(data, width, height, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: addresses of the blocks in data (see addrlib.getSurfaceAddrs()),
+                decodes the blocks straight from swizzled data without deswizzling it first
+    stats: dict with "blocks" and "reused" counters, the number of decoded blocks
+           and of blocks reused from the previous identical one are added to it
+    """
+
+    try:
+        data = memoryview(data).cast('B')
+
+    except:
+        print("Couldn't decompress data")
+        return b''
 
-def decompressDXT1(data, width, height):
-    if not isinstance(data, bytes):
-        try:
-            data = bytes(data)
+    if output is not None and len(output) < width * height * 4:
+        print("Output buffer is too small")
+        return b''
 
-        except:
-            print("Couldn't decompress data")
+    if blockAddrs is not None:
+        blockAddrs = memoryview(blockAddrs).cast('B').cast('I')
+        if len(blockAddrs) < ((width + 3) // 4) * ((height + 3) // 4):
+            print("Block addresses are incomplete")
             return b''
 
+        return decompress_.decompressDXT1(data, width, height, output, blockAddrs, stats=stats)
+
     csize = ((width + 3) // 4) * ((height + 3) // 4) * 8
     if len(data) < csize:
         print("Compressed data is incomplete")
         return b''
 
     data = data[:csize]
-    return decompress_.decompressDXT1(data, width, height)
+    return decompress_.decompressDXT1(data, width, height, output, stats=stats)
+
+
+def decompressDXT3(data, width, height, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: addresses of the blocks in data (see addrlib.getSurfaceAddrs()),
+                decodes the blocks straight from swizzled data without deswizzling it first
+    stats: dict with "blocks" and "reused" counters, the number of decoded blocks
+           and of blocks reused from the previous identical one are added to it
+    """
+
+    try:
+        data = memoryview(data).cast('B')
 
+    except:
+        print("Couldn't decompress data")
+        return b''
 
-def decompressDXT3(data, width, height):
-    if not isinstance(data, bytes):
-        try:
-            data = bytes(data)
+    if output is not None and len(output) < width * height * 4:
+        print("Output buffer is too small")
+        return b''
 
-        except:
-            print("Couldn't decompress data")
+    if blockAddrs is not None:
+        blockAddrs = memoryview(blockAddrs).cast('B').cast('I')
+        if len(blockAddrs) < ((width + 3) // 4) * ((height + 3) // 4):
+            print("Block addresses are incomplete")
             return b''
 
+        return decompress_.decompressDXT3(data, width, height, output, blockAddrs, stats=stats)
+
     csize = ((width + 3) // 4) * ((height + 3) // 4) * 16
     if len(data) < csize:
         print("Compressed data is incomplete")
         return b''
 
     data = data[:csize]
-    return decompress_.decompressDXT3(data, width, height)
+    return decompress_.decompressDXT3(data, width, height, output, stats=stats)
+
 
+def decompressDXT5(data, width, height, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: addresses of the blocks in data (see addrlib.getSurfaceAddrs()),
+                decodes the blocks straight from swizzled data without deswizzling it first
+    stats: dict with "blocks" and "reused" counters, the number of decoded blocks
+           and of blocks reused from the previous identical one are added to it
+    """
+
+    try:
+        data = memoryview(data).cast('B')
+
+    except:
+        print("Couldn't decompress data")
+        return b''
 
-def decompressDXT5(data, width, height):
-    if not isinstance(data, bytes):
-        try:
-            data = bytes(data)
+    if output is not None and len(output) < width * height * 4:
+        print("Output buffer is too small")
+        return b''
 
-        except:
-            print("Couldn't decompress data")
+    if blockAddrs is not None:
+        blockAddrs = memoryview(blockAddrs).cast('B').cast('I')
+        if len(blockAddrs) < ((width + 3) // 4) * ((height + 3) // 4):
+            print("Block addresses are incomplete")
             return b''
 
+        return decompress_.decompressDXT5(data, width, height, output, blockAddrs, stats=stats)
+
     csize = ((width + 3) // 4) * ((height + 3) // 4) * 16
     if len(data) < csize:
         print("Compressed data is incomplete")
         return b''
 
     data = data[:csize]
-    return decompress_.decompressDXT5(data, width, height)
+    return decompress_.decompressDXT5(data, width, height, output, stats=stats)
+
+
+def decompressBC4(data, width, height, SNORM=0, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: addresses of the blocks in data (see addrlib.getSurfaceAddrs()),
+                decodes the blocks straight from swizzled data without deswizzling it first
+    stats: dict with "blocks" and "reused" counters, the number of decoded blocks
+           and of blocks reused from the previous identical one are added to it
+    """
 
+    try:
+        data = memoryview(data).cast('B')
 
-def decompressBC4(data, width, height, SNORM=0):
-    if not isinstance(data, bytes):
-        try:
-            data = bytes(data)
+    except:
+        print("Couldn't decompress data")
+        return b''
+
+    if output is not None and len(output) < width * height * 4:
+        print("Output buffer is too small")
+        return b''
 
-        except:
-            print("Couldn't decompress data")
+    if blockAddrs is not None:
+        blockAddrs = memoryview(blockAddrs).cast('B').cast('I')
+        if len(blockAddrs) < ((width + 3) // 4) * ((height + 3) // 4):
+            print("Block addresses are incomplete")
             return b''
 
+        return decompress_.decompressBC4(data, width, height, SNORM, output, blockAddrs, stats=stats)
+
     csize = ((width + 3) // 4) * ((height + 3) // 4) * 8
     if len(data) < csize:
         print("Compressed data is incomplete")
         return b''
 
     data = data[:csize]
-    return decompress_.decompressBC4(data, width, height, SNORM)
+    return decompress_.decompressBC4(data, width, height, SNORM, output, stats=stats)
+
 
+def decompressBC5(data, width, height, SNORM=0, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: addresses of the blocks in data (see addrlib.getSurfaceAddrs()),
+                decodes the blocks straight from swizzled data without deswizzling it first
+    stats: dict with "blocks" and "reused" counters, the number of decoded blocks
+           and of blocks reused from the previous identical one are added to it
+    """
 
-def decompressBC5(data, width, height, SNORM=0):
-    if not isinstance(data, bytes):
-        try:
-            data = bytes(data)
+    try:
+        data = memoryview(data).cast('B')
+
+    except:
+        print("Couldn't decompress data")
+        return b''
 
-        except:
-            print("Couldn't decompress data")
+    if output is not None and len(output) < width * height * 4:
+        print("Output buffer is too small")
+        return b''
+
+    if blockAddrs is not None:
+        blockAddrs = memoryview(blockAddrs).cast('B').cast('I')
+        if len(blockAddrs) < ((width + 3) // 4) * ((height + 3) // 4):
+            print("Block addresses are incomplete")
             return b''
 
+        return decompress_.decompressBC5(data, width, height, SNORM, output, blockAddrs, stats=stats)
+
     csize = ((width + 3) // 4) * ((height + 3) // 4) * 16
     if len(data) < csize:
         print("Compressed data is incomplete")
         return b''
 
     data = data[:csize]
-    return decompress_.decompressBC5(data, width, height, SNORM)
+    return decompress_.decompressBC5(data, width, height, SNORM, output, stats=stats)
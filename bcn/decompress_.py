@@ -54,279 +54,233 @@ def EXP4TO8(col):
     return col | col << 4
 
 
-def dxt135_decode_imageblock(pixdata, img_block_src, i, j, dxt_type):
-    color0 = pixdata[img_block_src] | (pixdata[img_block_src + 1] << 8)
-    color1 = pixdata[img_block_src + 2] | (pixdata[img_block_src + 3] << 8)
-    bits = (pixdata[img_block_src + 4] | (pixdata[img_block_src + 5] << 8) |
-            (pixdata[img_block_src + 6] << 16) | (pixdata[img_block_src + 7] << 24))
-
-    bit_pos = 2 * (j * 4 + i)
-    code = (bits >> bit_pos) & 3
-
-    ACOMP = 255
-    if code == 0:
-        RCOMP = EXP5TO8R(color0)
-        GCOMP = EXP6TO8G(color0)
-        BCOMP = EXP5TO8B(color0)
-
-    elif code == 1:
-        RCOMP = EXP5TO8R(color1)
-        GCOMP = EXP6TO8G(color1)
-        BCOMP = EXP5TO8B(color1)
-
-    elif code == 2:
-        if color0 > color1:
-            RCOMP = ((EXP5TO8R(color0) * 2 + EXP5TO8R(color1)) // 3)
-            GCOMP = ((EXP6TO8G(color0) * 2 + EXP6TO8G(color1)) // 3)
-            BCOMP = ((EXP5TO8B(color0) * 2 + EXP5TO8B(color1)) // 3)
-
-        else:
-            RCOMP = ((EXP5TO8R(color0) + EXP5TO8R(color1)) // 2)
-            GCOMP = ((EXP6TO8G(color0) + EXP6TO8G(color1)) // 2)
-            BCOMP = ((EXP5TO8B(color0) + EXP5TO8B(color1)) // 2)
-
-    elif code == 3:
-        if dxt_type > 1 or color0 > color1:
-            RCOMP = ((EXP5TO8R(color0) + EXP5TO8R(color1) * 2) // 3)
-            GCOMP = ((EXP6TO8G(color0) + EXP6TO8G(color1) * 2) // 3)
-            BCOMP = ((EXP5TO8B(color0) + EXP5TO8B(color1) * 2) // 3)
-
-        else:
-            RCOMP = 0
-            GCOMP = 0
-            BCOMP = 0
-
-            if dxt_type == 1:
-                ACOMP = 0
- 
-    return ACOMP, RCOMP, GCOMP, BCOMP
-
-
-def dxt5_decode_alphablock(pixdata, blksrc, i, j):
-    alpha0 = pixdata[blksrc]
-    alpha1 = pixdata[blksrc + 1]
-
-    bits = (pixdata[blksrc] | (pixdata[blksrc + 1] << 8) |
-            (pixdata[blksrc + 2] << 16) | (pixdata[blksrc + 3] << 24) |
-            (pixdata[blksrc + 4] << 32) | (pixdata[blksrc + 5] << 40) |
-            (pixdata[blksrc + 6] << 48) | (pixdata[blksrc + 7] << 56)) >> 16
+def dxt135_decode_colorblock(pixdata, blksrc, dxt_type, texels):
+    """
+    Decodes the colors of a whole 4x4 block to texels (RGBA8, 64 bytes).
+    The palette is built once, then every texel is looked up from its 2-bit code.
+    """
 
-    for y in range(4):
-        for x in range(4):
-            if (x, y) == (i, j):
-                code = bits & 0x07
-                break
+    color0 = pixdata[blksrc] | (pixdata[blksrc + 1] << 8)
+    color1 = pixdata[blksrc + 2] | (pixdata[blksrc + 3] << 8)
+    bits = (pixdata[blksrc + 4] | (pixdata[blksrc + 5] << 8) |
+            (pixdata[blksrc + 6] << 16) | (pixdata[blksrc + 7] << 24))
 
-            bits >>= 3
+    R0, G0, B0 = EXP5TO8R(color0), EXP6TO8G(color0), EXP5TO8B(color0)
+    R1, G1, B1 = EXP5TO8R(color1), EXP6TO8G(color1), EXP5TO8B(color1)
 
-    if code == 0:
-        ACOMP = alpha0
+    palette = [(R0, G0, B0, 255), (R1, G1, B1, 255)]
 
-    elif code == 1:
-        ACOMP = alpha1
+    if color0 > color1:
+        palette.append(((R0 * 2 + R1) // 3, (G0 * 2 + G1) // 3, (B0 * 2 + B1) // 3, 255))
 
-    elif alpha0 > alpha1:
-        ACOMP = (alpha0 * (8 - code) + (alpha1 * (code - 1))) // 7
+    else:
+        palette.append(((R0 + R1) // 2, (G0 + G1) // 2, (B0 + B1) // 2, 255))
 
-    elif code < 6:
-        ACOMP = (alpha0 * (6 - code) + (alpha1 * (code - 1))) // 5
+    if dxt_type > 1 or color0 > color1:
+        palette.append(((R0 + R1 * 2) // 3, (G0 + G1 * 2) // 3, (B0 + B1 * 2) // 3, 255))
 
-    elif code == 6:
-        ACOMP = 0
+    elif dxt_type == 1:
+        palette.append((0, 0, 0, 0))
 
     else:
-        ACOMP = 255
+        palette.append((0, 0, 0, 255))
+
+    for k in range(16):
+        texels[k * 4:k * 4 + 4] = palette[(bits >> (2 * k)) & 3]
 
-    return ACOMP
 
+def dxt5_decode_alphablock(pixdata, blksrc, alphas):
+    """
+    Decodes the 16 alpha values of a BC3/BC4/BC5 alpha block to alphas.
+    """
 
-def dxt5_decode_alphablock_signed(pixdata, blksrc, i, j):
     alpha0 = pixdata[blksrc]
     alpha1 = pixdata[blksrc + 1]
 
-    bits = (pixdata[blksrc] | (pixdata[blksrc + 1] << 8) |
-            (pixdata[blksrc + 2] << 16) | (pixdata[blksrc + 3] << 24) |
-            (pixdata[blksrc + 4] << 32) | (pixdata[blksrc + 5] << 40) |
-            (pixdata[blksrc + 6] << 48) | (pixdata[blksrc + 7] << 56)) >> 16
+    bits = (pixdata[blksrc + 2] | (pixdata[blksrc + 3] << 8) |
+            (pixdata[blksrc + 4] << 16) | (pixdata[blksrc + 5] << 24) |
+            (pixdata[blksrc + 6] << 32) | (pixdata[blksrc + 7] << 40))
 
-    for y in range(4):
-        for x in range(4):
-            if (x, y) == (i, j):
-                code = bits & 0x07
-                break
+    palette = [alpha0, alpha1]
 
-            bits >>= 3
+    if alpha0 > alpha1:
+        palette += [(alpha0 * (8 - code) + (alpha1 * (code - 1))) // 7 for code in range(2, 8)]
 
-    if code == 0:
-        ACOMP = alpha0
+    else:
+        palette += [(alpha0 * (6 - code) + (alpha1 * (code - 1))) // 5 for code in range(2, 6)]
+        palette += [0, 255]
+
+    for k in range(16):
+        alphas[k] = palette[(bits >> (3 * k)) & 7]
+
+
+def dxt5_decode_alphablock_signed(pixdata, blksrc, alphas):
+    alpha0 = pixdata[blksrc]
+    alpha1 = pixdata[blksrc + 1]
 
-    elif code == 1:
-        ACOMP = alpha1
+    bits = (pixdata[blksrc + 2] | (pixdata[blksrc + 3] << 8) |
+            (pixdata[blksrc + 4] << 16) | (pixdata[blksrc + 5] << 24) |
+            (pixdata[blksrc + 6] << 32) | (pixdata[blksrc + 7] << 40))
 
-    elif ToSigned8(alpha0) > ToSigned8(alpha1):
-        ACOMP = ToUnsigned8((ToSigned8(alpha0) * (8 - code) + (ToSigned8(alpha1) * (code - 1))) // 7)
+    palette = [alpha0, alpha1]
 
-    elif code < 6:
-        ACOMP = ToUnsigned8((ToSigned8(alpha0) * (6 - code) + (ToSigned8(alpha1) * (code - 1))) // 5)
+    signed0 = ToSigned8(alpha0)
+    signed1 = ToSigned8(alpha1)
 
-    elif code == 6:
-        ACOMP = 0x80
+    if signed0 > signed1:
+        palette += [ToUnsigned8((signed0 * (8 - code) + (signed1 * (code - 1))) // 7) for code in range(2, 8)]
 
     else:
-        ACOMP = 0x7f
+        palette += [ToUnsigned8((signed0 * (6 - code) + (signed1 * (code - 1))) // 5) for code in range(2, 6)]
+        palette += [0x80, 0x7f]
 
-    return ACOMP
+    for k in range(16):
+        alphas[k] = palette[(bits >> (3 * k)) & 7]
 
 
-def fetch_2d_texel_rgba_dxt1(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 8
-    ACOMP, RCOMP, GCOMP, BCOMP = dxt135_decode_imageblock(pixdata, blksrc, i & 3, j & 3, 1)
- 
-    return RCOMP, GCOMP, BCOMP, ACOMP
+# Blocks that are out of the data are decoded as zeros
+zeroBlock = bytes(16)
 
 
-def fetch_2d_texel_rgba_dxt3(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
-    ACOMP, RCOMP, GCOMP, BCOMP = dxt135_decode_imageblock(pixdata, blksrc + 8, i & 3, j & 3, 2)
+def getBlock(data, blockAddrs, blk, blockSize):
+    """
+    Returns the data and offset of the given block, either in linear order or at its address in blockAddrs.
+    """
 
-    anibble = (pixdata[blksrc + ((j & 3) * 4 + (i & 3)) // 2] >> (4 * (i & 1))) & 0xf
-    ACOMP = EXP4TO8(anibble)
- 
-    return RCOMP, GCOMP, BCOMP, ACOMP
+    if blockAddrs is None:
+        return data, blk * blockSize
 
+    addr = blockAddrs[blk]
+    if addr + blockSize > len(data):
+        return zeroBlock, 0
 
-def fetch_2d_texel_rgba_dxt5(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
+    return data, addr
 
-    ACOMP = dxt5_decode_alphablock(pixdata, blksrc, i & 3, j & 3)
-    _, RCOMP, GCOMP, BCOMP = dxt135_decode_imageblock(pixdata, blksrc + 8, i & 3, j & 3, 2)
 
-    return RCOMP, GCOMP, BCOMP, ACOMP
+def writeBlock(texels, output, width, height, x, y):
+    """
+    Writes the texels of a decoded block to output, skipping the ones outside of the image.
+    """
 
+    rowSize = min(4, width - x) * 4
 
-def fetch_2d_texel_r_bc4(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 8
-    RCOMP = dxt5_decode_alphablock(pixdata, blksrc, i & 3, j & 3)
- 
-    return RCOMP
+    for j in range(min(4, height - y)):
+        pos = ((y + j) * width + x) * 4
+        output[pos:pos + rowSize] = texels[j * 16:j * 16 + rowSize]
 
 
-def fetch_2d_texel_r_bc4_snorm(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 8
-    RCOMP = dxt5_decode_alphablock_signed(pixdata, blksrc, i & 3, j & 3)
- 
-    return RCOMP
+def decompressBlocks(data, width, height, output, blockAddrs, blockSize, decodeBlock, stats=None):
+    if output is None:
+        output = bytearray(width * height * 4)
 
+    blocksPerRow = (width + 3) // 4
+    texels = bytearray(64)
 
-def fetch_2d_texel_rg_bc5(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
+    # Flat regions are made of identical blocks,
+    # reuse the texels of the previous block instead of decoding them again
+    prevBlock = None
+    numBlocks = numReused = 0
 
-    RCOMP = dxt5_decode_alphablock(pixdata, blksrc, i & 3, j & 3)
-    GCOMP = dxt5_decode_alphablock(pixdata, blksrc + 8, i & 3, j & 3)
- 
-    return RCOMP, GCOMP
+    for y in range(0, height, 4):
+        for x in range(0, width, 4):
+            pixdata, blksrc = getBlock(data, blockAddrs, (y >> 2) * blocksPerRow + (x >> 2), blockSize)
+            block = bytes(pixdata[blksrc:blksrc + blockSize])
+            numBlocks += 1
 
+            if block == prevBlock:
+                numReused += 1
 
-def fetch_2d_texel_rg_bc5_snorm(srcRowStride, pixdata, i, j):
-    blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
+            else:
+                decodeBlock(pixdata, blksrc, texels)
+                prevBlock = block
 
-    RCOMP = dxt5_decode_alphablock_signed(pixdata, blksrc, i & 3, j & 3)
-    GCOMP = dxt5_decode_alphablock_signed(pixdata, blksrc + 8, i & 3, j & 3)
- 
-    return RCOMP, GCOMP
+            writeBlock(texels, output, width, height, x, y)
 
+    if stats is not None:
+        stats["blocks"] += numBlocks
+        stats["reused"] += numReused
 
-def decompressDXT1(data, width, height):
-    output = bytearray(width * height * 4)
- 
-    for y in range(height):
-        for x in range(width):
-            R, G, B, A = fetch_2d_texel_rgba_dxt1(width, data, x, y)
+    return output
 
-            pos = (y * width + x) * 4
 
-            output[pos + 0] = R
-            output[pos + 1] = G
-            output[pos + 2] = B
-            output[pos + 3] = A
- 
-    return bytes(output)
+def decodeDXT1Block(pixdata, blksrc, texels):
+    dxt135_decode_colorblock(pixdata, blksrc, 1, texels)
 
 
-def decompressDXT3(data, width, height):
-    output = bytearray(width * height * 4)
- 
-    for y in range(height):
-        for x in range(width):
-            R, G, B, A = fetch_2d_texel_rgba_dxt3(width, data, x, y)
+def decodeDXT3Block(pixdata, blksrc, texels):
+    dxt135_decode_colorblock(pixdata, blksrc + 8, 2, texels)
 
-            pos = (y * width + x) * 4
+    for k in range(16):
+        anibble = (pixdata[blksrc + k // 2] >> (4 * (k & 1))) & 0xf
+        texels[k * 4 + 3] = EXP4TO8(anibble)
 
-            output[pos + 0] = R
-            output[pos + 1] = G
-            output[pos + 2] = B
-            output[pos + 3] = A
- 
-    return bytes(output)
 
+def decodeDXT5Block(pixdata, blksrc, texels):
+    dxt135_decode_colorblock(pixdata, blksrc + 8, 2, texels)
+    dxt5_decode_alphablock(pixdata, blksrc, memoryview(texels)[3::4])
 
-def decompressDXT5(data, width, height):
-    output = bytearray(width * height * 4)
- 
-    for y in range(height):
-        for x in range(width):
-            R, G, B, A = fetch_2d_texel_rgba_dxt5(width, data, x, y)
 
-            pos = (y * width + x) * 4
+def decodeBC4Block(pixdata, blksrc, texels):
+    R = [0] * 16
+    dxt5_decode_alphablock(pixdata, blksrc, R)
 
-            output[pos + 0] = R
-            output[pos + 1] = G
-            output[pos + 2] = B
-            output[pos + 3] = A
- 
-    return bytes(output)
+    for k in range(16):
+        texels[k * 4:k * 4 + 4] = (R[k], R[k], R[k], 255)
 
 
-def decompressBC4(data, width, height, SNORM):
-    output = bytearray(width * height * 4)
+def decodeBC4SNORMBlock(pixdata, blksrc, texels):
+    R = [0] * 16
+    dxt5_decode_alphablock_signed(pixdata, blksrc, R)
 
-    for y in range(height):
-        for x in range(width):
-            if SNORM:
-                R = ToSigned8(fetch_2d_texel_r_bc4_snorm(width, data, x, y)) + 128
+    for k in range(16):
+        r = ToSigned8(R[k]) + 128
+        texels[k * 4:k * 4 + 4] = (r, r, r, 255)
 
-            else:
-                R = fetch_2d_texel_r_bc4(width, data, x, y)
 
-            pos = (y * width + x) * 4
+def decodeBC5Block(pixdata, blksrc, texels):
+    R = [0] * 16
+    G = [0] * 16
+    dxt5_decode_alphablock(pixdata, blksrc, R)
+    dxt5_decode_alphablock(pixdata, blksrc + 8, G)
 
-            output[pos + 0] = R
-            output[pos + 1] = R
-            output[pos + 2] = R
-            output[pos + 3] = 255
- 
-    return bytes(output)
+    for k in range(16):
+        texels[k * 4:k * 4 + 4] = (R[k], G[k], 0, 255)
 
 
-def decompressBC5(data, width, height, SNORM):
-    output = bytearray(width * height * 4)
+def decodeBC5SNORMBlock(pixdata, blksrc, texels):
+    R = [0] * 16
+    G = [0] * 16
+    dxt5_decode_alphablock_signed(pixdata, blksrc, R)
+    dxt5_decode_alphablock_signed(pixdata, blksrc + 8, G)
 
-    for y in range(height):
-        for x in range(width):
-            if SNORM:
-                R, G = fetch_2d_texel_rg_bc5_snorm(width, data, x, y)
+    for k in range(16):
+        texels[k * 4:k * 4 + 4] = (ToSigned8(R[k]) + 128, ToSigned8(G[k]) + 128, 0, 255)
 
-                R = ToSigned8(R) + 128
-                G = ToSigned8(G) + 128
 
-            else:
-                R, G = fetch_2d_texel_rg_bc5(width, data, x, y)
+def decompressDXT1(data, width, height, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: address of every block in data (in linear order), for decoding straight from swizzled data
+                (see addrlib.getSurfaceAddrs()), the blocks are assumed to be in linear order if not given
+    stats: dict, the number of blocks and of blocks reused from the previous identical one
+           are added to its "blocks" and "reused" counters
+    """
+
+    return decompressBlocks(data, width, height, output, blockAddrs, 8, decodeDXT1Block, stats)
+
+
+def decompressDXT3(data, width, height, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16, decodeDXT3Block, stats)
+
+
+def decompressDXT5(data, width, height, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16, decodeDXT5Block, stats)
+
+
+def decompressBC4(data, width, height, SNORM, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 8,
+                            decodeBC4SNORMBlock if SNORM else decodeBC4Block, stats)
 
-            pos = (y * width + x) * 4
 
-            output[pos + 0] = R
-            output[pos + 1] = G
-            output[pos + 2] = 0
-            output[pos + 3] = 255
- 
-    return bytes(output)
+def decompressBC5(data, width, height, SNORM, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16,
+                            decodeBC5SNORMBlock if SNORM else decodeBC5Block, stats)
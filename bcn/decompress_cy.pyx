@@ -11,9 +11,8 @@
 ################################################################
 ################################################################
 
-from cpython cimport array
-from cython cimport view
-from libc.stdlib cimport malloc, free
+
+from libc.string cimport memcmp, memcpy
 
 
 ctypedef unsigned char u8
@@ -22,352 +21,331 @@ ctypedef unsigned int u32
 ctypedef unsigned long long u64
 
 
-cdef u8 EXP5TO8R(u16 packedcol):
+cdef u8 EXP5TO8R(u16 packedcol) noexcept nogil:
     return (((packedcol) >> 8) & 0xf8) | (((packedcol) >> 13) & 0x07)
 
 
-cdef u8 EXP6TO8G(u16 packedcol):
+cdef u8 EXP6TO8G(u16 packedcol) noexcept nogil:
     return (((packedcol) >> 3) & 0xfc) | (((packedcol) >>  9) & 0x03)
 
 
-cdef u8 EXP5TO8B(u16 packedcol):
+cdef u8 EXP5TO8B(u16 packedcol) noexcept nogil:
     return (((packedcol) << 3) & 0xf8) | (((packedcol) >>  2) & 0x07)
 
 
-cdef u8 EXP4TO8(u8 col):
+cdef u8 EXP4TO8(u8 col) noexcept nogil:
     return col | col << 4
 
 
-cdef (u8, u8, u8, u8) dxt135_decode_imageblock(u8 pixdata[], u32 img_block_src, u8 i, u8 j, u8 dxt_type):
-    cdef:
-        u16 color0 = pixdata[img_block_src] | (pixdata[img_block_src + 1] << 8)
-        u16 color1 = pixdata[img_block_src + 2] | (pixdata[img_block_src + 3] << 8)
-        u32 bits = (pixdata[img_block_src + 4] | (pixdata[img_block_src + 5] << 8) |
-                    (pixdata[img_block_src + 6] << 16) | (pixdata[img_block_src + 7] << 24))
-
-        u8 bit_pos = 2 * (j * 4 + i)
-        u8 code = (bits >> bit_pos) & 3
- 
-        u8 ACOMP, RCOMP, GCOMP, BCOMP
-
-    ACOMP = 255
-    if code == 0:
-        RCOMP = EXP5TO8R(color0)
-        GCOMP = EXP6TO8G(color0)
-        BCOMP = EXP5TO8B(color0)
-
-    elif code == 1:
-        RCOMP = EXP5TO8R(color1)
-        GCOMP = EXP6TO8G(color1)
-        BCOMP = EXP5TO8B(color1)
-
-    elif code == 2:
-        if color0 > color1:
-            RCOMP = ((EXP5TO8R(color0) * 2 + EXP5TO8R(color1)) // 3)
-            GCOMP = ((EXP6TO8G(color0) * 2 + EXP6TO8G(color1)) // 3)
-            BCOMP = ((EXP5TO8B(color0) * 2 + EXP5TO8B(color1)) // 3)
-
-        else:
-            RCOMP = ((EXP5TO8R(color0) + EXP5TO8R(color1)) // 2)
-            GCOMP = ((EXP6TO8G(color0) + EXP6TO8G(color1)) // 2)
-            BCOMP = ((EXP5TO8B(color0) + EXP5TO8B(color1)) // 2)
-
-    elif code == 3:
-        if dxt_type > 1 or color0 > color1:
-            RCOMP = ((EXP5TO8R(color0) + EXP5TO8R(color1) * 2) // 3)
-            GCOMP = ((EXP6TO8G(color0) + EXP6TO8G(color1) * 2) // 3)
-            BCOMP = ((EXP5TO8B(color0) + EXP5TO8B(color1) * 2) // 3)
-
-        else:
-            RCOMP = 0
-            GCOMP = 0
-            BCOMP = 0
-
-            if dxt_type == 1:
-                ACOMP = 0
- 
-    return ACOMP, RCOMP, GCOMP, BCOMP
-
-
-cdef u8 dxt5_decode_alphablock(u8 pixdata[], u32 blksrc, u8 i, u8 j):
+cdef void dxt135_decode_colorblock(const u8 *pixdata, u8 dxt_type, u8 *texels) noexcept nogil:
+    """
+    Decodes the colors of a whole 4x4 block to texels (RGBA8, 64 bytes).
+    The palette is built once, then every texel is looked up from its 2-bit code.
+    """
+
     cdef:
-        u8 alpha0 = pixdata[blksrc]
-        u8 alpha1 = pixdata[blksrc + 1]
+        u16 color0 = pixdata[0] | (pixdata[1] << 8)
+        u16 color1 = pixdata[2] | (pixdata[3] << 8)
+        u32 bits = (pixdata[4] | (pixdata[5] << 8) |
+                    (pixdata[6] << 16) | (pixdata[7] << 24))
 
-        u8 bit_pos = ((j & 3) * 4 + (i & 3)) * 3
-        u8 acodelow = pixdata[blksrc + 2 + bit_pos // 8]
-        u8 acodehigh = pixdata[blksrc + 3 + bit_pos // 8]
-        u8 code = (acodelow >> (bit_pos & 0x07) |
-                (acodehigh << (8 - (bit_pos & 0x07)))) & 0x07
+        u8 R0 = EXP5TO8R(color0), G0 = EXP6TO8G(color0), B0 = EXP5TO8B(color0)
+        u8 R1 = EXP5TO8R(color1), G1 = EXP6TO8G(color1), B1 = EXP5TO8B(color1)
 
-    if code == 0:
-        ACOMP = alpha0
+        u8 palette[4][4]
+        u32 k, code
 
-    elif code == 1:
-        ACOMP = alpha1
+    palette[0][0] = R0; palette[0][1] = G0; palette[0][2] = B0; palette[0][3] = 255
+    palette[1][0] = R1; palette[1][1] = G1; palette[1][2] = B1; palette[1][3] = 255
 
-    elif alpha0 > alpha1:
-        ACOMP = (alpha0 * (8 - code) + (alpha1 * (code - 1))) // 7
+    if color0 > color1:
+        palette[2][0] = (R0 * 2 + R1) // 3
+        palette[2][1] = (G0 * 2 + G1) // 3
+        palette[2][2] = (B0 * 2 + B1) // 3
+
+    else:
+        palette[2][0] = (R0 + R1) // 2
+        palette[2][1] = (G0 + G1) // 2
+        palette[2][2] = (B0 + B1) // 2
 
-    elif code < 6:
-        ACOMP = (alpha0 * (6 - code) + (alpha1 * (code - 1))) // 5
+    palette[2][3] = 255
 
-    elif code == 6:
-        ACOMP = 0
+    if dxt_type > 1 or color0 > color1:
+        palette[3][0] = (R0 + R1 * 2) // 3
+        palette[3][1] = (G0 + G1 * 2) // 3
+        palette[3][2] = (B0 + B1 * 2) // 3
+        palette[3][3] = 255
 
     else:
-        ACOMP = 255
- 
-    return ACOMP
+        palette[3][0] = 0
+        palette[3][1] = 0
+        palette[3][2] = 0
+        palette[3][3] = 0 if dxt_type == 1 else 255
 
+    for k in range(16):
+        code = (bits >> (2 * k)) & 3
+        memcpy(texels + k * 4, palette[code], 4)
 
-cdef u8 dxt5_decode_alphablock_signed(u8 pixdata[], u32 blksrc, u8 i, u8 j):
-    cdef:
-        u8 alpha0 = pixdata[blksrc]
-        u8 alpha1 = pixdata[blksrc + 1]
 
-        u8 bit_pos = ((j & 3) * 4 + (i & 3)) * 3
-        u8 acodelow = pixdata[blksrc + 2 + bit_pos // 8]
-        u8 acodehigh = pixdata[blksrc + 3 + bit_pos // 8]
-        u8 code = (acodelow >> (bit_pos & 0x07) |
-                (acodehigh << (8 - (bit_pos & 0x07)))) & 0x07
+cdef void dxt5_decode_alphablock(const u8 *pixdata, u8 *alphas, u32 stride) noexcept nogil:
+    """
+    Decodes the 16 alpha values of a BC3/BC4/BC5 alpha block to every stride-th byte of alphas.
+    """
 
-    if code == 0:
-        ACOMP = alpha0
+    cdef:
+        u8 alpha0 = pixdata[0]
+        u8 alpha1 = pixdata[1]
 
-    elif code == 1:
-        ACOMP = alpha1
+        u64 bits = (<u64>pixdata[2] | (<u64>pixdata[3] << 8) |
+                    (<u64>pixdata[4] << 16) | (<u64>pixdata[5] << 24) |
+                    (<u64>pixdata[6] << 32) | (<u64>pixdata[7] << 40))
 
-    elif <char>alpha0 > <char>alpha1:
-        ACOMP = <u8>((<char>alpha0 * (8 - code) + (<char>alpha1 * (code - 1))) // 7)
+        u8 palette[8]
+        u32 k, code
 
-    elif code < 6:
-        ACOMP = <u8>((<char>alpha0 * (6 - code) + (<char>alpha1 * (code - 1))) // 5)
+    palette[0] = alpha0
+    palette[1] = alpha1
 
-    elif code == 6:
-        ACOMP = 0x80
+    if alpha0 > alpha1:
+        for code in range(2, 8):
+            palette[code] = (alpha0 * (8 - code) + (alpha1 * (code - 1))) // 7
 
     else:
-        ACOMP = 0x7f
- 
-    return ACOMP
+        for code in range(2, 6):
+            palette[code] = (alpha0 * (6 - code) + (alpha1 * (code - 1))) // 5
+
+        palette[6] = 0
+        palette[7] = 255
 
+    for k in range(16):
+        alphas[k * stride] = palette[(bits >> (3 * k)) & 7]
 
-cdef (u8, u8, u8, u8) fetch_2d_texel_rgba_dxt1(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
+
+cdef void dxt5_decode_alphablock_signed(const u8 *pixdata, u8 *alphas, u32 stride) noexcept nogil:
     cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 8
-        u8 ACOMP, RCOMP, GCOMP, BCOMP
+        u8 alpha0 = pixdata[0]
+        u8 alpha1 = pixdata[1]
 
-    ACOMP, RCOMP, GCOMP, BCOMP = dxt135_decode_imageblock(pixdata, blksrc, i & 3, j & 3, 1)
- 
-    return RCOMP, GCOMP, BCOMP, ACOMP
+        u64 bits = (<u64>pixdata[2] | (<u64>pixdata[3] << 8) |
+                    (<u64>pixdata[4] << 16) | (<u64>pixdata[5] << 24) |
+                    (<u64>pixdata[6] << 32) | (<u64>pixdata[7] << 40))
 
+        u8 palette[8]
+        int code
+        u32 k
 
-cdef (u8, u8, u8, u8) fetch_2d_texel_rgba_dxt3(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
-    cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
-        u8 ACOMP, RCOMP, GCOMP, BCOMP
+    palette[0] = alpha0
+    palette[1] = alpha1
 
-    ACOMP, RCOMP, GCOMP, BCOMP = dxt135_decode_imageblock(pixdata, blksrc + 8, i & 3, j & 3, 2)
+    if <char>alpha0 > <char>alpha1:
+        for code in range(2, 8):
+            palette[code] = <u8>((<char>alpha0 * (8 - code) + (<char>alpha1 * (code - 1))) // 7)
 
-    cdef u8 anibble = (pixdata[blksrc + ((j & 3) * 4 + (i & 3)) // 2] >> (4 * (i & 1))) & 0xf
-    ACOMP = EXP4TO8(anibble)
- 
-    return RCOMP, GCOMP, BCOMP, ACOMP
+    else:
+        for code in range(2, 6):
+            palette[code] = <u8>((<char>alpha0 * (6 - code) + (<char>alpha1 * (code - 1))) // 5)
 
+        palette[6] = 0x80
+        palette[7] = 0x7f
 
-cdef (u8, u8, u8, u8) fetch_2d_texel_rgba_dxt5(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
-    cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
+    for k in range(16):
+        alphas[k * stride] = palette[(bits >> (3 * k)) & 7]
 
-        u8 ACOMP = dxt5_decode_alphablock(pixdata, blksrc, i & 3, j & 3)
-        u8 RCOMP, GCOMP, BCOMP
 
-    _, RCOMP, GCOMP, BCOMP = dxt135_decode_imageblock(pixdata, blksrc + 8, i & 3, j & 3, 2)
+# Blocks that are out of the data are decoded as zeros
+cdef u8 zeroBlock[16]
 
-    return RCOMP, GCOMP, BCOMP, ACOMP
 
+cdef inline const u8 *getBlock(const u8 *data, u64 dataSize, const u32 *blockAddrs, u32 blk, u32 blockSize) noexcept nogil:
+    """
+    Returns a pointer to the given block, either in linear order or at its address in blockAddrs.
+    """
 
-cdef u8 fetch_2d_texel_r_bc4(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
-    cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 8
-        u8 RCOMP = dxt5_decode_alphablock(pixdata, blksrc, i & 3, j & 3)
- 
-    return RCOMP
+    cdef u64 addr
 
+    if blockAddrs == NULL:
+        return data + <u64>blk * blockSize
 
-cdef u8 fetch_2d_texel_r_bc4_snorm(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
-    cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 8
-        u8 RCOMP = dxt5_decode_alphablock_signed(pixdata, blksrc, i & 3, j & 3)
- 
-    return RCOMP
+    addr = blockAddrs[blk]
+    if addr + blockSize > dataSize:
+        return zeroBlock
 
+    return data + addr
 
-cdef (u8, u8) fetch_2d_texel_rg_bc5(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
-    cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
-        u8 RCOMP = dxt5_decode_alphablock(pixdata, blksrc, i & 3, j & 3)
-        u8 GCOMP = dxt5_decode_alphablock(pixdata, blksrc + 8, i & 3, j & 3)
- 
-    return RCOMP, GCOMP
 
+cdef inline void writeBlock(const u8 *texels, u8 *out, u32 width, u32 height, u32 x, u32 y) noexcept nogil:
+    """
+    Writes the texels of a decoded block to out, skipping the ones outside of the image.
+    """
 
-cdef (u8, u8) fetch_2d_texel_rg_bc5_snorm(u32 srcRowStride, u8 pixdata[], u32 i, u32 j):
     cdef:
-        u32 blksrc = ((srcRowStride + 3) // 4 * (j // 4) + (i // 4)) * 16
-        u8 RCOMP = dxt5_decode_alphablock_signed(pixdata, blksrc, i & 3, j & 3)
-        u8 GCOMP = dxt5_decode_alphablock_signed(pixdata, blksrc + 8, i & 3, j & 3)
- 
-    return RCOMP, GCOMP
+        u32 rowSize = min(4, width - x) * 4
+        u32 rows = min(4, height - y)
+        u32 j
 
+    for j in range(rows):
+        memcpy(out + ((<u64>(y + j) * width + x) * 4), texels + j * 16, rowSize)
 
-cpdef bytes decompressDXT1(bytes data, u32 width, u32 height):
-    cdef:
-        array.array dataArr = array.array('B', data)
 
-        u8 *work = dataArr.data.as_uchars
-        u8 *output = <u8 *>malloc(width * height * 4)
+cdef void decodeDXT1Block(const u8 *block, u8 *texels) noexcept nogil:
+    dxt135_decode_colorblock(block, 1, texels)
+
+
+cdef void decodeDXT3Block(const u8 *block, u8 *texels) noexcept nogil:
+    cdef u32 k
+
+    dxt135_decode_colorblock(block + 8, 2, texels)
+
+    for k in range(16):
+        texels[k * 4 + 3] = EXP4TO8((block[k // 2] >> (4 * (k & 1))) & 0xf)
 
-        u8 R, G, B, A
-        u32 y, x, pos
- 
-    try:
-        for y in range(height):
-            for x in range(width):
-                R, G, B, A = fetch_2d_texel_rgba_dxt1(width, work, x, y)
 
-                pos = (y * width + x) * 4
+cdef void decodeDXT5Block(const u8 *block, u8 *texels) noexcept nogil:
+    dxt135_decode_colorblock(block + 8, 2, texels)
+    dxt5_decode_alphablock(block, texels + 3, 4)
 
-                output[pos + 0] = R
-                output[pos + 1] = G
-                output[pos + 2] = B
-                output[pos + 3] = A
-     
-        return bytes(<u8[:width * height * 4]>output)
 
-    finally:
-        free(output)
+cdef void decodeBC4Block(const u8 *block, u8 *texels) noexcept nogil:
+    cdef u32 k
 
+    dxt5_decode_alphablock(block, texels, 4)
 
-cpdef bytes decompressDXT3(bytes data, u32 width, u32 height):
+    for k in range(16):
+        texels[k * 4 + 1] = texels[k * 4]
+        texels[k * 4 + 2] = texels[k * 4]
+        texels[k * 4 + 3] = 255
+
+
+cdef void decodeBC4SNORMBlock(const u8 *block, u8 *texels) noexcept nogil:
     cdef:
-        array.array dataArr = array.array('B', data)
+        u32 k
+        u8 R
 
-        u8 *work = dataArr.data.as_uchars
-        u8 *output = <u8 *>malloc(width * height * 4)
+    dxt5_decode_alphablock_signed(block, texels, 4)
 
-        u8 R, G, B, A
-        u32 y, x, pos
- 
-    try:
-        for y in range(height):
-            for x in range(width):
-                R, G, B, A = fetch_2d_texel_rgba_dxt3(width, work, x, y)
+    for k in range(16):
+        R = <char>texels[k * 4] + 128
 
-                pos = (y * width + x) * 4
+        texels[k * 4 + 0] = R
+        texels[k * 4 + 1] = R
+        texels[k * 4 + 2] = R
+        texels[k * 4 + 3] = 255
 
-                output[pos + 0] = R
-                output[pos + 1] = G
-                output[pos + 2] = B
-                output[pos + 3] = A
-     
-        return bytes(<u8[:width * height * 4]>output)
 
-    finally:
-        free(output)
+cdef void decodeBC5Block(const u8 *block, u8 *texels) noexcept nogil:
+    cdef u32 k
 
+    dxt5_decode_alphablock(block, texels, 4)
+    dxt5_decode_alphablock(block + 8, texels + 1, 4)
+
+    for k in range(16):
+        texels[k * 4 + 2] = 0
+        texels[k * 4 + 3] = 255
 
-cpdef bytes decompressDXT5(bytes data, u32 width, u32 height):
-    cdef:
-        array.array dataArr = array.array('B', data)
 
-        u8 *work = dataArr.data.as_uchars
-        u8 *output = <u8 *>malloc(width * height * 4)
+cdef void decodeBC5SNORMBlock(const u8 *block, u8 *texels) noexcept nogil:
+    cdef u32 k
 
-        u8 R, G, B, A
-        u32 y, x, pos
- 
-    try:
-        for y in range(height):
-            for x in range(width):
-                R, G, B, A = fetch_2d_texel_rgba_dxt5(width, work, x, y)
+    dxt5_decode_alphablock_signed(block, texels, 4)
+    dxt5_decode_alphablock_signed(block + 8, texels + 1, 4)
 
-                pos = (y * width + x) * 4
+    for k in range(16):
+        texels[k * 4 + 0] = <char>texels[k * 4 + 0] + 128
+        texels[k * 4 + 1] = <char>texels[k * 4 + 1] + 128
+        texels[k * 4 + 2] = 0
+        texels[k * 4 + 3] = 255
 
-                output[pos + 0] = R
-                output[pos + 1] = G
-                output[pos + 2] = B
-                output[pos + 3] = A
-     
-        return bytes(<u8[:width * height * 4]>output)
 
-    finally:
-        free(output)
+ctypedef void (*decodeBlockFunc)(const u8 *, u8 *) noexcept nogil
 
 
-cpdef bytes decompressBC4(bytes data, u32 width, u32 height, int SNORM):
+cdef object decompressBlocks(const u8[::1] data, u32 width, u32 height, output,
+                             const u32[::1] blockAddrs, u32 blockSize, decodeBlockFunc decodeBlock, dict stats):
+
+    if output is None:
+        output = bytearray(width * height * 4)
+
     cdef:
-        array.array dataArr = array.array('B', data)
+        u8[::1] outputView = output
+        u8 *out
 
-        u8 *work = dataArr.data.as_uchars
-        u8 *output = <u8 *>malloc(width * height * 4)
+        const u8 *work
+        const u8 *block
+        const u32 *addrs = NULL
+        u64 dataSize = data.shape[0]
+        u32 blocksPerRow = (width + 3) // 4
 
-        u8 R
-        u32 y, x, pos
- 
-    try:
-        for y in range(height):
-            for x in range(width):
-                if SNORM:
-                    R = <char>fetch_2d_texel_r_bc4_snorm(width, data, x, y) + 128
+        const u8 *prevBlock = NULL
+        u64 numBlocks = 0
+        u64 numReused = 0
+
+        u8 texels[64]
+        u32 y, x
+
+    if not width or not height:
+        return output
+
+    if outputView.shape[0] < width * height * 4:
+        raise ValueError("Output buffer is too small!")
+
+    if blockAddrs is not None:
+        if blockAddrs.shape[0] < blocksPerRow * ((height + 3) // 4):
+            raise ValueError("Not enough block addresses!")
+
+        addrs = &blockAddrs[0]
+
+    work = &data[0]
+    out = &outputView[0]
+
+    # The GIL is released while decoding, so that other threads can decode other bands
+    with nogil:
+        for y in range(0, height, 4):
+            for x in range(0, width, 4):
+                block = getBlock(work, dataSize, addrs, (y >> 2) * blocksPerRow + (x >> 2), blockSize)
+                numBlocks += 1
+
+                # Flat regions are made of identical blocks,
+                # reuse the texels of the previous block instead of decoding them again
+                if prevBlock != NULL and memcmp(block, prevBlock, blockSize) == 0:
+                    numReused += 1
 
                 else:
-                    R = fetch_2d_texel_r_bc4(width, data, x, y)
+                    decodeBlock(block, texels)
+                    prevBlock = block
 
-                pos = (y * width + x) * 4
+                writeBlock(texels, out, width, height, x, y)
 
-                output[pos + 0] = R
-                output[pos + 1] = R
-                output[pos + 2] = R
-                output[pos + 3] = 255
-     
-        return bytes(<u8[:width * height * 4]>output)
+    if stats is not None:
+        stats["blocks"] += numBlocks
+        stats["reused"] += numReused
 
-    finally:
-        free(output)
+    return output
 
 
-cpdef bytes decompressBC5(bytes data, u32 width, u32 height, int SNORM):
-    cdef:
-        array.array dataArr = array.array('B', data)
+cpdef decompressDXT1(const u8[::1] data, u32 width, u32 height, output=None, const u32[::1] blockAddrs=None, dict stats=None):
+    """
+    blockAddrs: address of every block in data (in linear order), for decoding straight from swizzled data
+                (see addrlib.getSurfaceAddrs()), the blocks are assumed to be in linear order if not given
+    stats: dict, the number of blocks and of blocks reused from the previous identical one
+           are added to its "blocks" and "reused" counters
+    """
 
-        u8 *work = dataArr.data.as_uchars
-        u8 *output = <u8 *>malloc(width * height * 4)
+    return decompressBlocks(data, width, height, output, blockAddrs, 8, decodeDXT1Block, stats)
 
-        u8 R, G
-        u32 y, x, pos
- 
-    try:
-        for y in range(height):
-            for x in range(width):
-                if SNORM:
-                    R, G = fetch_2d_texel_rg_bc5_snorm(width, data, x, y)
 
-                    R = <char>R + 128
-                    G = <char>G + 128
+cpdef decompressDXT3(const u8[::1] data, u32 width, u32 height, output=None, const u32[::1] blockAddrs=None, dict stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16, decodeDXT3Block, stats)
+
+
+cpdef decompressDXT5(const u8[::1] data, u32 width, u32 height, output=None, const u32[::1] blockAddrs=None, dict stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16, decodeDXT5Block, stats)
 
-                else:
-                    R, G = fetch_2d_texel_rg_bc5(width, data, x, y)
 
-                pos = (y * width + x) * 4
+cpdef decompressBC4(const u8[::1] data, u32 width, u32 height, int SNORM, output=None, const u32[::1] blockAddrs=None, dict stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 8,
+                            decodeBC4SNORMBlock if SNORM else decodeBC4Block, stats)
 
-                output[pos + 0] = R
-                output[pos + 1] = G
-                output[pos + 2] = 0
-                output[pos + 3] = 255
-     
-        return bytes(<u8[:width * height * 4]>output)
 
-    finally:
-        free(output)
+cpdef decompressBC5(const u8[::1] data, u32 width, u32 height, int SNORM, output=None, const u32[::1] blockAddrs=None, dict stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16,
+                            decodeBC5SNORMBlock if SNORM else decodeBC5Block, stats)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# BC3 Compressor/Decompressor
+# Version 0.1
+# Copyright © 2018 MasterVermilli0n / AboodXD
+
+# decompress_np.py
+# A BCn decompressor in NumPy based on libtxc_dxtn.
+# Decodes every block of the texture at once instead of looping over the texels.
+
+################################################################
+################################################################
+
+import numpy as np
+
+
+# Layouts of the 8-byte color and alpha halves of the blocks
+colorBlockDtype = np.dtype([('color0', '<u2'), ('color1', '<u2'), ('bits', '<u4')])
+alphaBlockDtype = np.dtype([('alpha0', 'u1'), ('alpha1', 'u1'), ('bits', 'u1', 6)])
+
+# Shifts of the 2-bit color codes and 3-bit alpha codes of the 16 texels
+colorShifts = np.arange(0, 32, 2, dtype=np.uint32)
+alphaShifts = np.arange(0, 48, 3, dtype=np.uint64)
+alphaByteShifts = np.arange(0, 48, 8, dtype=np.uint64)
+
+
+def getBlocks(data, width, height, blockAddrs, blockSize):
+    """
+    Returns the blocks of the texture as a (numBlocks, blockSize) array,
+    either in linear order or gathered from their addresses in blockAddrs.
+    """
+
+    numBlocks = ((width + 3) // 4) * ((height + 3) // 4)
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    if blockAddrs is None:
+        return data[:numBlocks * blockSize].reshape(numBlocks, blockSize)
+
+    addrs = np.frombuffer(blockAddrs, dtype=np.uint32)
+    if len(addrs) < numBlocks:
+        raise ValueError("Not enough block addresses!")
+
+    addrs = addrs[:numBlocks].astype(np.int64)
+
+    # Blocks that are out of the data are decoded as zeros
+    valid = addrs + blockSize <= len(data)
+
+    blocks = np.zeros((numBlocks, blockSize), dtype=np.uint8)
+    blocks[valid] = data[addrs[valid, None] + np.arange(blockSize)]
+
+    return blocks
+
+
+def decodeColorBlocks(blocks, dxt_type):
+    """
+    Decodes the colors of all the blocks to a (numBlocks, 16, 4) RGBA8 array.
+    """
+
+    fields = np.ascontiguousarray(blocks).view(colorBlockDtype)[:, 0]
+    color0 = fields['color0'].astype(np.int32)
+    color1 = fields['color1'].astype(np.int32)
+
+    c0 = np.stack([((color0 >> 8) & 0xf8) | ((color0 >> 13) & 0x07),
+                   ((color0 >> 3) & 0xfc) | ((color0 >>  9) & 0x03),
+                   ((color0 << 3) & 0xf8) | ((color0 >>  2) & 0x07)], axis=1)
+
+    c1 = np.stack([((color1 >> 8) & 0xf8) | ((color1 >> 13) & 0x07),
+                   ((color1 >> 3) & 0xfc) | ((color1 >>  9) & 0x03),
+                   ((color1 << 3) & 0xf8) | ((color1 >>  2) & 0x07)], axis=1)
+
+    greater = (color0 > color1)[:, None]
+
+    palette = np.empty((len(blocks), 4, 4), dtype=np.uint8)
+    palette[:, 0, :3] = c0
+    palette[:, 1, :3] = c1
+    palette[:, 2, :3] = np.where(greater, (c0 * 2 + c1) // 3, (c0 + c1) // 2)
+    palette[:, :3, 3] = 255
+
+    if dxt_type > 1:
+        palette[:, 3, :3] = (c0 + c1 * 2) // 3
+        palette[:, 3, 3] = 255
+
+    else:
+        palette[:, 3, :3] = np.where(greater, (c0 + c1 * 2) // 3, 0)
+        palette[:, 3, 3] = np.where(greater[:, 0], 255, 0)
+
+    codes = (fields['bits'][:, None] >> colorShifts) & 3
+    return palette[np.arange(len(blocks))[:, None], codes]
+
+
+def decodeAlphaBlocks(blocks, signed):
+    """
+    Decodes the 16 values of all the BC3/BC4/BC5 alpha blocks to a (numBlocks, 16) array.
+    """
+
+    fields = np.ascontiguousarray(blocks).view(alphaBlockDtype)[:, 0]
+    alpha0 = fields['alpha0']
+    alpha1 = fields['alpha1']
+
+    if signed:
+        alpha0 = alpha0.view(np.int8)
+        alpha1 = alpha1.view(np.int8)
+
+    a0 = alpha0.astype(np.int32)[:, None]
+    a1 = alpha1.astype(np.int32)[:, None]
+
+    code8 = np.arange(2, 8, dtype=np.int32)
+    code6 = np.arange(2, 6, dtype=np.int32)
+
+    palette = np.empty((len(blocks), 8), dtype=np.int32)
+    palette[:, 0] = a0[:, 0]
+    palette[:, 1] = a1[:, 0]
+    palette[:, 2:] = (a0 * (8 - code8) + a1 * (code8 - 1)) // 7
+
+    six = (a0 <= a1)[:, 0]
+    palette[six, 2:6] = ((a0 * (6 - code6) + a1 * (code6 - 1)) // 5)[six]
+    palette[six, 6] = 0x80 if signed else 0
+    palette[six, 7] = 0x7f if signed else 255
+
+    palette = (palette & 0xff).astype(np.uint8)
+
+    bits = (fields['bits'].astype(np.uint64) << alphaByteShifts).sum(axis=1, dtype=np.uint64)
+    codes = ((bits[:, None] >> alphaShifts) & 7).astype(np.intp)
+    return palette[np.arange(len(blocks))[:, None], codes]
+
+
+def writeBlocks(texels, width, height, output):
+    """
+    Arranges the (numBlocks, 16, 4) texels of the blocks as an image and writes it to output,
+    skipping the texels outside of the image.
+    """
+
+    if output is None:
+        output = bytearray(width * height * 4)
+
+    elif len(output) < width * height * 4:
+        raise ValueError("Output buffer is too small!")
+
+    blocksPerRow = (width + 3) // 4
+    blocksPerCol = (height + 3) // 4
+
+    image = texels.reshape(blocksPerCol, blocksPerRow, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    image = image.reshape(blocksPerCol * 4, blocksPerRow * 4, 4)
+
+    out = np.frombuffer(output, dtype=np.uint8, count=width * height * 4)
+    out.reshape(height, width, 4)[:] = image[:height, :width]
+
+    return output
+
+
+def toSNORM(values):
+    return (values.view(np.int8).astype(np.int16) + 128).astype(np.uint8)
+
+
+def decompressBlocks(data, width, height, output, blockAddrs, blockSize, decodeBlocks, stats=None):
+    if not width or not height:
+        return bytearray() if output is None else output
+
+    blocks = getBlocks(data, width, height, blockAddrs, blockSize)
+
+    # Flat regions are made of identical blocks,
+    # only decode the blocks that differ from the previous one and repeat their texels
+    changed = np.ones(len(blocks), dtype=bool)
+    changed[1:] = (blocks[1:] != blocks[:-1]).any(axis=1)
+
+    texels = decodeBlocks(blocks[changed])[np.cumsum(changed) - 1]
+
+    if stats is not None:
+        stats["blocks"] += len(blocks)
+        stats["reused"] += len(blocks) - int(np.count_nonzero(changed))
+
+    return writeBlocks(texels, width, height, output)
+
+
+def decodeDXT1Blocks(blocks):
+    return decodeColorBlocks(blocks, 1)
+
+
+def decodeDXT3Blocks(blocks):
+    texels = decodeColorBlocks(blocks[:, 8:], 2)
+
+    nibbles = np.stack([blocks[:, :8] & 0xf, blocks[:, :8] >> 4], axis=2).reshape(-1, 16)
+    texels[:, :, 3] = nibbles | nibbles << 4
+
+    return texels
+
+
+def decodeDXT5Blocks(blocks):
+    texels = decodeColorBlocks(blocks[:, 8:], 2)
+    texels[:, :, 3] = decodeAlphaBlocks(blocks[:, :8], False)
+
+    return texels
+
+
+def decodeBC4Blocks(blocks, SNORM):
+    R = decodeAlphaBlocks(blocks, SNORM)
+    if SNORM:
+        R = toSNORM(R)
+
+    texels = np.empty((len(blocks), 16, 4), dtype=np.uint8)
+    texels[:, :, :3] = R[:, :, None]
+    texels[:, :, 3] = 255
+
+    return texels
+
+
+def decodeBC5Blocks(blocks, SNORM):
+    R = decodeAlphaBlocks(blocks[:, :8], SNORM)
+    G = decodeAlphaBlocks(blocks[:, 8:], SNORM)
+    if SNORM:
+        R = toSNORM(R)
+        G = toSNORM(G)
+
+    texels = np.empty((len(blocks), 16, 4), dtype=np.uint8)
+    texels[:, :, 0] = R
+    texels[:, :, 1] = G
+    texels[:, :, 2] = 0
+    texels[:, :, 3] = 255
+
+    return texels
+
+
+def decompressDXT1(data, width, height, output=None, blockAddrs=None, stats=None):
+    """
+    blockAddrs: address of every block in data (in linear order), for decoding straight from swizzled data
+                (see addrlib.getSurfaceAddrs()), the blocks are assumed to be in linear order if not given
+    stats: dict, the number of blocks and of blocks reused from the previous identical one
+           are added to its "blocks" and "reused" counters
+    """
+
+    return decompressBlocks(data, width, height, output, blockAddrs, 8, decodeDXT1Blocks, stats)
+
+
+def decompressDXT3(data, width, height, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16, decodeDXT3Blocks, stats)
+
+
+def decompressDXT5(data, width, height, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16, decodeDXT5Blocks, stats)
+
+
+def decompressBC4(data, width, height, SNORM, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 8,
+                            lambda blocks: decodeBC4Blocks(blocks, SNORM), stats)
+
+
+def decompressBC5(data, width, height, SNORM, output=None, blockAddrs=None, stats=None):
+    return decompressBlocks(data, width, height, output, blockAddrs, 16,
+                            lambda blocks: decodeBC5Blocks(blocks, SNORM), stats)
@@ -3,9 +3,13 @@
 # and I wanted to get something working asap
 # so, yeah, not the cleanest code ever
 
+import mmap
 import os
-from PIL import Image
 import struct
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 
 import addrlib
 import bcn
@@ -64,7 +68,12 @@ def computeSwizzleTileMode(tileModeAndSwizzlePattern):
     return tileModeAndSwizzlePattern[0] << 5 | tileModeAndSwizzlePattern[1]  # swizzlePattern << 5 | tileMode
 
 
-def readFLIM(f):
+def readFLIMHeader(f):
+    """
+    Reads the FLIM and imag headers at the end of f (the file, or at least its last 0x28 bytes).
+    Returns a FLIMData without the surface info and the image data.
+    """
+
     flim = FLIMData()
 
     pos = len(f) - 0x28
@@ -75,6 +84,9 @@ def readFLIM(f):
     elif f[pos + 4:pos + 6] == b'\xFE\xFF':
         bom = '>'
 
+    else:
+        raise ValueError("Invalid byte order mark!")
+
     header = FLIMHeader(bom)
     header.data(f, pos)
 
@@ -212,35 +224,237 @@ def readFLIM(f):
 
     flim.alignment = info.alignment
 
-    surfOut = addrlib.getSurfaceInfo(flim.format, flim.width, flim.height, 1, 1, flim.tileMode, 0, 0)
+    return flim
+
 
-    tilingDepth = surfOut.depth
-    if surfOut.tileMode == 3:
-        tilingDepth //= 4
+def readFLIM(f):
+    flim = readFLIMHeader(f)
+
+    # BFLIM images are always a single 2D slice without mipmaps
+    flim.depth = 1
+    flim.dim = 1
+    flim.numMips = 1
 
-    if tilingDepth != 1:
-        raise NotImplementedError("Unsupported depth!")
+    surfOut = addrlib.getSurfaceInfo(flim.format, flim.width, flim.height, flim.depth, flim.dim, flim.tileMode, 0, 0)
 
     flim.pitch = surfOut.pitch
 
-    flim.data = f[:info.imageSize]
+    # Keep a view of the image data instead of copying it
+    flim.data = memoryview(f)[:flim.imageSize]
 
     flim.surfOut = surfOut
 
     return flim
 
 
-def get_deswizzled_data(flim):
-    result = addrlib.deswizzle(flim.width, flim.height, 1, flim.format, 0, 1, flim.surfOut.tileMode,
-                               flim.swizzle, flim.pitch, flim.surfOut.bpp, 0, 0, flim.data)
+# Compact description of a BFLIM, read from its headers only (see probeFLIM())
+FLIMInfo = namedtuple('FLIMInfo', [
+    'width', 'height', 'format', 'compSel', 'tileMode', 'swizzle', 'alignment', 'imageSize',
+])
 
-    if (flim.format & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35):
-        size = ((flim.width + 3) >> 2) * ((flim.height + 3) >> 2) * (addrlib.surfaceGetBitsPerPixel(flim.format) >> 3)
+
+def probeFLIM(file):
+    """
+    Reads only the trailing 0x28-byte FLIM/imag headers of a BFLIM, without touching the image data.
+    file: path, file object, or buffer of the whole file (e.g. bytes or mmap)
+    Returns a FLIMInfo.
+    """
+
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as inf:
+            return probeFLIM(inf)
+
+    if hasattr(file, "read") and not isinstance(file, mmap.mmap):
+        file.seek(-0x28, os.SEEK_END)
+        f = file.read(0x28)
 
     else:
-        size = flim.width * flim.height * (addrlib.surfaceGetBitsPerPixel(flim.format) >> 3)
+        f = bytes(memoryview(file)[-0x28:])
+
+    if len(f) < 0x28:
+        raise ValueError("File is too small!")
+
+    flim = readFLIMHeader(f)
+
+    return FLIMInfo(flim.width, flim.height, flim.format, flim.compSel, flim.tileMode, flim.swizzle,
+                    flim.alignment, flim.imageSize)
+
+
+formatNames = {
+    0x01: 'L8',
+    0x02: 'LA4',
+    0x07: 'LA8',
+    0x08: 'RGB565',
+    0x0a: 'RGB5A1',
+    0x0b: 'RGBA4',
+    0x19: 'BGR10A2',
+    0x1a: 'RGBA8',
+    0x31: 'BC1',
+    0x32: 'BC2',
+    0x33: 'BC3',
+    0x34: 'BC4',
+    0x35: 'BC5',
+}
+
+
+def getFormatName(format_):
+    name = formatNames.get(format_ & 0x3F, hex(format_ & 0x3F))
+
+    if format_ & 0x400:
+        name += '_SRGB'
+
+    elif format_ & 0x200:
+        name += '_SNORM'
+
+    return name
+
+
+def getCapacityReport(timgPath):
+    """
+    Probes every BFLIM in timgPath (see probeFLIM()).
+    Returns a dict of format name -> [textures, texels, bytes to decode, RGBA8 output bytes],
+    and the list of the files that couldn't be probed.
+    """
+
+    report = {}
+    skipped = []
+
+    for name in sorted(os.listdir(timgPath)):
+        if not name.lower().endswith('.bflim'):
+            continue
+
+        try:
+            info = probeFLIM(os.path.join(timgPath, name))
+
+        except (OSError, ValueError, NotImplementedError, struct.error):
+            skipped.append(name)
+            continue
+
+        texels = info.width * info.height
+
+        entry = report.setdefault(getFormatName(info.format), [0, 0, 0, 0])
+        entry[0] += 1
+        entry[1] += texels
+        entry[2] += info.imageSize
+        entry[3] += texels * 4
+
+    return report, skipped
+
+
+# Placement of one mip level of a surface,
+# both in the swizzled data and in the deswizzled output buffer
+SurfaceLevel = namedtuple('SurfaceLevel', [
+    'level', 'width', 'height', 'numSlices', 'surfOut', 'offset', 'size', 'outOffset', 'outSliceSize'
+])
+
+
+def computeSurfaceLayout(format_, width, height, depth, dim, tileMode, numMips, mipOffsets=None):
+    """
+    Computes the offsets of every mip level and slice of a surface.
+    mipOffsets: offsets of the mip levels (starting from level 1) in the data,
+                if not given, every level follows the previous one aligned to its baseAlign.
+    Returns a list of SurfaceLevel and the total size of the deswizzled data.
+    """
+
+    levels = []
+    offset = 0
+    outOffset = 0
+
+    isBCn = (format_ & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35)
+    bytesPerPixel = addrlib.surfaceGetBitsPerPixel(format_) >> 3
+
+    for level in range(numMips):
+        surfOut = addrlib.getSurfaceInfo(format_, width, height, depth, dim, tileMode, 0, level)
+
+        levelWidth = max(1, width >> level)
+        levelHeight = max(1, height >> level)
+
+        if dim == 2:
+            numSlices = max(1, depth >> level)
+
+        else:
+            numSlices = depth
+
+        if level:
+            if mipOffsets is not None:
+                offset = mipOffsets[level - 1]
+
+            else:
+                offset = (offset + surfOut.baseAlign - 1) & ~(surfOut.baseAlign - 1)
+
+        if isBCn:
+            outSliceSize = ((levelWidth + 3) >> 2) * ((levelHeight + 3) >> 2) * bytesPerPixel
+
+        else:
+            outSliceSize = levelWidth * levelHeight * bytesPerPixel
+
+        levels.append(SurfaceLevel(level, levelWidth, levelHeight, numSlices, surfOut,
+                                   offset, surfOut.surfSize, outOffset, outSliceSize))
+
+        offset += surfOut.surfSize
+        outOffset += outSliceSize * numSlices
+
+    return levels, outOffset
+
 
-    return result[:size]
+def deswizzleSurface(format_, width, height, depth, dim, tileMode, swizzle, numMips, data, mipOffsets=None, result=None):
+    """
+    Deswizzles every mip level and slice of a surface into one buffer.
+    The offsets are computed once by computeSurfaceLayout(), then each slice is deswizzled
+    by its own addrlib.deswizzle() call, as the levels don't share a pitch or a tile mode.
+    BFLIMs only have one level and slice, so it's a single call for them.
+    data: swizzled data (any buffer)
+    result: writable buffer to deswizzle to, allocated if not given
+    Returns the buffer and, for every mip level, a list of memoryviews of its slices.
+    """
+
+    levels, size = computeSurfaceLayout(format_, width, height, depth, dim, tileMode, numMips, mipOffsets)
+
+    if result is None:
+        result = bytearray(size)
+
+    if len(result) < size:
+        raise ValueError("Result buffer is too small!")
+
+    data = memoryview(data)
+    resultView = memoryview(result)
+    images = []
+
+    for lvl in levels:
+        surfOut = lvl.surfOut
+        levelData = data[lvl.offset:lvl.offset + lvl.size]
+
+        # Slices are placed using the aligned height,
+        # the extra rows don't fit in the slice view and are skipped
+        if lvl.numSlices > 1:
+            deswizzleHeight = surfOut.pixelHeight
+
+        else:
+            deswizzleHeight = lvl.height
+
+        slices = []
+        for slice in range(lvl.numSlices):
+            pos = lvl.outOffset + slice * lvl.outSliceSize
+            sliceView = resultView[pos:pos + lvl.outSliceSize]
+
+            addrlib.deswizzle(lvl.width, deswizzleHeight, lvl.numSlices, format_, 0, 1, surfOut.tileMode,
+                              swizzle, surfOut.pitch, surfOut.bpp, slice, 0, levelData, sliceView)
+
+            slices.append(sliceView)
+
+        images.append(slices)
+
+    return result, images
+
+
+def get_deswizzled_surface(flim):
+    return deswizzleSurface(flim.format, flim.width, flim.height, flim.depth, flim.dim, flim.tileMode,
+                            flim.swizzle, flim.numMips, flim.data)
+
+
+def get_deswizzled_data(flim):
+    _, images = get_deswizzled_surface(flim)
+    return images[0][0]
 
 
 # Supported formats
@@ -260,31 +474,413 @@ formats = {
     0x35:  ('rgba8', 4),
 }
 
-def texureToRGBA8(width, height, format_, data, compSel):
+def texureToRGBA8(width, height, format_, data, compSel, output=None, blockAddrs=None, stats=None):
+    """
+    data: deswizzled data (any buffer)
+    output: writable buffer of at least width * height * 4 bytes, allocated if not given
+    blockAddrs: for BCn formats, addresses of the blocks if data is still swizzled (see addrlib.getSurfaceAddrs())
+    stats: for BCn formats, dict the block dedupe counters are added to (see newDedupeStats())
+    """
+
     formatStr, bpp = formats[format_ & 0x3F]
 
     ### Decompress the data if compressed ###
 
     if (format_ & 0x3F) == 0x31:
-        data = bcn.decompressDXT1(data, width, height)
+        data = bcn.decompressDXT1(data, width, height, output, blockAddrs, stats)
 
     elif (format_ & 0x3F) == 0x32:
-        data = bcn.decompressDXT3(data, width, height)
+        data = bcn.decompressDXT3(data, width, height, output, blockAddrs, stats)
 
     elif (format_ & 0x3F) == 0x33:
-        data = bcn.decompressDXT5(data, width, height)
+        data = bcn.decompressDXT5(data, width, height, output, blockAddrs, stats)
 
     elif (format_ & 0x3F) == 0x34:
-        data = bcn.decompressBC4(data, width, height, format_ >> 8)
+        data = bcn.decompressBC4(data, width, height, format_ >> 8, output, blockAddrs, stats)
 
     elif (format_ & 0x3F) == 0x35:
-        data = bcn.decompressBC5(data, width, height, format_ >> 8)
+        data = bcn.decompressBC5(data, width, height, format_ >> 8, output, blockAddrs, stats)
+
+    if (format_ & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35):
+        # The decompressed data is RGBA8, nothing to do for the identity selector,
+        # otherwise apply the component selectors in place
+        if list(compSel) == [0, 1, 2, 3]:
+            return data
+
+        output = data
+
+    return formConv.torgba8(width, height, data, formatStr, bpp, compSel, output)
+
+
+def tiledToRGBA8(flim, firstRow=0, numRows=None, output=None, stats=None):
+    """
+    Converts the image (or the given rows of it) to RGBA8.
+    BCn blocks are decoded straight from the swizzled data, other formats are deswizzled first.
+    output: writable buffer of at least width * numRows * 4 bytes, allocated if not given
+    stats: dict the block dedupe counters of BCn formats are added to (see newDedupeStats())
+    """
+
+    if numRows is None:
+        numRows = flim.height - firstRow
+
+    if (flim.format & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35):
+        blockAddrs = addrlib.getSurfaceAddrs(flim.width, flim.height, 1, flim.format, 0, 1, flim.surfOut.tileMode,
+                                             flim.swizzle, flim.pitch, flim.surfOut.bpp, 0, 0, len(flim.data),
+                                             firstRow, numRows)
+
+        return texureToRGBA8(flim.width, numRows, flim.format, flim.data, flim.compSel, output, blockAddrs, stats)
+
+    deswizzled = bytearray(flim.width * numRows * (flim.surfOut.bpp >> 3))
+    addrlib.deswizzle(flim.width, flim.height, 1, flim.format, 0, 1, flim.surfOut.tileMode, flim.swizzle,
+                      flim.pitch, flim.surfOut.bpp, 0, 0, flim.data, deswizzled, firstRow, numRows)
+
+    return texureToRGBA8(flim.width, numRows, flim.format, deswizzled, flim.compSel, output)
+
+
+def newDedupeStats():
+    # Number of decoded BCn blocks and of blocks reused from the previous identical one
+    return {"blocks": 0, "reused": 0}
+
+
+def addDedupeStats(stats, other):
+    if stats is not None:
+        stats["blocks"] += other["blocks"]
+        stats["reused"] += other["reused"]
+
+
+def getBands(flim, bandHeight=64):
+    """
+    Splits the image into independent bands of rows,
+    bandHeight is rounded up to whole tile rows (macro tile rows, or rows of BCn blocks).
+    Returns the first row and the number of rows of every band.
+    """
+
+    isBCn = (flim.format & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35)
+    blockSize = 4 if isBCn else 1
+
+    align = flim.surfOut.heightAlign * blockSize
+    bandHeight = max(1, (bandHeight + align - 1) // align) * align
+
+    return [(y, min(bandHeight, flim.height - y)) for y in range(0, flim.height, bandHeight)]
+
+
+def iterRGBA8Bands(flim, bandHeight=64, numThreads=1, stats=None):
+    """
+    Deswizzles and converts the image one band of rows at a time,
+    so that only one band is held in memory at once.
+    bandHeight: height of the bands in pixels, rounded up to whole tile rows
+    numThreads: if more than 1, that many bands are converted at once on a thread pool
+    stats: dict the block dedupe counters of BCn formats are added to (see newDedupeStats())
+    Yields the first row, the number of rows and the RGBA8 data of every band.
+    """
+
+    bands = getBands(flim, bandHeight)
+
+    if numThreads <= 1:
+        for y, numRows in bands:
+            yield y, numRows, tiledToRGBA8(flim, y, numRows, stats=stats)
+
+        return
+
+    def convertBand(band):
+        # Every band counts into its own stats, they are added up in this thread
+        bandStats = newDedupeStats()
+        return tiledToRGBA8(flim, *band, stats=bandStats), bandStats
+
+    with ThreadPoolExecutor(numThreads) as executor:
+        for i in range(0, len(bands), numThreads):
+            batch = bands[i:i + numThreads]
+            results = executor.map(convertBand, batch)
+
+            for (y, numRows), (data, bandStats) in zip(batch, results):
+                addDedupeStats(stats, bandStats)
+                yield y, numRows, data
 
-    return formConv.torgba8(width, height, bytearray(data), formatStr, bpp, compSel)
+
+def threadedTiledToRGBA8(flim, numThreads, bandHeight=64, stats=None):
+    """
+    Same as tiledToRGBA8(), but the bands of the image are converted on a thread pool.
+    The Cython kernels release the GIL, so a large texture is spread over numThreads cores.
+    """
+
+    output = bytearray(flim.width * flim.height * 4)
+    outputView = memoryview(output)
+    rowSize = flim.width * 4
+
+    def convertBand(band):
+        y, numRows = band
+        bandStats = newDedupeStats()
+        tiledToRGBA8(flim, y, numRows, outputView[y * rowSize:(y + numRows) * rowSize], bandStats)
+
+        return bandStats
+
+    with ThreadPoolExecutor(numThreads) as executor:
+        for bandStats in executor.map(convertBand, getBands(flim, bandHeight)):
+            addDedupeStats(stats, bandStats)
+
+    return output
+
+
+def openOutput(path):
+    # The output may be hardlinked to the outputs of other textures with the same data,
+    # replace it instead of writing over it
+    if os.path.lexists(path):
+        os.remove(path)
+
+    return open(path, "wb")
+
+
+def copyRowToBGRA(row, data):
+    # TGA pixels are BGRA
+    row[:] = data
+    row[0::4], row[2::4] = row[2::4], row[0::4]
+
+
+def writeTGA(path, width, height, bands, rle=False):
+    """
+    Writes bands of RGBA8 rows (see iterRGBA8Bands()) to a 32-bit TGA.
+    Uncompressed, it is laid out the same way as the ones saved by PIL (bottom-left origin).
+    rle: run-length encode the pixels, the rows are then written top row first as the bands come
+    The rows are written one at a time from a single row buffer.
+    """
+
+    rowSize = width * 4
+    row = bytearray(rowSize)
+
+    with openOutput(path) as out:
+        if rle:
+            out.write(struct.pack('<3B2HB4H2B', 0, 0, 10, 0, 0, 0, 0, 0, width, height, 32, 0x28))
+
+            for _, numRows, data in bands:
+                data = memoryview(data)
+
+                for i in range(numRows):
+                    copyRowToBGRA(row, data[i * rowSize:(i + 1) * rowSize])
+                    out.write(encodeTGARLERow(row))
+
+        else:
+            out.write(struct.pack('<3B2HB4H2B', 0, 0, 2, 0, 0, 0, 0, 0, width, height, 32, 8))
+
+            for y, numRows, data in bands:
+                data = memoryview(data)
+
+                # Bottom row first
+                out.seek(18 + (height - y - numRows) * rowSize)
+
+                for i in reversed(range(numRows)):
+                    copyRowToBGRA(row, data[i * rowSize:(i + 1) * rowSize])
+                    out.write(row)
+
+            out.seek(18 + height * rowSize)
+
+        out.write(b'\0' * 8 + b'TRUEVISION-XFILE.\0')
+
+
+def encodeTGARLERow(row):
+    """
+    Run-length encodes a row of 32-bit pixels.
+    Packets don't cross rows and hold at most 128 pixels.
+    """
+
+    pixels = memoryview(row).cast('I')
+    packets = bytearray()
+    raw = []
+
+    def flushRaw():
+        for i in range(0, len(raw), 128):
+            chunk = raw[i:i + 128]
+            packets.append(len(chunk) - 1)
+            packets.extend(b''.join(chunk))
+
+        raw.clear()
+
+    for pixel, group in groupby(pixels):
+        count = sum(1 for _ in group)
+        if count == 1:
+            raw.append(struct.pack('I', pixel))
+            continue
+
+        flushRaw()
+
+        pixel = struct.pack('I', pixel)
+        for i in range(0, count, 128):
+            packets.append(0x80 | (min(count - i, 128) - 1))
+            packets.extend(pixel)
+
+    flushRaw()
+
+    return packets
+
+
+def writePNGChunk(out, type_, data):
+    out.write(struct.pack('>I', len(data)))
+    out.write(type_)
+    out.write(data)
+    out.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(type_))))
+
+
+def writePNG(path, width, height, bands, compressLevel=6):
+    """
+    Writes bands of RGBA8 rows (see iterRGBA8Bands()) to an 8-bit RGBA PNG.
+    The rows are compressed as the bands come, without filtering.
+    compressLevel: zlib compression level, from 0 (none) to 9 (smallest)
+    """
+
+    rowSize = width * 4
+    compressor = zlib.compressobj(compressLevel)
+
+    with openOutput(path) as out:
+        out.write(b'\x89PNG\r\n\x1a\n')
+        writePNGChunk(out, b'IHDR', struct.pack('>2I5B', width, height, 8, 6, 0, 0, 0))
+
+        for _, numRows, data in bands:
+            data = memoryview(data)
+            rows = b''.join(b'\0' + data[i * rowSize:(i + 1) * rowSize] for i in range(numRows))
+
+            idat = compressor.compress(rows)
+            if idat:
+                writePNGChunk(out, b'IDAT', idat)
+
+        writePNGChunk(out, b'IDAT', compressor.flush())
+        writePNGChunk(out, b'IEND', b'')
+
+
+# Textures with at least this many pixels are converted
+# and written one band of rows at a time to limit memory use
+bandedMinPixels = 1024 * 1024
+
+# Number of threads converting the bands of a texture,
+# set it to os.cpu_count() to spread large textures over all cores
+bandThreads = 1
+
+# Run-length encode the TGAs written by toTGA()
+tgaRLE = False
+
+# zlib compression level of the PNGs written by toPNG()
+pngCompressLevel = 6
+
+
+def iterTextureBands(tex, stats=None):
+    """
+    Yields the RGBA8 bands of the texture to write (see iterRGBA8Bands()),
+    a single band for textures smaller than bandedMinPixels.
+    """
+
+    if tex.width * tex.height >= bandedMinPixels:
+        yield from iterRGBA8Bands(tex, numThreads=bandThreads, stats=stats)
+
+    elif bandThreads > 1:
+        yield 0, tex.height, threadedTiledToRGBA8(tex, bandThreads, stats=stats)
+
+    else:
+        yield 0, tex.height, tiledToRGBA8(tex, stats=stats)
 
 
 def toTGA(inb, name, texPath):
+    """
+    Returns the BCn block dedupe counters of the texture (see newDedupeStats()),
+    or None if it's not BCn compressed.
+    """
+
     tex = readFLIM(inb)
-    data = texureToRGBA8(tex.width, tex.height, tex.format, get_deswizzled_data(tex), tex.compSel)
-    img = Image.frombuffer("RGBA", (tex.width, tex.height), data, 'raw', "RGBA", 0, 1)
-    img.save(os.path.join(texPath, "%s.tga" % name))
+
+    stats = newDedupeStats()
+    writeTGA(os.path.join(texPath, "%s.tga" % name), tex.width, tex.height, iterTextureBands(tex, stats), tgaRLE)
+
+    if (tex.format & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35):
+        return stats
+
+
+def toPNG(inb, name, texPath):
+    """
+    Same as toTGA(), but writes a PNG.
+    """
+
+    tex = readFLIM(inb)
+
+    stats = newDedupeStats()
+    writePNG(os.path.join(texPath, "%s.png" % name), tex.width, tex.height, iterTextureBands(tex, stats), pngCompressLevel)
+
+    if (tex.format & 0x3F) in (0x31, 0x32, 0x33, 0x34, 0x35):
+        return stats
+
+
+def canExportDDS(format_, compSel):
+    """
+    Returns whether the BCn blocks of a texture can be written to a DDS as they are.
+    Only BC1-BC3 with the identity component selectors are read the same way from a DDS.
+    """
+
+    return (format_ & 0x3F) in (0x31, 0x32, 0x33) and list(compSel) == [0, 1, 2, 3]
+
+
+# FourCC and DXGI format of the BCn formats in DDS files
+ddsFormats = {
+    0x031: (b'DXT1', 71),
+    0x431: (b'DX10', 72),
+    0x032: (b'DXT3', 74),
+    0x432: (b'DX10', 75),
+    0x033: (b'DXT5', 77),
+    0x433: (b'DX10', 78),
+}
+
+
+def getDDSHeader(width, height, format_, dataSize):
+    """
+    Returns the header of a DDS with a single mip level of BCn blocks.
+    sRGB formats use the DX10 extended header.
+    """
+
+    fourCC, dxgiFormat = ddsFormats[format_]
+
+    pfFlags = 4 | 1  # DDPF_FOURCC | DDPF_ALPHAPIXELS
+
+    # DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    header = struct.pack('<4s7I44x2I4s5I4I4x', b'DDS ', 124, 0x81007, height, width, dataSize, 0, 0,
+                         32, pfFlags, fourCC, 0, 0, 0, 0, 0, 0x1000, 0, 0, 0)
+
+    if fourCC == b'DX10':
+        # D3D10_RESOURCE_DIMENSION_TEXTURE2D, array size 1
+        header += struct.pack('<5I', dxgiFormat, 3, 0, 1, 0)
+
+    return header
+
+
+def toDDS(inb, name, texPath):
+    """
+    Writes the BCn blocks of the texture to a DDS without decoding them.
+    Raises NotImplementedError if it can't be kept in a DDS (see canExportDDS()).
+    """
+
+    tex = readFLIM(inb)
+
+    if not canExportDDS(tex.format, tex.compSel):
+        raise NotImplementedError("Can't export this texture to DDS: " + getFormatName(tex.format))
+
+    data = get_deswizzled_data(tex)
+
+    with openOutput(os.path.join(texPath, "%s.dds" % name)) as out:
+        out.write(getDDSHeader(tex.width, tex.height, tex.format, len(data)))
+        out.write(data)
+
+
+def main():
+    timgPath = input("Input (timg folder):  ")
+
+    report, skipped = getCapacityReport(timgPath)
+    total = [0, 0, 0, 0]
+
+    print("\n%-12s %8s %14s %14s %14s" % ("Format", "Textures", "Texels", "Data bytes", "RGBA8 bytes"))
+
+    for name, entry in sorted(report.items()):
+        print("%-12s %8d %14d %14d %14d" % (name, *entry))
+        total = [a + b for a, b in zip(total, entry)]
+
+    print("%-12s %8d %14d %14d %14d" % ("Total", *total))
+
+    for name in skipped:
+        print("could not read %s" % name)
+
+
+if __name__ == "__main__":
+    main()
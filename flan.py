@@ -608,6 +608,7 @@ def main(files, path, output):
 
     textures = []
     formats = []
+    refTextures = []
     usedTypes = []
 
     for flan in anim:
@@ -619,6 +620,12 @@ def main(files, path, output):
                 if animInfo.magic not in usedTypes:
                     usedTypes.append(animInfo.magic)
 
+                # The texture pattern targets reference all the files of the animation (see AnimTarget.set())
+                if animInfo.magic == b'FLTP' and animInfo.animTargets:
+                    for fileName in flan.info.fileNames:
+                        if fileName not in refTextures:
+                            refTextures.append(fileName)
+
     lans = []
     for type_ in usedTypes:
         animContsNames = []
@@ -651,4 +658,4 @@ def main(files, path, output):
     with open(output, "w", encoding="utf-8") as out:
         out.write(xml)
 
-    return textures, formats
+    return textures, formats, refTextures
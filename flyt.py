@@ -1,8 +1,15 @@
 from bflyt import FLYT
 from common import Color4, MaterialName, UserData, LRName
 from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import bflim as BFLIM
+import hashlib
+import json
 import os
+import shutil
+import struct
+import threading
+import time
 
 
 class Vec2:
@@ -1936,28 +1943,468 @@ class TexelFormat:
         return self.format
 
 
-class TextureFile:
-    def __init__(self, timgPath, timgOutP, texture, format):
-        self.imagePath = '%s\\%s.tga' % (".\\Textures", texture)
-        self.format = TexelFormat(format[1])
+def getTexturePath(timgOutP, texture, ext=".tga"):
+    return os.path.join(timgOutP, texture + ext)
+
+
+def convertTexture(timgPath, timgOutP, texture, format, ext=".tga"):
+    """
+    Converts texture's BFLIM in timgPath to a TGA (or a DDS, see exportDDS) in timgOutP.
+    Returns the message to print, so that it can run in a worker process,
+    and whether the texture was converted.
+    """
+
+    try:
+        with open(os.path.join(timgPath, '%s%s.bflim' % (texture, format)), "rb") as inf:
+            inb = inf.read()
+
+    except FileNotFoundError:
+        return "please convert %s%s.bflim" % (texture, format), False
+
+    try:
+        if ext == ".dds":
+            BFLIM.toDDS(inb, texture, timgOutP)
+            return "%s%s.bflim exported to DDS" % (texture, format), True
+
+        stats = BFLIM.toTGA(inb, texture, timgOutP)
+
+    except NotImplementedError:
+        return "please convert %s%s.bflim" % (texture, format), False
+
+    except (ValueError, struct.error, OSError) as e:
+        # A corrupt or truncated BFLIM, only this texture fails
+        return "could not convert %s%s.bflim: %s" % (texture, format, e), False
+
+    if stats and stats["blocks"]:
+        return "%s%s.bflim converted (%d of %d blocks reused)" % (texture, format, stats["reused"], stats["blocks"]), True
+
+    return "%s%s.bflim converted" % (texture, format), True
+
+
+def timedConvertTexture(timgPath, timgOutP, texture, format, ext):
+    # Also returns the time spent converting, for the utilization report
+    start = time.perf_counter()
+    message, converted = convertTexture(timgPath, timgOutP, texture, format, ext)
+
+    return message, converted, time.perf_counter() - start
+
+
+def getTextureDigest(timgPath, texture, format):
+    """
+    Returns the digest of the contents of texture's BFLIM,
+    or None if it can't be read, the job will only print an error.
+    """
+
+    try:
+        with open(os.path.join(timgPath, '%s%s.bflim' % (texture, format)), "rb") as inf:
+            return hashlib.blake2b(inf.read(), digest_size=16).hexdigest()
+
+    except OSError:
+        return None
+
+
+def loadTextureIndex(path):
+    if not path or not os.path.isfile(path):
+        return {}
+
+    try:
+        with open(path, encoding="utf-8") as inf:
+            return json.load(inf)
+
+    except (OSError, ValueError):
+        print("could not read %s, the textures will be converted again" % path)
+        return {}
+
+
+def getIndexEntry(path):
+    # The size and modification time tell if the output was rewritten since it was indexed
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def isIndexEntryValid(entry):
+    try:
+        stat = os.stat(entry["path"])
+
+    except (OSError, KeyError, TypeError):
+        return False
 
-        if not os.path.isdir(timgOutP):
-            os.mkdir(timgOutP)
+    return stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime")
 
+
+def saveTextureIndex(path, index):
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as out:
+        json.dump(index, out, indent=1, sort_keys=True)
+
+    os.replace(tmpPath, path)
+
+
+def copyTexture(source, dest):
+    """
+    Hardlinks (or copies) the already converted texture source to dest.
+    """
+
+    if os.path.exists(dest):
+        os.remove(dest)
+
+    if linkDuplicates:
         try:
-            with open(os.path.join(timgPath, '%s%s.bflim' % (texture, format)), "rb") as inf:
-                inb = inf.read()
+            os.link(source, dest)
+            return
+
+        except OSError:
+            # Different drives, or links are not supported
+            pass
+
+    shutil.copyfile(source, dest)
+
+
+# Options of the bflim module used by the conversions
+workerOptions = ("bandedMinPixels", "bandThreads", "tgaRLE", "pngCompressLevel")
 
-        except FileNotFoundError:
-            print("please convert %s%s.bflim" % (texture, format))
+
+def getWorkerOptions():
+    return {name: getattr(BFLIM, name) for name in workerOptions}
+
+
+def initTextureWorker(options):
+    # Worker processes started with "spawn" (Windows, macOS) import bflim again
+    # and don't see the options set in this process
+    for name, value in options.items():
+        setattr(BFLIM, name, value)
+
+
+def getTextureInfo(timgPath, texture, format):
+    """
+    Reads the BFLIM headers of texture to pick the extension of its output,
+    and to estimate the peak memory used by converting it:
+    the RGBA8 output (or the blocks for a DDS) plus the input file.
+    Returns ".tga" and 0 if it can't be read, the job will only print an error.
+    """
+
+    path = os.path.join(timgPath, '%s%s.bflim' % (texture, format))
+
+    try:
+        info = BFLIM.probeFLIM(path)
+        fileSize = os.path.getsize(path)
+
+    except (OSError, ValueError, NotImplementedError, struct.error):
+        return ".tga", 0
+
+    if exportDDS and BFLIM.canExportDDS(info.format, info.compSel):
+        return ".dds", fileSize * 2
+
+    return ".tga", info.width * info.height * 4 + fileSize
+
+
+# Number of processes converting the textures of a layout while its XML is built,
+# None to use os.cpu_count(), 1 to convert them one after another in this process
+textureWorkers = None
+
+# Estimated memory (in bytes) that the textures being converted at once may use,
+# None for no limit, a texture bigger than this is converted alone
+textureMemoryBudget = None
+
+# Index of the converted textures (digest of the BFLIM -> output file), kept between runs
+# so that textures that were already converted by another layout are copied instead,
+# None to keep it in the output folder, "" to not keep one
+textureIndexPath = None
+
+# Hardlink the textures with the same BFLIM as an already converted one instead of copying them
+linkDuplicates = True
+
+# Export the BC1-BC3 textures to DDS files with their compressed blocks instead of decoding them to TGA
+exportDDS = False
+
+
+class TextureJob:
+    def __init__(self, texture, format, ext, memory):
+        self.texture = texture
+        self.format = format
+        self.ext = ext
+        self.memory = memory
+        self.digest = None
+        self.source = None  # TextureJob or output file with the same BFLIM
+        self.future = None
+        self.message = None
+        self.converted = False
+        self.time = 0
+
+
+class TextureConverter:
+    """
+    Converts a list of textures on a process pool.
+    Textures with the same BFLIM as another texture, or as one in the index, are only converted once.
+    The textures are dispatched largest first while their estimated memory fits in the budget.
+    The messages are returned by getMessages() in the order the textures were added.
+    """
+
+    def __init__(self, timgPath, timgOutP, numWorkers=None, memoryBudget=None):
+        self.timgPath = timgPath
+        self.timgOutP = timgOutP
+        if numWorkers is None:
+            numWorkers = textureWorkers or os.cpu_count() or 1
+
+        if memoryBudget is None:
+            memoryBudget = textureMemoryBudget
+
+        self.numWorkers = numWorkers
+        self.memoryBudget = memoryBudget
+        self.executor = None
+        self.thread = None
+        self.error = None
+        self.started = False
+        self.jobs = []
+        self.decodeJobs = []
+
+        if textureIndexPath is None:
+            self.indexPath = os.path.join(timgOutP, "textureIndex.json")
 
         else:
+            self.indexPath = textureIndexPath
+
+        self.index = {}
+
+        self.makespan = 0
+        self.busyTime = 0
+        self.peakMemory = 0
+
+    def add(self, texture, format):
+        job = TextureJob(texture, format, *getTextureInfo(self.timgPath, texture, format))
+        self.jobs.append(job)
+
+        return job
+
+    def addMessage(self, message):
+        # Keeps the messages of the skipped textures in order with the others
+        self.jobs.append(message)
+
+    def start(self):
+        """
+        Starts converting the added textures in the background.
+        """
+
+        self.started = True
+
+        jobs = [job for job in self.jobs if isinstance(job, TextureJob)]
+        if not jobs:
+            return
+
+        if not os.path.isdir(self.timgOutP):
+            os.mkdir(self.timgOutP)
+
+        self.numWorkers = min(self.numWorkers, len(jobs))
+        if self.numWorkers > 1:
+            try:
+                self.executor = ProcessPoolExecutor(self.numWorkers, initializer=initTextureWorker,
+                                                    initargs=(getWorkerOptions(),))
+
+            except (OSError, NotImplementedError):
+                # No process support on this platform
+                self.numWorkers = 1
+
+        # The BFLIMs are hashed by the scheduler thread, so that it doesn't hold up building the XML
+        if self.executor is not None:
+            self.thread = threading.Thread(target=self.run, args=(jobs,))
+            self.thread.start()
+
+    def findDecodeJobs(self, jobs):
+        """
+        Hashes the BFLIMs of the jobs to only decode the first texture of every BFLIM
+        that wasn't converted before, the others are copied from it.
+        """
+
+        self.index = loadTextureIndex(self.indexPath)
+        sources = {}
+
+        # Indexed outputs that are rewritten by this run can't be copied from
+        outputs = {os.path.abspath(getTexturePath(self.timgOutP, job.texture, job.ext)) for job in jobs}
+
+        for job in jobs:
+            job.digest = getTextureDigest(self.timgPath, job.texture, job.format)
+
+            if job.digest is not None:
+                # A TGA and a DDS of the same BFLIM are different outputs
+                job.digest += job.ext
+
+            if job.digest is None:
+                self.decodeJobs.append(job)
+
+            elif job.digest in sources:
+                job.source = sources[job.digest]
+
+            else:
+                sources[job.digest] = job
+
+                entry = self.index.get(job.digest)
+                dest = os.path.abspath(getTexturePath(self.timgOutP, job.texture, job.ext))
+
+                if isIndexEntryValid(entry) and (entry["path"] == dest or entry["path"] not in outputs):
+                    job.source = entry["path"]
+
+                else:
+                    self.decodeJobs.append(job)
+
+    def run(self, jobs):
+        try:
+            self.findDecodeJobs(jobs)
+
+        except BaseException as e:
+            self.error = e
+            return
+
+        self.schedule(self.decodeJobs)
+
+    def schedule(self, jobs):
+        pending = sorted(jobs, key=lambda job: job.memory, reverse=True)
+        running = {}
+        memory = 0
+        start = time.perf_counter()
+
+        try:
+            while pending or running:
+                i = 0
+                while i < len(pending) and len(running) < self.numWorkers:
+                    job = pending[i]
+
+                    # Skip the jobs that don't fit for now, but let a smaller one use the worker
+                    if running and self.memoryBudget is not None and memory + job.memory > self.memoryBudget:
+                        i += 1
+                        continue
+
+                    job.future = self.executor.submit(timedConvertTexture, self.timgPath, self.timgOutP, job.texture, job.format, job.ext)
+                    running[job.future] = job
+                    memory += job.memory
+                    self.peakMemory = max(self.peakMemory, memory)
+                    del pending[i]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    memory -= job.memory
+
+                    if future.exception() is None:
+                        job.message, job.converted, job.time = future.result()
+                        self.busyTime += job.time
+
+        except BaseException as e:
+            self.error = e
+
+        self.makespan = time.perf_counter() - start
+
+    def getMessages(self):
+        messages = []
+
+        if not self.started:
+            self.start()
+
+        try:
+            if self.thread is not None:
+                # An error of the scheduler is reported by the jobs it didn't finish
+                self.thread.join()
+
+            else:
+                jobs = [job for job in self.jobs if isinstance(job, TextureJob)]
+                if jobs:
+                    self.findDecodeJobs(jobs)
+
+                start = time.perf_counter()
+
+                try:
+                    for job in self.decodeJobs:
+                        try:
+                            job.message, job.converted, job.time = timedConvertTexture(self.timgPath, self.timgOutP, job.texture, job.format, job.ext)
+
+                        except Exception as e:
+                            job.message = "could not convert %s%s.bflim: %r" % (job.texture, job.format, e)
+
+                        self.busyTime += job.time
+                        self.peakMemory = max(self.peakMemory, job.memory)
+
+                finally:
+                    self.makespan = time.perf_counter() - start
+
+            for job in self.jobs:
+                if isinstance(job, str):
+                    messages.append(job)
+
+                elif job.source is not None:
+                    messages.append(self.copyFromSource(job))
+
+                else:
+                    if job.message is None:
+                        job.message = self.getJobError(job)
+
+                    messages.append(job.message)
+
+                    if job.converted and job.digest is not None:
+                        self.index[job.digest] = getIndexEntry(getTexturePath(self.timgOutP, job.texture, job.ext))
+
+            if self.indexPath and self.decodeJobs:
+                saveTextureIndex(self.indexPath, self.index)
+
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+            self.thread = None
+
+        return messages
+
+    def getJobError(self, job):
+        # The message of a job that raised, or that wasn't run because the scheduler failed
+        error = self.error
+
+        if job.future is not None:
             try:
-                BFLIM.toTGA(inb, texture, timgOutP)
-                print("%s%s.bflim converted" % (texture, format))
+                job.message, job.converted, job.time = job.future.result()
+                return job.message
+
+            except Exception as e:
+                error = e
+
+        return "could not convert %s%s.bflim: %r" % (job.texture, job.format, error)
+
+    def copyFromSource(self, job):
+        if isinstance(job.source, TextureJob):
+            if not job.source.converted:
+                return "please convert %s%s.bflim" % (job.texture, job.format)
+
+            source = getTexturePath(self.timgOutP, job.source.texture, job.source.ext)
+            name = "%s%s.bflim" % (job.source.texture, job.source.format)
+
+        else:
+            source = name = job.source
+
+        dest = getTexturePath(self.timgOutP, job.texture, job.ext)
+        job.converted = True
+
+        if os.path.exists(dest) and os.path.samefile(source, dest):
+            return "%s%s.bflim already converted" % (job.texture, job.format)
+
+        copyTexture(source, dest)
+
+        return "%s%s.bflim converted (same as %s)" % (job.texture, job.format, name)
+
+    def getReport(self):
+        jobs = [job for job in self.jobs if isinstance(job, TextureJob)]
+        numConverted = sum(job.converted for job in jobs)
+        numDecoded = sum(job.converted for job in self.decodeJobs)
+
+        numWorkers = max(self.numWorkers, 1)
+        utilization = self.busyTime / (self.makespan * numWorkers) if self.makespan else 0
+
+        return "%d textures converted (%d decoded), %d failed in %.2fs by %d workers (%.0f%% utilization, %.1f MB estimated peak memory)" % (
+            numConverted, numDecoded, len(jobs) - numConverted, self.makespan, numWorkers, utilization * 100,
+            self.peakMemory / 0x100000)
 
-            except NotImplementedError:
-                print("please convert %s%s.bflim" % (texture, format))
+
+class TextureFile:
+    def __init__(self, texture, format, ext=".tga"):
+        self.imagePath = '%s\\%s%s' % (".\\Textures", texture, ext)
+        self.format = TexelFormat(format[1])
 
     def getAsDict(self):
         return {
@@ -2014,8 +2461,13 @@ class PropertyForm:
         }
 
 
+# Only convert the textures used by the materials or by the texture pattern animations,
+# the others are still listed in the XML without their file
+convertOnlyReferenced = False
+
+
 class Layout:
-    def __init__(self, file, timgPath, timgOutP, textures, formats):
+    def __init__(self, file, timgPath, timgOutP, textures, formats, refTextures=None, textureWorkers=None):
         with open(file, "rb") as inf:
             inb = inf.read()
 
@@ -2028,8 +2480,28 @@ class Layout:
                     self.flyt.txl.textures.append(texture)
                     self.flyt.txl.formats.append(format)
 
+        self.refTextures = refTextures or []
         self.timgPath = timgPath
         self.timgOutP = timgOutP
+        self.textureWorkers = textureWorkers
+
+    def getReferencedTextures(self):
+        """
+        Returns the set of the textures referenced by the texture maps of the materials,
+        or by the texture pattern animations (refTextures).
+        """
+
+        referenced = set(self.refTextures)
+
+        if self.flyt.txl and self.flyt.mat:
+            textures = self.flyt.txl.textures
+
+            for material in self.flyt.mat.materials:
+                for texMap in material.resTexMaps:
+                    if texMap.texIdx < len(textures):
+                        referenced.add(textures[texMap.texIdx])
+
+        return referenced
 
     def getAsDict(self):
         if self.flyt.rootPane and self.flyt.lyt:
@@ -2056,34 +2528,54 @@ class Layout:
             else:
                 materials = []
 
-            paneSet = PaneSet()
-            paneSet.set(rootPane.getChildren(), materials, textures, fonts)
-
-            paneHierarchy = PaneHierarchy(rootPane)
-            groupSet = GroupSet(self.flyt.groupList)
-            screenSetting = ScreenSetting()
-            screenSetting.set(layout.layoutWidth, layout.layoutHeight, layout.originType)
-
-            control = None
-            if self.flyt.cnt:
-                cnt = self.flyt.cnt
-
-                control = Control()
-                control.set(
-                    cnt.controlName, cnt.controlUserName, cnt.controlFunctionalPaneNames,
-                    cnt.controlFunctionalAnimNames, cnt.controlFunctionalPaneParameterNames,
-                    cnt.controlFunctionalAnimParameterNames, cnt.extUserDataList,
-                )
-
+            # Start converting the textures first, they are converted while the XML is built
+            converter = TextureConverter(self.timgPath, self.timgOutP, self.textureWorkers)
+            referenced = self.getReferencedTextures()
             textureList = []
             fontList = []
 
             for texture, format in zip(textures, formats):
                 if format[0] == '+':
-                    print("%s%s.bflim conversion skipped, please convert %s^%s.bflim or make sure it has already been converted." % (texture, format, texture, format[1:]))
+                    converter.addMessage("%s%s.bflim conversion skipped, please convert %s^%s.bflim or make sure it has already been converted." % (texture, format, texture, format[1:]))
                     continue
 
-                textureList.append(TextureFile(self.timgPath, self.timgOutP, texture, format))
+                if convertOnlyReferenced and texture not in referenced:
+                    # Keep it in the texture list, only skip converting it
+                    converter.addMessage("%s%s.bflim conversion skipped, it is not used by any material or texture pattern animation." % (texture, format))
+                    textureList.append(TextureFile(texture, format, getTextureInfo(self.timgPath, texture, format)[0]))
+                    continue
+
+                job = converter.add(texture, format)
+                textureList.append(TextureFile(texture, format, job.ext))
+
+            converter.start()
+
+            try:
+                paneSet = PaneSet()
+                paneSet.set(rootPane.getChildren(), materials, textures, fonts)
+
+                paneHierarchy = PaneHierarchy(rootPane)
+                groupSet = GroupSet(self.flyt.groupList)
+                screenSetting = ScreenSetting()
+                screenSetting.set(layout.layoutWidth, layout.layoutHeight, layout.originType)
+
+                control = None
+                if self.flyt.cnt:
+                    cnt = self.flyt.cnt
+
+                    control = Control()
+                    control.set(
+                        cnt.controlName, cnt.controlUserName, cnt.controlFunctionalPaneNames,
+                        cnt.controlFunctionalAnimNames, cnt.controlFunctionalPaneParameterNames,
+                        cnt.controlFunctionalAnimParameterNames, cnt.extUserDataList,
+                    )
+
+            finally:
+                for message in converter.getMessages():
+                    print(message)
+
+                if textureList:
+                    print(converter.getReport())
 
             for font in fonts:
                 fontList.append(FontFile(font))
@@ -7,6 +7,16 @@
 ################################################################
 ################################################################
 
+from functools import lru_cache
+import struct
+
+try:
+    import numpy as np
+
+except ImportError:
+    np = None
+
+
 def getComponentsFromPixel(format_, pixel, comp):
     if format_ == 'l8':
         comp[0] = pixel & 0xFF
@@ -56,16 +66,81 @@ def getComponentsFromPixel(format_, pixel, comp):
     return comp
 
 
-def torgba8(width, height, data, format_, bpp, compSel):
-    assert len(data) >= width * height * bpp
+# 16-bit formats converted through a table of all their 65536 pixel values
+lut16Formats = ('la8', 'rgb565', 'rgb5a1', 'rgba4')
 
-    size = width * height * 4
-    new_data = bytearray(size)
+# Without NumPy, building a table is only worth it for textures with at least this many pixels
+lut16MinPixels = 0x10000
 
-    comp = bytearray([0, 0, 0, 0xFF, 0, 0xFF])
 
-    if bpp not in [1, 2, 4]:
-        return bytes(new_data)
+@lru_cache(maxsize=32)
+def getLUT16(format_, compSel):
+    """
+    Returns the RGBA8 value of every 16-bit pixel of the format (as 65536 * 4 bytes),
+    with the component selectors (a tuple) already applied.
+    """
+
+    if np is None:
+        ramp = struct.pack('<65536H', *range(0x10000))
+        return bytes(convertPixels(0x10000, 1, ramp, format_, 2, compSel, bytearray(0x40000)))
+
+    pixel = np.arange(0x10000, dtype=np.uint32)
+
+    comp = np.zeros((0x10000, 6), dtype=np.uint8)
+    comp[:, 3] = 0xFF
+    comp[:, 5] = 0xFF
+
+    if format_ == 'la8':
+        comp[:, 0] = pixel & 0xFF
+        comp[:, 1] = (pixel & 0xFF00) >> 8
+
+    elif format_ == 'rgb565':
+        comp[:, 0] = (pixel & 0x1F) / 0x1F * 0xFF
+        comp[:, 1] = ((pixel & 0x7E0) >> 5) / 0x3F * 0xFF
+        comp[:, 2] = ((pixel & 0xF800) >> 11) / 0x1F * 0xFF
+
+    elif format_ == 'rgb5a1':
+        comp[:, 0] = (pixel & 0x1F) / 0x1F * 0xFF
+        comp[:, 1] = ((pixel & 0x3E0) >> 5) / 0x1F * 0xFF
+        comp[:, 2] = ((pixel & 0x7c00) >> 10) / 0x1F * 0xFF
+        comp[:, 3] = ((pixel & 0x8000) >> 15) * 0xFF
+
+    elif format_ == 'rgba4':
+        comp[:, 0] = (pixel & 0xF) * 17
+        comp[:, 1] = ((pixel & 0xF0) >> 4) * 17
+        comp[:, 2] = ((pixel & 0xF00) >> 8) * 17
+        comp[:, 3] = ((pixel & 0xF000) >> 12) * 17
+
+    return comp[:, list(compSel)].tobytes()
+
+
+@lru_cache(maxsize=8)
+def getLUT16Entries(format_, compSel):
+    lut = getLUT16(format_, compSel)
+    return [lut[i:i + 4] for i in range(0, 0x40000, 4)]
+
+
+def convertPixelsLUT16(numPixels, data, format_, compSel, output):
+    if np is not None:
+        lut = np.frombuffer(getLUT16(format_, compSel), dtype=np.uint8).reshape(0x10000, 4)
+        pixels = np.frombuffer(data, dtype='<u2', count=numPixels)
+        out = np.frombuffer(output, dtype=np.uint8, count=numPixels * 4).reshape(numPixels, 4)
+
+        np.take(lut, pixels, axis=0, out=out)
+
+    else:
+        entries = getLUT16Entries(format_, compSel)
+        pixels = struct.unpack('<%dH' % numPixels, data[:numPixels * 2])
+
+        output[:numPixels * 4] = b''.join(map(entries.__getitem__, pixels))
+
+    return output
+
+
+def convertPixels(width, height, data, format_, bpp, compSel, output):
+    new_data = output
+
+    comp = bytearray([0, 0, 0, 0xFF, 0, 0xFF])
 
     for y in range(height):
         for x in range(width):
@@ -83,12 +158,78 @@ def torgba8(width, height, data, format_, bpp, compSel):
             new_data[pos_ + 1] = comp[compSel[1]]
             new_data[pos_ + 0] = comp[compSel[0]]
 
-    return bytes(new_data)
+    return output
+
+
+def applyCompSel(numPixels, data, compSel, output=None):
+    """
+    Applies the component selectors to RGBA8 data.
+    The identity selector [0, 1, 2, 3] returns data unchanged (or copies it to output if given).
+    output can be data itself.
+    """
+
+    size = numPixels * 4
+
+    if list(compSel) == [0, 1, 2, 3]:
+        if output is None or output is data:
+            return data
+
+        output[:size] = memoryview(data).cast('B')[:size]
+        return output
+
+    if output is None:
+        output = bytearray(size)
+
+    if np is None:
+        return convertPixels(numPixels, 1, data, 'rgba8', 4, compSel, output)
+
+    src = np.frombuffer(data, dtype=np.uint8, count=size).reshape(numPixels, 4)
+    dst = np.frombuffer(output, dtype=np.uint8, count=size).reshape(numPixels, 4)
+
+    # The fancy index makes a copy of the selected components first, so dst can be src
+    channels = [i for i in range(4) if compSel[i] < 4]
+    dst[:, channels] = src[:, [compSel[i] for i in channels]]
+
+    for i in range(4):
+        if compSel[i] == 4:
+            dst[:, i] = 0
+
+        elif compSel[i] == 5:
+            dst[:, i] = 0xFF
+
+    return output
 
 
-def rgb8torgbx8(data):
+def torgba8(width, height, data, format_, bpp, compSel, output=None):
+    assert len(data) >= width * height * bpp
+
+    size = width * height * 4
+
+    if output is None:
+        output = bytearray(size)
+
+    assert len(output) >= size
+
+    if bpp not in [1, 2, 4]:
+        return output
+
+    if format_ == 'rgba8' and bpp == 4:
+        return applyCompSel(width * height, data, compSel, output)
+
+    if bpp == 2 and format_ in lut16Formats and (np is not None or width * height >= lut16MinPixels):
+        return convertPixelsLUT16(width * height, data, format_, tuple(compSel), output)
+
+    return convertPixels(width, height, data, format_, bpp, compSel, output)
+
+
+def rgb8torgbx8(data, output=None):
     numPixels = len(data) // 3
-    new_data = bytearray(numPixels * 4)
+
+    if output is None:
+        output = bytearray(numPixels * 4)
+
+    assert len(output) >= numPixels * 4
+    new_data = output
 
     for i in range(numPixels):
         new_data[4 * i + 0] = data[3 * i + 0]
@@ -96,4 +237,4 @@ def rgb8torgbx8(data):
         new_data[4 * i + 2] = data[3 * i + 2]
         new_data[4 * i + 3] = 0xFF
 
-    return bytes(new_data)
+    return output
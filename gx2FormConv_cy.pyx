@@ -7,9 +7,7 @@
 ################################################################
 ################################################################
 
-from cpython cimport array
-from cython cimport view
-from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
 
 
 ctypedef unsigned char u8
@@ -17,74 +15,94 @@ ctypedef unsigned short u16
 ctypedef unsigned int u32
 
 
-cdef u8 *getComponentsFromPixel(str format_, pixel, u8 *comp):
-    if format_ == 'l8':
+# Formats supported by torgba8()
+cdef enum:
+    FORMAT_UNSUPPORTED
+    FORMAT_L8
+    FORMAT_LA8
+    FORMAT_LA4
+    FORMAT_RGB565
+    FORMAT_RGB5A1
+    FORMAT_RGBA4
+    FORMAT_RGB8
+    FORMAT_BGR10A2
+    FORMAT_RGBA8
+
+
+cdef dict formatIds = {
+    'l8': FORMAT_L8,
+    'la8': FORMAT_LA8,
+    'la4': FORMAT_LA4,
+    'rgb565': FORMAT_RGB565,
+    'rgb5a1': FORMAT_RGB5A1,
+    'rgba4': FORMAT_RGBA4,
+    'rgb8': FORMAT_RGB8,
+    'bgr10a2': FORMAT_BGR10A2,
+    'rgba8': FORMAT_RGBA8,
+}
+
+
+cdef u8 *getComponentsFromPixel(int format_, u32 pixel, u8 *comp) noexcept nogil:
+    if format_ == FORMAT_L8:
         comp[0] = pixel & 0xFF
 
-    elif format_ == 'la8':
+    elif format_ == FORMAT_LA8:
         comp[0] = pixel & 0xFF
         comp[1] = (pixel & 0xFF00) >> 8
 
-    elif format_ == 'la4':
+    elif format_ == FORMAT_LA4:
         comp[0] = (pixel & 0xF) * 17
         comp[1] = ((pixel & 0xF0) >> 4) * 17
 
-    elif format_ == 'rgb565':
-        comp[0] = int((pixel & 0x1F) / 0x1F * 0xFF)
-        comp[1] = int(((pixel & 0x7E0) >> 5) / 0x3F * 0xFF)
-        comp[2] = int(((pixel & 0xF800) >> 11) / 0x1F * 0xFF)
+    elif format_ == FORMAT_RGB565:
+        comp[0] = <u8>(<double>(pixel & 0x1F) / 0x1F * 0xFF)
+        comp[1] = <u8>(<double>((pixel & 0x7E0) >> 5) / 0x3F * 0xFF)
+        comp[2] = <u8>(<double>((pixel & 0xF800) >> 11) / 0x1F * 0xFF)
 
-    elif format_ == 'rgb5a1':
-        comp[0] = int((pixel & 0x1F) / 0x1F * 0xFF)
-        comp[1] = int(((pixel & 0x3E0) >> 5) / 0x1F * 0xFF)
-        comp[2] = int(((pixel & 0x7c00) >> 10) / 0x1F * 0xFF)
+    elif format_ == FORMAT_RGB5A1:
+        comp[0] = <u8>(<double>(pixel & 0x1F) / 0x1F * 0xFF)
+        comp[1] = <u8>(<double>((pixel & 0x3E0) >> 5) / 0x1F * 0xFF)
+        comp[2] = <u8>(<double>((pixel & 0x7c00) >> 10) / 0x1F * 0xFF)
         comp[3] = ((pixel & 0x8000) >> 15) * 0xFF
 
-    elif format_ == 'rgba4':
+    elif format_ == FORMAT_RGBA4:
         comp[0] = (pixel & 0xF) * 17
         comp[1] = ((pixel & 0xF0) >> 4) * 17
         comp[2] = ((pixel & 0xF00) >> 8) * 17
         comp[3] = ((pixel & 0xF000) >> 12) * 17
 
-    elif format_ == 'rgb8':
+    elif format_ == FORMAT_RGB8:
         comp[0] = pixel & 0xFF
         comp[1] = (pixel & 0xFF00) >> 8
         comp[2] = (pixel & 0xFF0000) >> 16
 
-    elif format_ == 'bgr10a2':
-        comp[0] = int((pixel & 0x3FF) / 0x3FF * 0xFF)
-        comp[1] = int(((pixel & 0xFFC00) >> 10) / 0x3FF * 0xFF)
-        comp[2] = int(((pixel & 0x3FF00000) >> 20) / 0x3FF * 0xFF)
-        comp[3] = int(((pixel & 0xC0000000) >> 30) / 0x3 * 0xFF)
+    elif format_ == FORMAT_BGR10A2:
+        comp[0] = <u8>(<double>(pixel & 0x3FF) / 0x3FF * 0xFF)
+        comp[1] = <u8>(<double>((pixel & 0xFFC00) >> 10) / 0x3FF * 0xFF)
+        comp[2] = <u8>(<double>((pixel & 0x3FF00000) >> 20) / 0x3FF * 0xFF)
+        comp[3] = <u8>(<double>((pixel >> 30) & 0x3) / 0x3 * 0xFF)
 
-    elif format_ == 'rgba8':
+    elif format_ == FORMAT_RGBA8:
         comp[0] = pixel & 0xFF
         comp[1] = (pixel & 0xFF00) >> 8
         comp[2] = (pixel & 0xFF0000) >> 16
-        comp[3] = (pixel & 0xFF000000) >> 24
+        comp[3] = (pixel >> 24) & 0xFF
 
     return comp
 
-cpdef bytes torgba8(u32 width, u32 height, bytearray data_, str format_, u32 bpp, list compSel_):
-    cdef:
-        array.array dataArr = array.array('B', data_)
-        u8 *data = dataArr.data.as_uchars
+ctypedef void (*convertFunc)(const u8 *, u8 *, u32, const u8 *) noexcept nogil
 
-        u32[4] compSel
-        u32 i, elem
 
-    for i, elem in enumerate(compSel_):
-        compSel[i] = elem
+cdef inline u32 readU16(const u8 *data) noexcept nogil:
+    return data[0] | data[1] << 8
 
-    assert len(data_) >= width * height * bpp
 
-    cdef:
-        u32 size = width * height * 4
-        u8 *new_data = <u8 *>malloc(size)
+cdef inline u32 readU32(const u8 *data) noexcept nogil:
+    return data[0] | data[1] << 8 | data[2] << 16 | <u32>data[3] << 24
 
-        u32 x, y, pos, pos_, pixel
-        u8* comp = <u8 *>malloc(6)  # "u8[6] comp" causes issues
 
+cdef inline void initComponents(u8 *comp) noexcept nogil:
+    # Components that are not set by the format keep these values
     comp[0] = 0
     comp[1] = 0
     comp[2] = 0
@@ -92,53 +110,291 @@ cpdef bytes torgba8(u32 width, u32 height, bytearray data_, str format_, u32 bpp
     comp[4] = 0
     comp[5] = 0xFF
 
-    if bpp not in [1, 2, 4]:
-        try:
-            return bytes(<u8[:size]>new_data)
 
-        finally:
-            free(new_data)
-            free(comp)
+cdef inline void writePixel(u8 *out, const u8 *comp, const u8 *compSel) noexcept nogil:
+    out[3] = comp[compSel[3]]
+    out[2] = comp[compSel[2]]
+    out[1] = comp[compSel[1]]
+    out[0] = comp[compSel[0]]
+
 
-    for y in range(height):
-        for x in range(width):
-            pos = (y * width + x) * bpp
-            pos_ = (y * width + x) * 4
+cdef void convertL8(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i
 
-            pixel = 0
-            for i in range(bpp):
-                pixel |= data[pos + i] << (8 * i)
+    initComponents(comp)
 
-            comp = getComponentsFromPixel(format_, pixel, comp)
+    for i in range(numPixels):
+        comp[0] = data[i]
+        writePixel(out + i * 4, comp, compSel)
 
-            new_data[pos_ + 3] = <u8>comp[compSel[3]]
-            new_data[pos_ + 2] = <u8>comp[compSel[2]]
-            new_data[pos_ + 1] = <u8>comp[compSel[1]]
-            new_data[pos_ + 0] = <u8>comp[compSel[0]]
 
-    try:
-        return bytes(<u8[:size]>new_data)
+cdef void convertLA4(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i, pixel
 
-    finally:
-        free(new_data)
-        free(comp)
+    initComponents(comp)
 
+    for i in range(numPixels):
+        pixel = data[i]
+        comp[0] = (pixel & 0xF) * 17
+        comp[1] = (pixel >> 4) * 17
+        writePixel(out + i * 4, comp, compSel)
 
-cpdef bytes rgb8torgbx8(bytearray data):
+
+cdef void convertLA8(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
     cdef:
-        u32 numPixels = len(data) // 3
+        u8 comp[6]
+        u32 i, pixel
+
+    initComponents(comp)
+
+    for i in range(numPixels):
+        pixel = readU16(data + i * 2)
+        comp[0] = pixel & 0xFF
+        comp[1] = pixel >> 8
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef void convertRGB565(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i, pixel
+
+    initComponents(comp)
+
+    for i in range(numPixels):
+        pixel = readU16(data + i * 2)
+        comp[0] = <u8>(<double>(pixel & 0x1F) / 0x1F * 0xFF)
+        comp[1] = <u8>(<double>((pixel & 0x7E0) >> 5) / 0x3F * 0xFF)
+        comp[2] = <u8>(<double>((pixel & 0xF800) >> 11) / 0x1F * 0xFF)
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef void convertRGB5A1(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i, pixel
+
+    initComponents(comp)
+
+    for i in range(numPixels):
+        pixel = readU16(data + i * 2)
+        comp[0] = <u8>(<double>(pixel & 0x1F) / 0x1F * 0xFF)
+        comp[1] = <u8>(<double>((pixel & 0x3E0) >> 5) / 0x1F * 0xFF)
+        comp[2] = <u8>(<double>((pixel & 0x7c00) >> 10) / 0x1F * 0xFF)
+        comp[3] = (pixel >> 15) * 0xFF
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef void convertRGBA4(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i, pixel
+
+    initComponents(comp)
+
+    for i in range(numPixels):
+        pixel = readU16(data + i * 2)
+        comp[0] = (pixel & 0xF) * 17
+        comp[1] = ((pixel & 0xF0) >> 4) * 17
+        comp[2] = ((pixel & 0xF00) >> 8) * 17
+        comp[3] = (pixel >> 12) * 17
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef void convertBGR10A2(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i, pixel
+
+    initComponents(comp)
+
+    for i in range(numPixels):
+        pixel = readU32(data + i * 4)
+        comp[0] = <u8>(<double>(pixel & 0x3FF) / 0x3FF * 0xFF)
+        comp[1] = <u8>(<double>((pixel & 0xFFC00) >> 10) / 0x3FF * 0xFF)
+        comp[2] = <u8>(<double>((pixel & 0x3FF00000) >> 20) / 0x3FF * 0xFF)
+        comp[3] = <u8>(<double>(pixel >> 30) / 0x3 * 0xFF)
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef void convertRGBA8(const u8 *data, u8 *out, u32 numPixels, const u8 *compSel) noexcept nogil:
+    cdef:
+        u8 comp[6]
+        u32 i
+
+    initComponents(comp)
+
+    # The pixel is fully read before it's written, so data can be out
+    for i in range(numPixels):
+        comp[0] = data[i * 4 + 0]
+        comp[1] = data[i * 4 + 1]
+        comp[2] = data[i * 4 + 2]
+        comp[3] = data[i * 4 + 3]
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef void convertGeneric(int formatId, const u8 *data, u8 *out, u32 numPixels, u32 bpp, const u8 *compSel) noexcept nogil:
+    """
+    Fallback for formats without a kernel, or with an unexpected bpp.
+    """
+
+    cdef:
+        u8 comp[6]
+        u32 i, n, pixel
+
+    initComponents(comp)
+
+    for i in range(numPixels):
+        pixel = 0
+        for n in range(bpp):
+            pixel |= data[i * bpp + n] << (8 * n)
+
+        getComponentsFromPixel(formatId, pixel, comp)
+        writePixel(out + i * 4, comp, compSel)
+
+
+cdef convertFunc getConvertFunc(int formatId, u32 bpp):
+    if formatId == FORMAT_L8 and bpp == 1:
+        return convertL8
 
-        u8 *new_data = <u8 *>malloc(numPixels * 4)
+    elif formatId == FORMAT_LA4 and bpp == 1:
+        return convertLA4
+
+    elif formatId == FORMAT_LA8 and bpp == 2:
+        return convertLA8
+
+    elif formatId == FORMAT_RGB565 and bpp == 2:
+        return convertRGB565
+
+    elif formatId == FORMAT_RGB5A1 and bpp == 2:
+        return convertRGB5A1
+
+    elif formatId == FORMAT_RGBA4 and bpp == 2:
+        return convertRGBA4
+
+    elif formatId == FORMAT_BGR10A2 and bpp == 4:
+        return convertBGR10A2
+
+    elif formatId == FORMAT_RGBA8 and bpp == 4:
+        return convertRGBA8
+
+    return NULL
+
+
+# Tables of the RGBA8 values of all the 65536 pixels of a 16-bit format, with compSel applied,
+# keyed by (formatId, compSel)
+cdef dict lut16Cache = {}
+
+# Building a table costs as much as converting 65536 pixels,
+# only use them for textures with at least this many pixels
+cdef u32 lut16MinPixels = 0x1000
+
+
+cdef bytes getLUT16(int formatId, convertFunc convert, const u8 *compSel):
+    key = (formatId, compSel[0], compSel[1], compSel[2], compSel[3])
+
+    cdef bytes lut = lut16Cache.get(key)
+    if lut is not None:
+        return lut
+
+    cdef:
+        bytearray ramp = bytearray(0x20000)
+        bytearray table = bytearray(0x40000)
+        u8 *rampPtr = ramp
+        u32 i
+
+    for i in range(0x10000):
+        rampPtr[i * 2 + 0] = i & 0xFF
+        rampPtr[i * 2 + 1] = i >> 8
+
+    convert(rampPtr, table, 0x10000, compSel)
+
+    lut = bytes(table)
+    lut16Cache[key] = lut
+
+    return lut
+
+
+cdef void convertLUT16(const u8 *data, u8 *out, u32 numPixels, const u8 *lut) noexcept nogil:
+    cdef u32 i
+
+    for i in range(numPixels):
+        memcpy(out + i * 4, lut + readU16(data + i * 2) * 4, 4)
+
+
+cpdef torgba8(u32 width, u32 height, const u8[::1] data_, str format_, u32 bpp, list compSel_, output=None):
+    cdef:
+        u8 compSel[4]
+        u32 i, elem
+
+    # Output component -> index of the component (or of the constants 0 and 0xFF)
+    for i, elem in enumerate(compSel_):
+        compSel[i] = elem
+
+    assert len(data_) >= width * height * bpp
+
+    cdef u32 size = width * height * 4
+
+    if output is None:
+        output = bytearray(size)
+
+    cdef u8[::1] outputView = output
+    assert len(outputView) >= size
+
+    if bpp not in [1, 2, 4] or not size:
+        return output
+
+    cdef:
+        int formatId = formatIds.get(format_, FORMAT_UNSUPPORTED)
+        convertFunc convert = getConvertFunc(formatId, bpp)
+
+        const u8 *data = &data_[0]
+        u8 *new_data = &outputView[0]
+
+    cdef:
+        bytes lut
+        const u8 *lutPtr
+
+    if bpp == 2 and convert != NULL and width * height >= lut16MinPixels:
+        lut = getLUT16(formatId, convert, compSel)
+        lutPtr = lut
+
+        with nogil:
+            convertLUT16(data, new_data, width * height, lutPtr)
+
+        return output
+
+    # The GIL is released while converting, so that other threads can convert other bands
+    with nogil:
+        if convert != NULL:
+            convert(data, new_data, width * height, compSel)
+
+        else:
+            convertGeneric(formatId, data, new_data, width * height, bpp, compSel)
+
+    return output
+
+
+cpdef rgb8torgbx8(const u8[::1] data, output=None):
+    cdef u32 numPixels = len(data) // 3
+
+    if output is None:
+        output = bytearray(numPixels * 4)
+
+    cdef:
+        u8[::1] new_data = output
         u32 i
 
-    try:
-        for i in range(numPixels):
-            new_data[4 * i + 0] = data[3 * i + 0]
-            new_data[4 * i + 1] = data[3 * i + 1]
-            new_data[4 * i + 2] = data[3 * i + 2]
-            new_data[4 * i + 3] = 0xFF
+    assert len(new_data) >= numPixels * 4
 
-        return bytes(<u8[:numPixels * 4]>new_data)
+    for i in range(numPixels):
+        new_data[4 * i + 0] = data[3 * i + 0]
+        new_data[4 * i + 1] = data[3 * i + 1]
+        new_data[4 * i + 2] = data[3 * i + 2]
+        new_data[4 * i + 3] = 0xFF
 
-    finally:
-        free(new_data)
+    return output
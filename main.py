@@ -1,6 +1,7 @@
 from collections import OrderedDict
 import os
 
+import bcn
 from common import dictToXml, Head
 from flyt import Layout
 from flan import main as flanMain
@@ -9,6 +10,7 @@ from flan import main as flanMain
 def main():
     print("Layout Exporter U v1.0.0")
     print("(C) 2019 AboodXD\n")
+    print("BCn decoder: %s\n" % bcn.tier)
 
     file = input("Input (.bflyt):  ")
     output = input("Output (.flyt):  ")
@@ -29,11 +31,11 @@ def main():
             if _file.startswith(fileName + "_"):
                 files.append(_file)
 
-    textures, formats = None, None
+    textures, formats, refTextures = None, None, None
     if files:
-        textures, formats = flanMain(files, animPath, animOutput)
+        textures, formats, refTextures = flanMain(files, animPath, animOutput)
 
-    lyt = Layout(file, timgPath, timgOutP, textures, formats)
+    lyt = Layout(file, timgPath, timgOutP, textures, formats, refTextures)
 
     file = {}
     file["nw4f_layout"] = OrderedDict()
@@ -0,0 +1,111 @@
+# Checks the Cython and NumPy swizzlers against the per-pixel Python one
+
+import random
+import unittest
+
+import addrlib
+from addrlib import addrlib as reference
+
+
+def getTiers():
+    tiers = []
+
+    try:
+        from addrlib import addrlib_cy
+        tiers.append(addrlib_cy)
+
+    except ImportError:
+        pass
+
+    try:
+        from addrlib import addrlib_np
+        tiers.append(addrlib_np)
+
+    except ImportError:
+        pass
+
+    return tiers
+
+
+tiers = getTiers()
+
+# L8, LA8, RGBA8, BGR10A2, BC1, BC5
+formats = (0x01, 0x07, 0x1a, 0x19, 0x31, 0x35)
+
+sizes = ((37, 21), (64, 64))
+
+
+def iterSurfaces(seed=1):
+    rand = random.Random(seed)
+
+    for format_ in formats:
+        for tileMode in range(1, 17):
+            for width, height in sizes:
+                surfOut = reference.getSurfaceInfo(format_, width, height, 1, 1, tileMode, 0, 0)
+                data = rand.randbytes(surfOut.surfSize)
+
+                for swizzle in (0, 0x500):
+                    yield format_, tileMode, swizzle, width, height, surfOut, data
+
+
+class TestAddrlib(unittest.TestCase):
+    def test_deswizzle(self):
+        for format_, tileMode, swizzle, width, height, surfOut, data in iterSurfaces():
+            args = (width, height, 1, format_, 0, 1, tileMode, swizzle, surfOut.pitch, surfOut.bpp, 0, 0)
+            expected = reference.deswizzle(*args, data)
+
+            for tier in tiers:
+                with self.subTest(tier=tier.__name__, format=hex(format_), tileMode=tileMode, swizzle=swizzle, size=(width, height)):
+                    self.assertEqual(bytes(tier.deswizzle(*args, data)), bytes(expected))
+
+    def test_swizzle_roundtrip(self):
+        for format_, tileMode, swizzle, width, height, surfOut, data in iterSurfaces(2):
+            args = (width, height, 1, format_, 0, 1, tileMode, swizzle, surfOut.pitch, surfOut.bpp, 0, 0)
+
+            # A swizzled surface has zeros where no pixel is stored
+            swizzled = reference.swizzle(*args, reference.deswizzle(*args, data))
+
+            for tier in [reference] + tiers:
+                with self.subTest(tier=tier.__name__, format=hex(format_), tileMode=tileMode, swizzle=swizzle, size=(width, height)):
+                    self.assertEqual(bytes(tier.swizzle(*args, tier.deswizzle(*args, swizzled))), bytes(swizzled))
+
+    def test_deswizzle_bands(self):
+        for format_, tileMode, swizzle, width, height, surfOut, data in iterSurfaces(3):
+            args = (width, height, 1, format_, 0, 1, tileMode, swizzle, surfOut.pitch, surfOut.bpp, 0, 0)
+            expected = bytes(reference.deswizzle(*args, data))
+
+            # Rows of elements, a row of BCn blocks holds 4 rows of pixels
+            elemHeight = 4 if format_ in (0x31, 0x35) else 1
+            rowSize = (width + elemHeight - 1) // elemHeight * surfOut.bpp // 8
+
+            for tier in [reference] + tiers:
+                for firstRow in range(0, height, 16):
+                    numRows = min(16, height - firstRow)
+                    start = firstRow // elemHeight * rowSize
+                    end = start + (numRows + elemHeight - 1) // elemHeight * rowSize
+
+                    band = bytearray(end - start)
+                    tier.deswizzle(*args, data, band, firstRow, numRows)
+
+                    with self.subTest(tier=tier.__name__, format=hex(format_), tileMode=tileMode, swizzle=swizzle, size=(width, height), firstRow=firstRow):
+                        self.assertEqual(bytes(band), expected[start:end])
+
+    def test_getSurfaceAddrs(self):
+        for format_, tileMode, swizzle, width, height, surfOut, data in iterSurfaces(4):
+            for dataSize in (len(data), len(data) // 2):
+                args = (width, height, 1, format_, 0, 1, tileMode, swizzle, surfOut.pitch, surfOut.bpp, 0, 0, dataSize)
+                expected = list(reference.getSurfaceAddrs(*args))
+
+                for tier in tiers:
+                    with self.subTest(tier=tier.__name__, format=hex(format_), tileMode=tileMode, swizzle=swizzle, size=(width, height), dataSize=dataSize):
+                        self.assertEqual(list(tier.getSurfaceAddrs(*args)), expected)
+                        self.assertEqual(list(tier.getSurfaceAddrs(*args, 16, 16)), list(reference.getSurfaceAddrs(*args, 16, 16)))
+
+    def test_package_tier(self):
+        # The package exports the fastest tier that could be imported
+        if tiers:
+            self.assertIs(addrlib.deswizzle, tiers[0].deswizzle)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# Checks the Cython and NumPy BCn decoders against the per-texel Python one
+
+import random
+import unittest
+from array import array
+
+import bcn
+from bcn import decompress_ as reference
+
+
+def getTiers():
+    tiers = []
+
+    try:
+        from bcn import decompress_cy
+        tiers.append(decompress_cy)
+
+    except ImportError:
+        pass
+
+    try:
+        from bcn import decompress_np
+        tiers.append(decompress_np)
+
+    except ImportError:
+        pass
+
+    return tiers
+
+
+tiers = getTiers()
+
+# Name, block size and SNORM of the decoders
+decoders = (
+    ("DXT1", 8, None),
+    ("DXT3", 16, None),
+    ("DXT5", 16, None),
+    ("BC4", 8, 0),
+    ("BC4", 8, 1),
+    ("BC5", 16, 0),
+    ("BC5", 16, 1),
+)
+
+sizes = ((4, 4), (13, 29), (64, 16))
+
+
+def decompress(tier, name, SNORM, data, width, height, blockAddrs=None, stats=None):
+    func = getattr(tier, "decompress" + name)
+    data = memoryview(data)
+
+    if blockAddrs is not None:
+        blockAddrs = memoryview(blockAddrs)
+
+    if SNORM is None:
+        return func(data, width, height, None, blockAddrs, stats)
+
+    return func(data, width, height, SNORM, None, blockAddrs, stats)
+
+
+def makeBlocks(rand, numBlocks, blockSize):
+    # Runs of identical blocks, like the flat regions the decoders skip
+    blocks = []
+    while len(blocks) < numBlocks:
+        blocks.extend([rand.randbytes(blockSize)] * rand.choice((1, 1, 2, 5)))
+
+    return b''.join(blocks[:numBlocks])
+
+
+class TestBCn(unittest.TestCase):
+    def test_decompress(self):
+        rand = random.Random(1)
+
+        for name, blockSize, SNORM in decoders:
+            for width, height in sizes:
+                numBlocks = ((width + 3) // 4) * ((height + 3) // 4)
+                data = makeBlocks(rand, numBlocks, blockSize)
+
+                expectedStats = {"blocks": 0, "reused": 0}
+                expected = bytes(decompress(reference, name, SNORM, data, width, height, stats=expectedStats))
+                self.assertEqual(expectedStats["blocks"], numBlocks)
+
+                for tier in tiers:
+                    with self.subTest(tier=tier.__name__, format=name, SNORM=SNORM, size=(width, height)):
+                        stats = {"blocks": 0, "reused": 0}
+                        self.assertEqual(bytes(decompress(tier, name, SNORM, data, width, height, stats=stats)), expected)
+                        self.assertEqual(stats, expectedStats)
+
+    def test_decompress_blockAddrs(self):
+        rand = random.Random(2)
+
+        for name, blockSize, SNORM in decoders:
+            for width, height in sizes:
+                numBlocks = ((width + 3) // 4) * ((height + 3) // 4)
+                data = makeBlocks(rand, numBlocks, blockSize)
+
+                order = list(range(numBlocks))
+                rand.shuffle(order)
+
+                # Reading the blocks through their addresses is the same as reading them reordered
+                blockAddrs = array('I', [i * blockSize for i in order])
+                reordered = b''.join(data[i * blockSize:(i + 1) * blockSize] for i in order)
+
+                expected = bytes(decompress(reference, name, SNORM, reordered, width, height))
+                self.assertEqual(bytes(decompress(reference, name, SNORM, data, width, height, blockAddrs)), expected)
+
+                # Blocks out of the data are decoded as zeros
+                blockAddrs[-1] = 0xFFFFFFFF
+                expected = bytes(decompress(reference, name, SNORM, data, width, height, blockAddrs))
+
+                for tier in tiers:
+                    with self.subTest(tier=tier.__name__, format=name, SNORM=SNORM, size=(width, height)):
+                        self.assertEqual(bytes(decompress(tier, name, SNORM, data, width, height, blockAddrs)), expected)
+
+    def test_package_checks(self):
+        # Incomplete data is refused by the package instead of read out of bounds
+        self.assertEqual(bcn.decompressDXT1(b'\0' * 8, 8, 8), b'')
+        self.assertEqual(bcn.decompressBC5(b'\0' * 16, 4, 4, blockAddrs=array('I')), b'')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+# Checks the fused, banded and threaded BFLIM conversions and the TGA/PNG writers
+# against deswizzling and decoding the whole texture with the Python modules
+
+import os
+import random
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import bcn
+import bflim
+import gx2FormConv
+from addrlib import addrlib as addrlibReference
+from bcn import decompress_ as bcnReference
+
+# FLIM format codes supported by readFLIM()
+flimFormats = (0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x07, 0x08, 0x09,
+               0x0c, 0x0d, 0x0e, 0x0f, 0x10, 0x11, 0x14, 0x15, 0x16, 0x17, 0x19)
+
+tileModes = (1, 2, 4, 7, 12, 16)
+
+sizes = ((13, 29), (64, 40))
+
+
+def makeFLIM(rand, formatCode, width, height, tileMode, swizzle):
+    """
+    Returns a little endian BFLIM with random image data.
+    """
+
+    flim = bflim.readFLIMHeader(struct.pack('<4s2H2IH2x4sI3H2BI', b'FLIM', 0xFEFF, 0x14, 0x2020000, 0x28, 1,
+                                            b'imag', 0x10, width, height, 0x200, formatCode, tileMode, 0))
+
+    surfOut = addrlibReference.getSurfaceInfo(flim.format, width, height, 1, 1, tileMode, 0, 0)
+    data = rand.randbytes(surfOut.surfSize)
+
+    return data + struct.pack('<4s2H2IH2x4sI3H2BI', b'FLIM', 0xFEFF, 0x14, 0x2020000, len(data) + 0x28, 1,
+                              b'imag', 0x10, width, height, 0x200, formatCode, tileMode | swizzle << 5, len(data))
+
+
+def referenceToRGBA8(flim):
+    # Whole texture, per-pixel deswizzling and Python decoders
+    deswizzled = addrlibReference.deswizzle(flim.width, flim.height, 1, flim.format, 0, 1, flim.surfOut.tileMode,
+                                            flim.swizzle, flim.pitch, flim.surfOut.bpp, 0, 0, flim.data)
+
+    with mock.patch.object(bcn, "decompress_", bcnReference), mock.patch.object(bflim, "formConv", gx2FormConv):
+        return bytes(bflim.texureToRGBA8(flim.width, flim.height, flim.format, deswizzled, flim.compSel))
+
+
+def iterTextures(seed=1):
+    rand = random.Random(seed)
+
+    for formatCode in flimFormats:
+        for tileMode in tileModes:
+            for width, height in sizes:
+                f = makeFLIM(rand, formatCode, width, height, tileMode, rand.randrange(8))
+                yield (formatCode, tileMode, width, height), f
+
+
+def readTGA(path):
+    """
+    Returns the width, height and top-down RGBA8 pixels of a TGA written by writeTGA().
+    """
+
+    with open(path, "rb") as inf:
+        f = inf.read()
+
+    _, _, imageType, _, _, _, _, _, width, height, _, descriptor = struct.unpack_from('<3B2HB4H2B', f)
+    body = f[18:]
+
+    if imageType == 2:
+        pixels = body[:width * height * 4]
+
+    else:
+        pixels = bytearray()
+        pos = 0
+
+        while len(pixels) < width * height * 4:
+            header = body[pos]
+            count = (header & 0x7F) + 1
+            pos += 1
+
+            if header & 0x80:
+                pixels += body[pos:pos + 4] * count
+                pos += 4
+
+            else:
+                pixels += body[pos:pos + count * 4]
+                pos += count * 4
+
+    rows = [pixels[y * width * 4:(y + 1) * width * 4] for y in range(height)]
+
+    # Bottom-left origin
+    if not descriptor & 0x20:
+        rows.reverse()
+
+    rgba = bytearray(b''.join(rows))
+    rgba[0::4], rgba[2::4] = rgba[2::4], rgba[0::4]
+
+    return width, height, bytes(rgba)
+
+
+def readPNG(path):
+    """
+    Returns the width, height and RGBA8 pixels of an unfiltered PNG written by writePNG().
+    """
+
+    with open(path, "rb") as inf:
+        f = inf.read()
+
+    pos = 8
+    idat = b''
+
+    while pos < len(f):
+        size, type_ = struct.unpack_from('>I4s', f, pos)
+        chunk = f[pos + 8:pos + 8 + size]
+        pos += size + 12
+
+        if type_ == b'IHDR':
+            width, height = struct.unpack_from('>2I', chunk)
+
+        elif type_ == b'IDAT':
+            idat += chunk
+
+    raw = zlib.decompress(idat)
+    rowSize = width * 4 + 1
+
+    return width, height, b''.join(raw[y * rowSize + 1:(y + 1) * rowSize] for y in range(height))
+
+
+class TestBFLIM(unittest.TestCase):
+    def test_tiledToRGBA8(self):
+        for params, f in iterTextures():
+            flim = bflim.readFLIM(f)
+            expected = referenceToRGBA8(flim)
+
+            with self.subTest(params=params):
+                self.assertEqual(bytes(bflim.tiledToRGBA8(flim)), expected)
+
+                bands = [bytes(bflim.tiledToRGBA8(flim, y, numRows)) for y, numRows in bflim.getBands(flim, 8)]
+                self.assertEqual(b''.join(bands), expected)
+
+                self.assertEqual(bytes(bflim.threadedTiledToRGBA8(flim, 3, 8)), expected)
+
+                bands = [bytes(data) for _, _, data in bflim.iterRGBA8Bands(flim, 8, 3)]
+                self.assertEqual(b''.join(bands), expected)
+
+    def test_writers(self):
+        with tempfile.TemporaryDirectory() as texPath, \
+             mock.patch.object(bflim, "bandedMinPixels", 512), mock.patch.object(bflim, "bandThreads", 2):
+
+            for params, f in iterTextures(2):
+                flim = bflim.readFLIM(f)
+                expected = (flim.width, flim.height, referenceToRGBA8(flim))
+
+                for rle in (False, True):
+                    with self.subTest(params=params, rle=rle), mock.patch.object(bflim, "tgaRLE", rle):
+                        bflim.toTGA(f, "texture", texPath)
+                        self.assertEqual(readTGA(os.path.join(texPath, "texture.tga")), expected)
+
+                with self.subTest(params=params, png=True):
+                    bflim.toPNG(f, "texture", texPath)
+                    self.assertEqual(readPNG(os.path.join(texPath, "texture.png")), expected)
+
+    def test_dedupe_stats(self):
+        # The counters of a texture don't depend on how many threads converted its bands
+        rand = random.Random(3)
+        f = makeFLIM(rand, 0x0c, 128, 128, 4, 0)
+
+        with tempfile.TemporaryDirectory() as texPath, mock.patch.object(bflim, "bandedMinPixels", 1):
+            results = []
+
+            for numThreads in (1, 4):
+                with mock.patch.object(bflim, "bandThreads", numThreads):
+                    results.append(bflim.toTGA(f, "texture", texPath))
+
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0]["blocks"], 32 * 32)
+
+
+if __name__ == "__main__":
+    unittest.main()